@@ -59,6 +59,17 @@ let apiState = {
   isProcessing: false
 };
 
+// Practice session ID so the server keeps smoothing state per user
+let practiceSessionId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+
+/**
+ * Start a new practice session (resets server-side keypoint smoothing)
+ */
+export const startPracticeSession = () => {
+  practiceSessionId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+  return practiceSessionId;
+};
+
 // Result tracking for smooth transitions
 let lastResponse = {
   keypoints: null,
@@ -66,6 +77,21 @@ let lastResponse = {
   timestamp: 0
 };
 
+/**
+ * Whether frame data is a local file URI (uploaded as binary) rather than base64
+ */
+const isFileUri = (imageData) =>
+  typeof imageData === 'string' && /^(file|content|ph|assets-library):\/\//.test(imageData);
+
+/**
+ * Build a multipart body for the binary frame endpoints
+ */
+const buildFrameUpload = (uri) => {
+  const formData = new FormData();
+  formData.append('image', { uri, type: 'image/jpeg', name: 'frame.jpg' });
+  return formData;
+};
+
 /**
  * Throttled function to process pose frames. This prevents overwhelming
  * the backend with too many API calls.
@@ -124,7 +150,8 @@ export const processFrame = throttle(async (imageData, poseId) => {
     }
     
     // Add proper data URI prefix if missing
-    if (!imageData.startsWith('data:image/')) {
+    const binaryUpload = isFileUri(imageData);
+    if (!binaryUpload && !imageData.startsWith('data:image/')) {
       imageData = `data:image/jpeg;base64,${imageData}`;
     }
     
@@ -138,21 +165,36 @@ export const processFrame = throttle(async (imageData, poseId) => {
     const timeoutMs = 3000 + Math.min(apiState.failedAttempts * 500, 2000);
     
     try {
-      // Send to backend with appropriate timeout
-      const response = await axios.post(
-        `${API_BASE_URL}/api/yoga/pose-estimation`,
-        {
-          image: imageData,
-          poseId: poseId
-        },
-        { 
-          timeout: timeoutMs,
-          headers: {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
+      // Send to backend with appropriate timeout. File URIs go to the binary
+      // endpoint as multipart, which avoids the base64 JSON overhead.
+      const response = binaryUpload
+        ? await axios.post(
+          `${API_BASE_URL}/api/yoga/pose-estimation/frame`,
+          buildFrameUpload(imageData),
+          {
+            timeout: timeoutMs,
+            params: { poseId, sessionId: practiceSessionId },
+            headers: {
+              'Content-Type': 'multipart/form-data',
+              'Accept': 'application/json'
+            }
           }
-        }
-      );
+        )
+        : await axios.post(
+          `${API_BASE_URL}/api/yoga/pose-estimation`,
+          {
+            image: imageData,
+            poseId: poseId,
+            sessionId: practiceSessionId
+          },
+          { 
+            timeout: timeoutMs,
+            headers: {
+              'Content-Type': 'application/json',
+              'Accept': 'application/json'
+            }
+          }
+        );
       
       console.log(`📡 Server response status: ${response.status}`);
       
@@ -275,16 +317,27 @@ export const getLLMFeedback = throttle(async (imageData, poseId, keypoints, isFi
     console.log(`Getting feedback for pose ${poseId}, final=${isFinal}`);
     
     // Send to backend (with a longer timeout for LLM processing)
-    const response = await axios.post(
-      `${API_BASE_URL}/api/yoga/posture-feedback`,
-      {
-        image: imageData,
-        poseId: poseId,
-        isFinal,
-        keypoints
-      },
-      { timeout: 10000 } // 10 second timeout for LLM processing
-    );
+    const response = isFileUri(imageData)
+      ? await axios.post(
+        `${API_BASE_URL}/api/yoga/posture-feedback/frame`,
+        buildFrameUpload(imageData),
+        {
+          timeout: 10000, // 10 second timeout for LLM processing
+          params: { poseId, isFinal, sessionId: practiceSessionId },
+          headers: { 'Content-Type': 'multipart/form-data' }
+        }
+      )
+      : await axios.post(
+        `${API_BASE_URL}/api/yoga/posture-feedback`,
+        {
+          image: imageData,
+          poseId: poseId,
+          isFinal,
+          keypoints,
+          sessionId: practiceSessionId
+        },
+        { timeout: 10000 } // 10 second timeout for LLM processing
+      );
     
     if (response.data && response.data.success && response.data.data.feedback) {
       console.log('Feedback received from server');
@@ -378,4 +431,64 @@ export const getReferencePoseKeypoints = async (poseId) => {
     return DEFAULT_POSE_KEYPOINTS[poseId];
   }
   return DEFAULT_POSE_KEYPOINTS['1-1']; // Default to mountain pose
-};
\ No newline at end of file
+};
+/**
+ * Open a WebSocket stream for continuous pose feedback.
+ *
+ * Frames are sent as binary JPEG data; the server always processes the newest
+ * frame and drops stale ones, so frames can be sent as fast as the camera
+ * produces them. Keypoint smoothing is kept for the life of the stream.
+ *
+ * @param {string} poseId - Initial pose ID
+ * @param {object} handlers - { onConfig, onPose, onFeedback, onError, onClose }
+ * @returns {object} { sendFrame(uriOrBase64), setPose(poseId, trimester), end(), close() }
+ */
+export const openPoseStream = (poseId, handlers = {}) => {
+  const wsUrl = `${API_BASE_URL.replace(/^http/, 'ws')}/api/yoga/pose-stream?poseId=${encodeURIComponent(poseId)}`;
+  const socket = new WebSocket(wsUrl);
+  socket.binaryType = 'arraybuffer';
+  
+  socket.onmessage = (event) => {
+    try {
+      const message = JSON.parse(event.data);
+      const handler = {
+        config: handlers.onConfig,
+        pose: handlers.onPose,
+        feedback: handlers.onFeedback,
+        error: handlers.onError
+      }[message.type];
+      if (handler) {
+        handler(message.data);
+      }
+    } catch (error) {
+      console.warn('Invalid pose stream message:', error);
+    }
+  };
+  socket.onerror = (event) => handlers.onError && handlers.onError({ error: event.message });
+  socket.onclose = () => handlers.onClose && handlers.onClose();
+  
+  return {
+    sendFrame: async (imageData) => {
+      if (socket.readyState !== WebSocket.OPEN) {
+        return;
+      }
+      // Read the captured file as bytes; base64 frames are converted locally
+      const source = isFileUri(imageData) || imageData.startsWith('data:image/')
+        ? imageData
+        : `data:image/jpeg;base64,${imageData}`;
+      const frame = await (await fetch(source)).arrayBuffer();
+      socket.send(frame);
+    },
+    setPose: (newPoseId, trimester) => {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'config', poseId: newPoseId, trimester }));
+      }
+    },
+    end: () => {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'end' }));
+      }
+    },
+    close: () => socket.close()
+  };
+};
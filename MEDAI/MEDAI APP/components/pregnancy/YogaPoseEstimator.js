@@ -23,7 +23,8 @@ import {
   processFrame,
   getLLMFeedback,
   resetPoseData,
-  getReferencePoseKeypoints
+  getReferencePoseKeypoints,
+  startPracticeSession
 } from './PoseDetectionService';
 import ThreeJsReferenceModel from './ThreeJsReferenceModel';
 
@@ -233,24 +234,21 @@ const YogaPoseEstimator = ({ pose, onClose, onComplete }) => {
       
       const photo = await cameraRef.current.takePictureAsync({
         quality: 0.5,        // Medium quality is sufficient
-        base64: true,        // We need base64 for API
+        base64: false,       // Frame is uploaded as a binary file
         exif: false,         // Don't need exif data
         skipProcessing: true, // Skip additional processing for speed
         shutterSound: false // Disable shutter sound
       });
       
-      if (!photo || !photo.base64) {
-        console.error("❌ Failed to capture photo or get base64 data");
+      if (!photo || !photo.uri) {
+        console.error("❌ Failed to capture photo");
         return;
       }
       
-      console.log(`📊 Image captured: ${photo.width}x${photo.height}, base64 length: ${photo.base64.length} chars`);
+      console.log(`📊 Image captured: ${photo.width}x${photo.height}`);
       
-      // Add proper data URI prefix if missing
-      let imageData = photo.base64;
-      if (!imageData.startsWith('data:image/')) {
-        imageData = `data:image/jpeg;base64,${imageData}`;
-      }
+      // Local file URI, sent to the server's binary frame endpoint
+      const imageData = photo.uri;
       
       // Send to API and get results
       console.log(`🔄 Sending frame to API for pose ${pose.id}...`);
@@ -291,6 +289,9 @@ const YogaPoseEstimator = ({ pose, onClose, onComplete }) => {
   const startAnalysis = () => {
     console.log('Start analysis button clicked, setting stage to practice');
     
+    // Each practice gets its own server-side smoothing and tracking state
+    startPracticeSession();
+    
     // Just change stage to practice - actual analysis will start 
     // when cameraReady effect triggers
     setStage('practice');
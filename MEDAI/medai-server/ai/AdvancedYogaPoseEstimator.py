@@ -15,26 +15,34 @@ import cv2
 import json
 import logging
 import time
-from typing import Dict, List, Tuple, Any, Optional
+import threading
+from typing import Dict, List, Tuple, Any, Optional, Union, NamedTuple, BinaryIO
 import requests
-from PIL import Image
-from io import BytesIO
-import tensorflow as tf
-import tensorflow_hub as hub
-from scipy.ndimage import gaussian_filter1d
+from ai.model_registry import mediapipe_pose_complexity, model_status
+from ai.pose_frame import (KEYPOINT_NAMES, KEYPOINT_INDEX, NUM_KEYPOINTS, PoseFrame,
+                           angle_triplet_indices, joint_angles)
+from ai.pose_tracking import (PoseTrackerStore, SMOOTHING_MIN_HISTORY, MOTION_GATE_THRESHOLD,
+                               MOTION_GATE_MAX_REUSE, MOTION_GATE_MAX_AGE, motion_signature)
+from ai.inference_batcher import InferenceBatcher
+from ai.pose_backends import create_backend
+from ai.pose_cropping import (CropRegion, FULL_FRAME, crop_decode_size, crop_to_input,
+                               next_crop_region, torso_visible, uncrop_keypoints)
+from ai.preprocessing import decode_image, letterbox, load_letterboxed
 os.environ['TF_GRAPPLER_DISABLE'] = '1'
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# MoveNet keypoint names and connections for visualization
-KEYPOINT_NAMES = [
-    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
-    'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
-    'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
-    'left_knee', 'right_knee', 'left_ankle', 'right_ankle'
-]
+MOVENET_INPUT_SIZE = 256
+# Batch concurrent MoveNet calls through a shared scheduler (set to 0 to disable)
+POSE_BATCHING_ENABLED = os.environ.get('POSE_BATCHING', '1') != '0'
+# Crop session frames around the subject found in the previous frame (set to 0 to disable)
+POSE_CROP_TRACKING_ENABLED = os.environ.get('POSE_CROP_TRACKING', '1') != '0'
+# Cropped results with a lower mean keypoint score are re-run on the full frame
+POSE_CROP_MIN_SCORE = float(os.environ.get('POSE_CROP_MIN_SCORE', 0.25))
+# Refuse to start without MoveNet instead of falling back to MediaPipe (set to 1 in production)
+POSE_MODEL_REQUIRED = os.environ.get('POSE_MODEL_REQUIRED', '0') == '1'
 
 # Define pose connections for skeleton visualization
 POSE_CONNECTIONS = [
@@ -154,6 +162,95 @@ TRIMESTER_TOLERANCES = {
     'third': 35     # More lenient in third trimester
 }
 
+# Position tolerances for the position-based fallback evaluation
+POSITION_TOLERANCES = {
+    'first': 0.15,   # Stricter in first trimester
+    'second': 0.20,  # Medium tolerance in second trimester
+    'third': 0.25    # More lenient in third trimester
+}
+
+# Importance of each keypoint for position-based evaluation
+POSITION_WEIGHTS = {
+    'left_shoulder': 1.5,
+    'right_shoulder': 1.5,
+    'left_hip': 1.5,
+    'right_hip': 1.5,
+    'left_knee': 1.2,
+    'right_knee': 1.2,
+    'left_ankle': 1.0,
+    'right_ankle': 1.0,
+    'left_elbow': 1.0,
+    'right_elbow': 1.0,
+    'left_wrist': 0.8,
+    'right_wrist': 0.8,
+    'nose': 0.5
+}
+
+# General joint angles reported for a frame (point_a -> point_b (vertex) -> point_c)
+KEY_ANGLE_DEFINITIONS = [
+    ('left_shoulder', 'left_elbow', 'left_wrist', 'left_elbow_angle'),
+    ('right_shoulder', 'right_elbow', 'right_wrist', 'right_elbow_angle'),
+    ('left_hip', 'left_knee', 'left_ankle', 'left_knee_angle'),
+    ('right_hip', 'right_knee', 'right_ankle', 'right_knee_angle'),
+    ('left_shoulder', 'left_hip', 'left_knee', 'left_trunk_angle'),
+    ('right_shoulder', 'right_hip', 'right_knee', 'right_trunk_angle'),
+    ('left_hip', 'right_hip', 'right_knee', 'right_hip_angle'),
+    ('right_hip', 'left_hip', 'left_knee', 'left_hip_angle')
+]
+
+# Readable joint names for feedback messages
+JOINT_DISPLAY_NAMES = {
+    'left_shoulder': 'left shoulder',
+    'right_shoulder': 'right shoulder',
+    'left_elbow': 'left elbow',
+    'right_elbow': 'right elbow',
+    'left_wrist': 'left wrist',
+    'right_wrist': 'right wrist',
+    'left_hip': 'left hip',
+    'right_hip': 'right hip',
+    'left_knee': 'left knee',
+    'right_knee': 'right knee',
+    'left_ankle': 'left ankle',
+    'right_ankle': 'right ankle',
+    'nose': 'head'
+}
+
+
+class CompiledPoseAngles(NamedTuple):
+    """Index arrays for a pose's angle definitions, ready for batched evaluation."""
+    triplets: np.ndarray         # (N, 3) keypoint indices, vertex in the middle
+    expected_values: np.ndarray  # (N,) expected angles in degrees
+    weights: np.ndarray          # (N,) importance weights
+
+
+def _compile_pose_angles(definition: Dict[str, Any]) -> CompiledPoseAngles:
+    count = len(definition['angles'])
+    weights = [definition['weights'][i] if i < len(definition['weights']) else 1.0
+               for i in range(count)]
+    return CompiledPoseAngles(
+        triplets=angle_triplet_indices(definition['angles']),
+        expected_values=np.array(definition['expected_values'][:count], dtype=np.float32),
+        weights=np.array(weights, dtype=np.float32)
+    )
+
+
+COMPILED_POSE_ANGLES = {
+    pose_id: _compile_pose_angles(definition)
+    for pose_id, definition in POSE_ANGLE_DEFINITIONS.items()
+}
+KEY_ANGLE_TRIPLETS = angle_triplet_indices([(a, b, c) for a, b, c, _ in KEY_ANGLE_DEFINITIONS])
+KEY_ANGLE_NAMES = [name for _, _, _, name in KEY_ANGLE_DEFINITIONS]
+
+POSITION_WEIGHT_VECTOR = np.zeros(NUM_KEYPOINTS, dtype=np.float32)
+for _part, _weight in POSITION_WEIGHTS.items():
+    POSITION_WEIGHT_VECTOR[KEYPOINT_INDEX[_part]] = _weight
+
+# Keypoints that should stay inside the camera frame
+FRAME_CHECK_INDICES = np.array([KEYPOINT_INDEX[p] for p in
+                                ['nose', 'left_ankle', 'right_ankle', 'left_wrist', 'right_wrist']])
+
+KeypointsLike = Union[PoseFrame, List[Dict[str, Any]]]
+
 class YogaPoseEstimator:
     """Advanced yoga pose estimator using MoveNet and specialized yoga pose analysis."""
     
@@ -168,10 +265,16 @@ class YogaPoseEstimator:
             enable_smoothing: Whether to use temporal smoothing for more stable visualization
         """
         self._reference_poses = {}  # Cache for reference poses
-        self._keypoint_history = [] # For temporal smoothing
-        self._max_history_size = 5  # Number of frames to keep for smoothing
+        self._reference_frames = {}  # Reference keypoints as PoseFrames, by pose ID
+        self._trackers = PoseTrackerStore()  # Per-session history for temporal smoothing
         self._enable_smoothing = enable_smoothing
         self._model_loaded = False
+        self._model_error = None  # Why MoveNet could not be loaded
+        self._fallback = None  # Detector used instead of MoveNet ('mediapipe' or 'none')
+        self._batcher = None  # Micro-batching scheduler for concurrent MoveNet calls
+        # Frames run vs. skipped by the motion gate, and crop tracking outcomes
+        self._frame_counts = {'inferred': 0, 'reused': 0, 'cropped': 0, 'full_frame_retries': 0}
+        self._frame_counts_lock = threading.Lock()
         self._last_error_time = 0  # For error rate limiting
         
         # Load MoveNet model
@@ -182,18 +285,15 @@ class YogaPoseEstimator:
             else:
                 model_name = "movenet_lightning"
                 
-            # Load model
-            self.model = hub.load(f"https://www.kaggle.com/models/google/movenet/TensorFlow2/singlepose-thunder/4")
-            self.movenet = self.model.signatures['serving_default']
+            # Load model through the configured backend (POSE_BACKEND: tf, tflite, ...)
+            self.backend = create_backend(variant='thunder')
             
             # Verify model works by running inference on a test image
-            test_image = np.zeros((192, 192, 3), dtype=np.uint8)
-
-            image = tf.cast(tf.image.resize_with_pad(test_image, 256, 256), dtype=tf.int32)
+            test_image = np.zeros((MOVENET_INPUT_SIZE, MOVENET_INPUT_SIZE, 3), dtype=np.uint8)
 
 
             print("I RAN TILL HERE")
-            self._run_inference_on_image(image)
+            self._run_inference_on_image(test_image)
 
             # print("LOAD CLASSIFICATION MODEL")
 
@@ -209,12 +309,21 @@ class YogaPoseEstimator:
 
 
             
-            logger.info(f"Loaded MoveNet {model_name} model successfully")
+            logger.info(f"Loaded MoveNet {model_name} model successfully ({self.backend.name} backend)")
             self._model_loaded = True
             
+            if POSE_BATCHING_ENABLED:
+                self._batcher = InferenceBatcher(self.backend.infer_batch, name='movenet-batcher')
+                logger.info("MoveNet micro-batching enabled")
+            
         except Exception as e:
+            self._model_error = str(e)
+            if POSE_MODEL_REQUIRED:
+                raise RuntimeError(f"MoveNet model is required (POSE_MODEL_REQUIRED=1) but failed to load: {e}") from e
             logger.error(f"Failed to load MoveNet model: {e}")
-            logger.info("Will use fallback mechanisms for pose detection")
+            logger.error("Pose detection is DEGRADED: falling back to MediaPipe; see /api/metrics "
+                         "and run 'python -m ai.model_registry fetch thunder'")
+            self._fallback = 'none'
             
             # Initialize MediaPipe as fallback
             try:
@@ -222,10 +331,11 @@ class YogaPoseEstimator:
                 self.mp_pose = mp.solutions.pose
                 self.mp_pose_detector = self.mp_pose.Pose(
                     static_image_mode=True,
-                    model_complexity=model_complexity,
+                    model_complexity=mediapipe_pose_complexity(model_complexity),
                     enable_segmentation=False,
                     min_detection_confidence=0.5
                 )
+                self._fallback = 'mediapipe'
                 logger.info("Initialized MediaPipe Pose as fallback")
             except Exception as mp_error:
                 logger.error(f"Failed to initialize MediaPipe fallback: {mp_error}")
@@ -274,64 +384,76 @@ class YogaPoseEstimator:
         Run MoveNet inference on an image.
         
         Args:
-            image: Input image as numpy array (RGB format)
+            image: Preprocessed input image as numpy array (RGB format)
             
         Returns:
             Array of keypoints [y, x, confidence] for each of the 17 keypoints
         """
-        # Convert to tensor, add batch dimension, and ensure int32 dtype
-
-        image_test = tf.cast(tf.image.resize_with_pad(image, 256, 256), dtype=tf.int32)
-        input_image = tf.cast(tf.expand_dims(image_test, axis=0), dtype=tf.int32)
-        
-        # Run inference
-        outputs = self.movenet(input_image)
-        
-        # Extract keypoints from output
-        keypoints = outputs['output_0'].numpy().squeeze()
+        return self.backend.infer(image)
+    
+    def _infer_keypoints(self, image: np.ndarray) -> np.ndarray:
+        """Run MoveNet on one image, through the batcher when it is enabled."""
+        if self._batcher is not None and image.shape == (MOVENET_INPUT_SIZE, MOVENET_INPUT_SIZE, 3):
+            return self._batcher.infer(image)
+        return self._run_inference_on_image(image)
+    
+    def inference_metrics(self) -> Dict[str, Any]:
+        """Throughput and latency metrics for MoveNet inference."""
+        with self._frame_counts_lock:
+            counts = dict(self._frame_counts)
+        inferred, reused = counts['inferred'], counts['reused']
+        motion_gate = {
+            'threshold': MOTION_GATE_THRESHOLD,
+            'max_reuse': MOTION_GATE_MAX_REUSE,
+            'max_age': MOTION_GATE_MAX_AGE,
+            'inferred_frames': inferred,
+            'reused_frames': reused,
+            'reuse_rate': reused / (inferred + reused) if inferred + reused else 0.0
+        }
+        crop_tracking = {
+            'enabled': POSE_CROP_TRACKING_ENABLED,
+            'cropped_frames': counts['cropped'],
+            'full_frame_retries': counts['full_frame_retries']
+        }
         
-        return keypoints
+        model = {
+            'model_loaded': self._model_loaded,
+            'model_error': self._model_error,
+            'fallback': self._fallback,
+            'movenet': model_status('thunder')
+        }
+        if self._batcher is None:
+            return {
+                'batching': False,
+                **model,
+                'backend': self.backend.name if self._model_loaded else None,
+                'motion_gate': motion_gate,
+                'crop_tracking': crop_tracking
+            }
+        return {
+            'batching': True,
+            **model,
+            'backend': self.backend.name,
+            'max_batch_size': self._batcher.max_batch_size,
+            'window_ms': self._batcher.window * 1000,
+            'motion_gate': motion_gate,
+            'crop_tracking': crop_tracking,
+            **self._batcher.stats.snapshot()
+        }
     
-    def preprocess_image(self, image_data: bytes) -> np.ndarray:
+    def preprocess_image(self, image_data: Union[bytes, BinaryIO]) -> np.ndarray:
         """
         Preprocess image data for the pose model.
         
         Args:
-            image_data: JPEG/PNG image data as bytes
+            image_data: JPEG/PNG image data as bytes or a binary file object
             
         Returns:
-            Preprocessed image as numpy array
+            Letterboxed 256x256 RGB image (a per-thread buffer reused by the next call)
         """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(BytesIO(image_data))
-            
-            # Convert to RGB (in case of RGBA or other formats)
-            image = image.convert('RGB')
-            
-            # Convert to numpy array
-            image_np = np.array(image)
-            
-            # Resize to appropriate input size for model (maintain aspect ratio)
-            input_size = 256
-            height, width = image_np.shape[:2]
-            
-            # Calculate resize dimensions
-            if height > width:
-                new_height = input_size
-                new_width = int(width * (input_size / height))
-            else:
-                new_width = input_size
-                new_height = int(height * (input_size / width))
-            
-            # Resize image
-            image_np = cv2.resize(image_np, (new_width, new_height))
-            
-            # Create square image with padding
-            square_image = np.zeros((input_size, input_size, 3), dtype=np.uint8)
-            offset_x = (input_size - new_width) // 2
-            offset_y = (input_size - new_height) // 2
-            square_image[offset_y:offset_y+new_height, offset_x:offset_x+new_width] = image_np
+            # Decode at reduced scale and letterbox into this thread's reusable buffer
+            square_image, _ = load_letterboxed(image_data, MOVENET_INPUT_SIZE)
             
             return square_image
             
@@ -343,49 +465,96 @@ class YogaPoseEstimator:
                 self._last_error_time = current_time
             
             # Return a black image of valid size
-            return np.zeros((256, 256, 3), dtype=np.uint8)
+            return np.zeros((MOVENET_INPUT_SIZE, MOVENET_INPUT_SIZE, 3), dtype=np.uint8)
+    
+    def decode_frame(self, image_data: Union[bytes, BinaryIO], crop_region: CropRegion) -> np.ndarray:
+        """
+        Decode a full frame for crop tracking, at the resolution its crop region needs.
+        
+        Args:
+            image_data: JPEG/PNG image data as bytes or a binary file object
+            crop_region: Session's crop region for this frame
+            
+        Returns:
+            Full RGB frame (at reduced scale when the crop allows it)
+        """
+        try:
+            return decode_image(image_data, min_size=crop_decode_size(crop_region, MOVENET_INPUT_SIZE))
+        except Exception as e:
+            current_time = time.time()
+            if current_time - self._last_error_time > 5:  # Rate limit error logs
+                logger.error(f"Error decoding frame: {str(e)}")
+                self._last_error_time = current_time
+            return np.zeros((MOVENET_INPUT_SIZE, MOVENET_INPUT_SIZE, 3), dtype=np.uint8)
+    
+    def _count_frame(self, outcome: str):
+        with self._frame_counts_lock:
+            self._frame_counts[outcome] += 1
+    
+    def _infer_keypoints_tracked(self, image: np.ndarray, tracker) -> np.ndarray:
+        """
+        Run MoveNet on a session's crop of a full frame.
+        
+        The crop comes from the keypoints of the session's previous frame. If the
+        torso is lost or the keypoint scores drop, the frame is run again on the
+        whole image, and the next crop is derived from that result.
+        
+        Args:
+            image: Full RGB frame (from decode_frame)
+            tracker: The session's PoseTracker
+            
+        Returns:
+            Array of keypoints [y, x, confidence] in letterbox coordinates
+        """
+        height, width = image.shape[:2]
+        with tracker.lock:
+            region = tracker.crop_region
+        
+        if region != FULL_FRAME:
+            crop = crop_to_input(image, region, MOVENET_INPUT_SIZE)
+            keypoints = uncrop_keypoints(self._infer_keypoints(crop), region)
+            if torso_visible(keypoints) and keypoints[:, 2].mean() >= POSE_CROP_MIN_SCORE:
+                self._count_frame('cropped')
+                with tracker.lock:
+                    tracker.crop_region = next_crop_region(keypoints, width, height)
+                return keypoints
+            # Lost the subject, look for it in the whole frame again
+            self._count_frame('full_frame_retries')
+        
+        square_image, _ = letterbox(image, MOVENET_INPUT_SIZE)
+        keypoints = self._infer_keypoints(square_image)
+        with tracker.lock:
+            tracker.crop_region = next_crop_region(keypoints, width, height)
+        return keypoints
     
-    def detect_pose(self, image: np.ndarray) -> List[Dict[str, Any]]:
+    def detect_pose(self, image: np.ndarray, session_id: Optional[str] = None) -> PoseFrame:
         """
         Detect pose keypoints in an image.
         
         Args:
-            image: Preprocessed image as numpy array
+            image: Preprocessed image as numpy array, or a full frame from
+                   decode_frame to run on the session's tracked crop
+            session_id: Practice session the frame belongs to (used for smoothing and crop tracking)
             
         Returns:
-            List of keypoint dictionaries
+            Detected keypoints as a PoseFrame
         """
         # If model is loaded, use MoveNet
         if self._model_loaded:
             try:
-                # Run inference
-                keypoints = self._run_inference_on_image(image)
-                
-                # Format keypoints to match expected output format
-                formatted_keypoints = []
-                
-                for idx, name in enumerate(KEYPOINT_NAMES):
-                    # MoveNet returns [y, x, confidence]
-                    y, x, confidence = keypoints[idx]
-                    
-                    # Convert to normalized coordinates [0, 1]
-                    normalized_x = min(max(x, 0.0), 1.0)
-                    normalized_y = min(max(y, 0.0), 1.0)
-                    
-                    formatted_keypoints.append({
-                        'part': name,
-                        'position': {
-                            'x': float(normalized_x),
-                            'y': float(normalized_y)
-                        },
-                        'score': float(confidence)
-                    })
+                # Run inference (MoveNet returns [y, x, confidence] rows)
+                tracker = self._trackers.get(session_id) if POSE_CROP_TRACKING_ENABLED else None
+                if tracker is not None and image.shape[:2] != (MOVENET_INPUT_SIZE, MOVENET_INPUT_SIZE):
+                    keypoints = self._infer_keypoints_tracked(image, tracker)
+                else:
+                    keypoints = self._infer_keypoints(image)
+                frame = PoseFrame.from_movenet(keypoints)
                 
                 # Apply temporal smoothing if enabled
-                if self._enable_smoothing and formatted_keypoints:
-                    formatted_keypoints = self._apply_temporal_smoothing(formatted_keypoints)
+                if self._enable_smoothing:
+                    frame = self._apply_temporal_smoothing(frame, session_id)
                 
-                return formatted_keypoints
+                return frame
                 
             except Exception as e:
                 # If MoveNet fails, log error and fall back to MediaPipe or dummy data
@@ -397,6 +566,10 @@ class YogaPoseEstimator:
         # Fallback to MediaPipe if available
         if hasattr(self, 'mp_pose_detector'):
             try:
+                if image.shape[:2] != (MOVENET_INPUT_SIZE, MOVENET_INPUT_SIZE):
+                    # Full frame from decode_frame; keep keypoints in letterbox coordinates
+                    image, _ = letterbox(image, MOVENET_INPUT_SIZE)
+                
                 # Convert to RGB for MediaPipe (it expects RGB)
                 image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) if len(image.shape) == 3 else image
                 
@@ -404,46 +577,21 @@ class YogaPoseEstimator:
                 results = self.mp_pose_detector.process(image_rgb)
                 
                 if results.pose_landmarks:
-                    # Map MediaPipe landmarks to our format
-                    formatted_keypoints = []
-                    
-                    # MediaPipe pose landmarks mapping
-                    mp_to_our_format = {
-                        0: 'nose',
-                        2: 'left_eye',
-                        5: 'right_eye',
-                        7: 'left_ear',
-                        8: 'right_ear',
-                        11: 'left_shoulder',
-                        12: 'right_shoulder',
-                        13: 'left_elbow',
-                        14: 'right_elbow',
-                        15: 'left_wrist',
-                        16: 'right_wrist',
-                        23: 'left_hip',
-                        24: 'right_hip',
-                        25: 'left_knee',
-                        26: 'right_knee',
-                        27: 'left_ankle',
-                        28: 'right_ankle'
-                    }
+                    # MediaPipe landmark index for each of our keypoints (in KEYPOINT_NAMES order)
+                    mp_landmark_indices = [0, 2, 5, 7, 8, 11, 12, 13, 14, 15, 16, 23, 24, 25, 26, 27, 28]
+                    landmarks = results.pose_landmarks.landmark
                     
-                    for mp_idx, our_part in mp_to_our_format.items():
-                        landmark = results.pose_landmarks.landmark[mp_idx]
-                        formatted_keypoints.append({
-                            'part': our_part,
-                            'position': {
-                                'x': landmark.x,  # MediaPipe already normalizes to 0-1
-                                'y': landmark.y   # MediaPipe already normalizes to 0-1
-                            },
-                            'score': landmark.visibility  # MediaPipe provides visibility as confidence
-                        })
+                    # MediaPipe already normalizes to 0-1 and provides visibility as confidence
+                    frame = PoseFrame(np.array(
+                        [(landmarks[i].x, landmarks[i].y, landmarks[i].visibility) for i in mp_landmark_indices],
+                        dtype=np.float32
+                    ))
                     
                     # Apply temporal smoothing if enabled
-                    if self._enable_smoothing and formatted_keypoints:
-                        formatted_keypoints = self._apply_temporal_smoothing(formatted_keypoints)
+                    if self._enable_smoothing:
+                        frame = self._apply_temporal_smoothing(frame, session_id)
                     
-                    return formatted_keypoints
+                    return frame
                     
             except Exception as mp_e:
                 # If MediaPipe fails, log error and fall back to dummy data
@@ -453,74 +601,84 @@ class YogaPoseEstimator:
                     self._last_error_time = current_time
         
         # If all else fails, return dummy keypoints
-        return self._get_dummy_keypoints()
+        return self._get_dummy_frame()
     
-    def _apply_temporal_smoothing(self, current_keypoints: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _detect_pose_gated(self, image: np.ndarray,
+                           session_id: Optional[str] = None) -> Tuple[PoseFrame, bool]:
         """
-        Apply temporal smoothing to keypoints for more stable visualization.
+        Detect pose keypoints, skipping inference while the session's camera view is static.
+        
+        The frame is compared with the last frame the model ran on for the same
+        session (a 32x32 grayscale thumbnail). If it has barely changed, the
+        previous keypoints are returned again, up to MOTION_GATE_MAX_REUSE
+        frames in a row and MOTION_GATE_MAX_AGE seconds after the last inference.
         
         Args:
-            current_keypoints: Current frame's keypoints
+            image: Preprocessed image as numpy array
+            session_id: Practice session the frame belongs to (no gating without one)
             
         Returns:
-            Smoothed keypoints
+            Tuple of (detected keypoints, whether they were reused from an earlier frame)
         """
-        # Add current keypoints to history
-        self._keypoint_history.append(current_keypoints)
+        tracker = self._trackers.get(session_id) if MOTION_GATE_THRESHOLD > 0 else None
+        if tracker is None:
+            return self.detect_pose(image, session_id), False
         
-        # Keep history within size limit
-        if len(self._keypoint_history) > self._max_history_size:
-            self._keypoint_history.pop(0)
+        signature = motion_signature(image)
+        with tracker.lock:
+            previous = tracker.reuse_if_static(signature)
         
-        # If we don't have enough history yet, return current keypoints
-        if len(self._keypoint_history) < 3:
-            return current_keypoints
+        if previous is not None:
+            self._count_frame('reused')
+            return PoseFrame(previous), True
         
-        # Create a map of keypoint parts for the current frame
-        current_keypoint_map = {kp['part']: kp for kp in current_keypoints}
+        frame = self.detect_pose(image, session_id)
+        self._count_frame('inferred')
         
-        # Prepare arrays for smoothing X and Y positions
-        smoothed_keypoints = []
+        # Dummy keypoints mean detection failed; don't keep serving them
+        if frame is not self._get_dummy_frame():
+            with tracker.lock:
+                tracker.record_inference(signature, frame.data)
         
-        # For each keypoint part
-        for part in KEYPOINT_NAMES:
-            # Extract position history for this part
-            x_history = []
-            y_history = []
-            score_history = []
-            
-            for frame in self._keypoint_history:
-                # Find this part in the frame
-                keypoint = next((kp for kp in frame if kp['part'] == part), None)
-                if keypoint:
-                    x_history.append(keypoint['position']['x'])
-                    y_history.append(keypoint['position']['y'])
-                    score_history.append(keypoint['score'])
+        return frame, False
+    
+    def _apply_temporal_smoothing(self, frame: PoseFrame,
+                                  session_id: Optional[str] = None) -> PoseFrame:
+        """
+        Apply temporal smoothing to keypoints for more stable visualization.
+        
+        History is tracked per session, so frames from different users are
+        never blended together. Without a session ID there is no history to
+        smooth against and the keypoints are returned unchanged.
+        
+        Args:
+            frame: Current frame's keypoints
+            session_id: Practice session the frame belongs to
             
-            # If we have history for this part
-            if x_history and y_history:
-                # Apply Gaussian smoothing
-                x_smooth = gaussian_filter1d(np.array(x_history), sigma=1.0)[-1]
-                y_smooth = gaussian_filter1d(np.array(y_history), sigma=1.0)[-1]
-                
-                # Use average of most recent scores
-                recent_scores = score_history[-3:] if len(score_history) >= 3 else score_history
-                avg_score = sum(recent_scores) / len(recent_scores)
-                
-                # Create smoothed keypoint
-                smoothed_keypoints.append({
-                    'part': part,
-                    'position': {
-                        'x': float(x_smooth),
-                        'y': float(y_smooth)
-                    },
-                    'score': float(avg_score)
-                })
-            elif part in current_keypoint_map:
-                # If no history but exists in current frame, use current value
-                smoothed_keypoints.append(current_keypoint_map[part])
+        Returns:
+            Smoothed keypoints
+        """
+        tracker = self._trackers.get(session_id)
+        if tracker is None:
+            return frame
+        
+        with tracker.lock:
+            smoothed = tracker.smooth(frame.data)
+            if len(tracker) < SMOOTHING_MIN_HISTORY:
+                # Not enough history yet, keep the current frame as-is
+                return frame
         
-        return smoothed_keypoints
+        return PoseFrame(smoothed)
+    
+    def end_session(self, session_id: str):
+        """Release tracking state for a finished practice session."""
+        self._trackers.discard(session_id)
+    
+    def _get_dummy_frame(self) -> PoseFrame:
+        """Dummy keypoints as a PoseFrame (built once and reused)."""
+        if not hasattr(self, '_dummy_frame'):
+            self._dummy_frame = PoseFrame.from_keypoints(self._get_dummy_keypoints())
+        return self._dummy_frame
     
     def _get_dummy_keypoints(self) -> List[Dict[str, Any]]:
         """Generate dummy keypoints when detection fails."""
@@ -587,6 +745,14 @@ class YogaPoseEstimator:
         
         return self._reference_poses[pose_id]
     
+    def _get_reference_frame(self, pose_id: str) -> PoseFrame:
+        """Get reference keypoints for a pose as a PoseFrame."""
+        frame = self._reference_frames.get(pose_id)
+        if frame is None:
+            frame = PoseFrame.from_keypoints(self.get_reference_pose(pose_id)['keypoints'])
+            self._reference_frames[pose_id] = frame
+        return frame
+    
     def _get_pose_info(self, pose_id: str) -> Dict[str, str]:
         """Get basic information about a pose."""
         poses = {
@@ -838,77 +1004,22 @@ class YogaPoseEstimator:
             {'part': 'right_ankle', 'position': {'x': 0.65, 'y': 0.80}, 'score': 1.0}
         ]
     
-    def _calculate_angle(self, a, b, c) -> float:
-        """
-        Calculate angle between three points (in degrees).
-        Point b is the vertex.
-        
-        Args:
-            a, b, c: Points as dictionaries with 'x' and 'y' keys
-            
-        Returns:
-            Angle in degrees (0-180)
-        """
-        # Convert to numpy arrays for easier calculation
-        a_vec = np.array([a['x'], a['y']])
-        b_vec = np.array([b['x'], b['y']])
-        c_vec = np.array([c['x'], c['y']])
-        
-        # Calculate vectors
-        ba = a_vec - b_vec
-        bc = c_vec - b_vec
-        
-        # Calculate angle using dot product formula
-        cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-        
-        # Ensure value is in valid range due to floating point errors
-        cosine_angle = np.clip(cosine_angle, -1.0, 1.0)
-        
-        # Calculate angle in degrees
-        angle_rad = np.arccos(cosine_angle)
-        angle_deg = np.degrees(angle_rad)
-        
-        return float(angle_deg)
-    
-    def _calculate_key_angles(self, keypoints: List[Dict[str, Any]]) -> Dict[str, float]:
+    def _calculate_key_angles(self, keypoints: KeypointsLike) -> Dict[str, float]:
         """
         Calculate important angles between keypoints.
         
         Args:
-            keypoints: List of keypoint dictionaries
+            keypoints: Detected keypoints (PoseFrame or list of keypoint dictionaries)
             
         Returns:
             Dictionary mapping angle names to values in degrees
         """
-        keypoint_dict = {kp['part']: kp['position'] for kp in keypoints}
-        
-        angles = {}
-        
-        # Define key angles to calculate (point_a -> point_b (vertex) -> point_c)
-        angle_definitions = [
-            ('left_shoulder', 'left_elbow', 'left_wrist', 'left_elbow_angle'),
-            ('right_shoulder', 'right_elbow', 'right_wrist', 'right_elbow_angle'),
-            ('left_hip', 'left_knee', 'left_ankle', 'left_knee_angle'),
-            ('right_hip', 'right_knee', 'right_ankle', 'right_knee_angle'),
-            ('left_shoulder', 'left_hip', 'left_knee', 'left_trunk_angle'),
-            ('right_shoulder', 'right_hip', 'right_knee', 'right_trunk_angle'),
-            ('left_hip', 'right_hip', 'right_knee', 'right_hip_angle'),
-            ('right_hip', 'left_hip', 'left_knee', 'left_hip_angle')
-        ]
-        
-        for a_part, b_part, c_part, angle_name in angle_definitions:
-            if a_part in keypoint_dict and b_part in keypoint_dict and c_part in keypoint_dict:
-                a = keypoint_dict[a_part]
-                b = keypoint_dict[b_part]
-                c = keypoint_dict[c_part]
-                
-                angle = self._calculate_angle(a, b, c)
-                angles[angle_name] = angle
-        
-        return angles
+        frame = PoseFrame.coerce(keypoints)
+        angles = joint_angles(frame.xy, KEY_ANGLE_TRIPLETS)
+        return dict(zip(KEY_ANGLE_NAMES, angles.tolist()))
     
-    def evaluate_pose(self, detected_keypoints: List[Dict[str, Any]], 
-                      reference_keypoints: List[Dict[str, Any]], 
+    def evaluate_pose(self, detected_keypoints: KeypointsLike, 
+                      reference_keypoints: KeypointsLike, 
                       pose_id: str = '1-1',
                       trimester: str = 'second') -> float:
         """
@@ -923,60 +1034,37 @@ class YogaPoseEstimator:
         Returns:
             Accuracy percentage (0-100)
         """
-        if not detected_keypoints or not reference_keypoints:
+        if detected_keypoints is None or reference_keypoints is None or \
+                (isinstance(detected_keypoints, list) and not detected_keypoints) or \
+                (isinstance(reference_keypoints, list) and not reference_keypoints):
             logger.warning("Missing keypoints for pose evaluation")
             return 0.0
         
         try:
+            detected = PoseFrame.coerce(detected_keypoints)
+            
             # Get angle definitions for this pose
-            pose_angles = POSE_ANGLE_DEFINITIONS.get(pose_id)
-            if not pose_angles:
+            pose_angles = COMPILED_POSE_ANGLES.get(pose_id)
+            if pose_angles is None:
                 logger.warning(f"No angle definitions found for pose {pose_id}, using position-based evaluation")
-                return self._evaluate_pose_by_position(detected_keypoints, reference_keypoints, trimester)
-            
-            # Convert keypoints to dictionaries for quick lookup
-            detected_dict = {kp['part']: kp for kp in detected_keypoints}
-            reference_dict = {kp['part']: kp for kp in reference_keypoints}
-            
-            total_score = 0.0
-            total_weight = 0.0
+                return self._evaluate_pose_by_position(detected, reference_keypoints, trimester)
             
             # Get trimester-specific tolerance
             tolerance = TRIMESTER_TOLERANCES.get(trimester, TRIMESTER_TOLERANCES['second'])
             
-            # Compare key angles
-            for i, (a, b, c) in enumerate(pose_angles['angles']):
-                # Skip if any keypoint is missing
-                if (a not in detected_dict or b not in detected_dict or c not in detected_dict or
-                    a not in reference_dict or b not in reference_dict or c not in reference_dict):
-                    continue
-                
-                # Get expected angle value and weight
-                expected_angle = pose_angles['expected_values'][i]
-                weight = pose_angles['weights'][i] if i < len(pose_angles['weights']) else 1.0
-                
-                # Calculate actual angle in detected pose
-                detected_angle = self._calculate_angle(
-                    detected_dict[a]['position'],
-                    detected_dict[b]['position'],
-                    detected_dict[c]['position']
-                )
-                
-                # Calculate difference from expected angle
-                angle_diff = abs(detected_angle - expected_angle)
-                
-                # Convert to similarity score (0-1)
-                # Adjust for trimester-specific tolerance
-                angle_similarity = max(0, 1.0 - angle_diff / tolerance)
-                
-                # Add to total with weight
-                total_score += angle_similarity * weight
-                total_weight += weight
+            # Compare all key angles at once; degenerate (NaN) angles are left out
+            detected_angles = joint_angles(detected.xy, pose_angles.triplets)
+            measured = ~np.isnan(detected_angles)
+            angle_diff = np.abs(detected_angles[measured] - pose_angles.expected_values[measured])
+            angle_similarity = np.fmax(0.0, 1.0 - angle_diff / tolerance)
+            
+            total_weight = float(pose_angles.weights[measured].sum())
+            total_score = float(np.dot(angle_similarity, pose_angles.weights[measured]))
             
-            # Check if we have enough data for angle-based evaluation
+            # Check if enough angles could be measured for angle-based evaluation
             if total_weight < 2.0:
                 # Fall back to position-based evaluation
-                return self._evaluate_pose_by_position(detected_keypoints, reference_keypoints, trimester)
+                return self._evaluate_pose_by_position(detected, reference_keypoints, trimester)
             
             # Calculate final normalized score (0-100)
             accuracy = (total_score / total_weight) * 100
@@ -988,8 +1076,8 @@ class YogaPoseEstimator:
             logger.error(f"Error in pose evaluation: {str(e)}")
             return 50.0  # Return medium accuracy on error
     
-    def _evaluate_pose_by_position(self, detected_keypoints: List[Dict[str, Any]], 
-                                  reference_keypoints: List[Dict[str, Any]],
+    def _evaluate_pose_by_position(self, detected_keypoints: KeypointsLike, 
+                                  reference_keypoints: KeypointsLike,
                                   trimester: str = 'second') -> float:
         """
         Fallback evaluation method using keypoint positions.
@@ -1002,55 +1090,21 @@ class YogaPoseEstimator:
         Returns:
             Accuracy percentage (0-100)
         """
-        # Create dictionaries for quick lookup
-        detected_dict = {kp['part']: kp for kp in detected_keypoints}
-        reference_dict = {kp['part']: kp for kp in reference_keypoints}
-        
-        # Define important keypoints with weights
-        keypoint_weights = {
-            'left_shoulder': 1.5,
-            'right_shoulder': 1.5,
-            'left_hip': 1.5,
-            'right_hip': 1.5,
-            'left_knee': 1.2,
-            'right_knee': 1.2,
-            'left_ankle': 1.0,
-            'right_ankle': 1.0,
-            'left_elbow': 1.0,
-            'right_elbow': 1.0,
-            'left_wrist': 0.8,
-            'right_wrist': 0.8,
-            'nose': 0.5
-        }
-        
-        total_score = 0.0
-        total_weight = 0.0
+        detected = PoseFrame.coerce(detected_keypoints)
+        reference = PoseFrame.coerce(reference_keypoints)
         
         # Get trimester-specific tolerance
         # This value affects how strict we are with position matching
-        position_tolerance = {
-            'first': 0.15,   # Stricter in first trimester
-            'second': 0.20,  # Medium tolerance in second trimester
-            'third': 0.25    # More lenient in third trimester
-        }.get(trimester, 0.20)
+        position_tolerance = POSITION_TOLERANCES.get(trimester, 0.20)
         
-        # Compare each keypoint position
-        for part, weight in keypoint_weights.items():
-            if part in detected_dict and part in reference_dict:
-                det_pos = detected_dict[part]['position']
-                ref_pos = reference_dict[part]['position']
-                
-                # Calculate Euclidean distance
-                distance = ((det_pos['x'] - ref_pos['x']) ** 2 + 
-                           (det_pos['y'] - ref_pos['y']) ** 2) ** 0.5
-                
-                # Convert to similarity score (0-1)
-                # Higher tolerance (higher divisor) means we're more lenient
-                similarity = max(0, 1.0 - distance / position_tolerance)
-                
-                # Add to total with weight
-                total_score += similarity * weight
-                total_weight += weight
+        # Euclidean distance of every keypoint from its reference position
+        distances = np.linalg.norm(detected.xy - reference.xy, axis=1)
+        
+        # Convert to similarity scores (0-1); a higher tolerance is more lenient
+        similarity = np.maximum(0.0, 1.0 - distances / position_tolerance)
+        
+        total_weight = float(POSITION_WEIGHT_VECTOR.sum())
+        total_score = float(np.dot(similarity, POSITION_WEIGHT_VECTOR))
         
         # Calculate final score
         if total_weight > 0:
@@ -1059,18 +1113,26 @@ class YogaPoseEstimator:
         else:
             return 0.0
     
-    def estimate_pose(self, image_data: bytes, pose_id: str, trimester: str = None) -> Dict[str, Any]:
+    def estimate_pose(self, image_data: bytes, pose_id: str, trimester: str = None,
+                      session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Process image to detect pose, evaluate accuracy, and return results.
         
         Args:
-            image_data: Image data as bytes or base64 string
+            image_data: Image data as bytes, base64 string or binary file object
             pose_id: Identifier of the expected yoga pose
             trimester: Optional pregnancy trimester ('first', 'second', 'third')
+            session_id: Optional client practice session ID for temporal smoothing and motion gating
             
         Returns:
             Dictionary with pose estimation results
         """
+        results, _ = self._estimate_pose_frame(image_data, pose_id, trimester, session_id)
+        return results
+    
+    def _estimate_pose_frame(self, image_data: bytes, pose_id: str, trimester: str = None,
+                             session_id: Optional[str] = None) -> Tuple[Dict[str, Any], PoseFrame]:
+        """Run estimate_pose and also return the detected keypoints as a PoseFrame."""
         try:
             start_time = time.time()
             
@@ -1086,6 +1148,7 @@ class YogaPoseEstimator:
             # Get reference pose
             reference_pose = self.get_reference_pose(pose_id)
             reference_keypoints = reference_pose['keypoints']
+            reference_frame = self._get_reference_frame(pose_id)
             
             # Determine trimester from pose ID if not provided
             if not trimester:
@@ -1093,17 +1156,25 @@ class YogaPoseEstimator:
                 trimester = pose_info.get('trimester', 'second')
             
             # Preprocess image and detect pose
-            preprocessed_image = self.preprocess_image(image_bytes)
+            crop_tracker = (self._trackers.get(session_id)
+                            if POSE_CROP_TRACKING_ENABLED and self._model_loaded else None)
+            if crop_tracker is not None:
+                # Keep the full frame; it is cropped around the tracked subject at detection time
+                with crop_tracker.lock:
+                    crop_region = crop_tracker.crop_region
+                preprocessed_image = self.decode_frame(image_bytes, crop_region)
+            else:
+                preprocessed_image = self.preprocess_image(image_bytes)
             
             detection_start = time.time()
-            detected_keypoints = self.detect_pose(preprocessed_image)
+            detected_frame, reused = self._detect_pose_gated(preprocessed_image, session_id)
             detection_time = time.time() - detection_start
             
             # Evaluate pose accuracy
             evaluation_start = time.time()
             accuracy = self.evaluate_pose(
-                detected_keypoints, 
-                reference_keypoints, 
+                detected_frame, 
+                reference_frame, 
                 pose_id, 
                 trimester
             )
@@ -1125,10 +1196,11 @@ class YogaPoseEstimator:
             return {
                 'pose_id': pose_id,
                 'accuracy': float(display_accuracy),
-                'keypoints': detected_keypoints,
+                'keypoints': detected_frame.to_keypoints(),
                 'reference_keypoints': reference_keypoints,
-                'processing_time': total_time
-            }
+                'processing_time': total_time,
+                'reused': reused  # Keypoints carried over from a previous frame (no motion)
+            }, detected_frame
             
         except Exception as e:
             logger.exception(f"Error estimating pose: {str(e)}")
@@ -1139,19 +1211,20 @@ class YogaPoseEstimator:
                 'accuracy': 50.0,  # Default medium accuracy
                 'keypoints': self._get_dummy_keypoints(),
                 'reference_keypoints': self.get_reference_pose(pose_id)['keypoints'],
+                'reused': False,
                 'error': str(e)
-            }
+            }, self._get_dummy_frame()
     
     def analyze_pose_issues(self, 
-                          detected_keypoints: List[Dict[str, Any]], 
-                          reference_keypoints: List[Dict[str, Any]], 
+                          detected_keypoints: KeypointsLike, 
+                          reference_keypoints: KeypointsLike, 
                           pose_id: str) -> List[str]:
         """
         Analyze specific issues with a detected pose compared to the reference.
         
         Args:
-            detected_keypoints: List of detected keypoints
-            reference_keypoints: List of reference keypoints
+            detected_keypoints: Detected keypoints (PoseFrame or list of keypoint dictionaries)
+            reference_keypoints: Reference keypoints (PoseFrame or list of keypoint dictionaries)
             pose_id: Pose identifier
             
         Returns:
@@ -1160,88 +1233,62 @@ class YogaPoseEstimator:
         issues = []
         
         try:
-            # Create dictionaries for quick lookup
-            detected_dict = {kp['part']: kp['position'] for kp in detected_keypoints}
-            reference_dict = {kp['part']: kp['position'] for kp in reference_keypoints}
+            detected = PoseFrame.coerce(detected_keypoints)
+            xy = detected.xy
             
             # Get angle definitions for this pose
             pose_angles = POSE_ANGLE_DEFINITIONS.get(pose_id)
             if not pose_angles:
                 return [f"Unable to analyze specific issues for {pose_id}"]
+            compiled = COMPILED_POSE_ANGLES[pose_id]
             
             # Calculate detected angles and compare to expected values
+            detected_angles = joint_angles(xy, compiled.triplets)
+            angle_diffs = np.abs(detected_angles - compiled.expected_values)
+            
             angle_issues = []
             
-            for i, (a, b, c) in enumerate(pose_angles['angles']):
-                if all(p in detected_dict and p in reference_dict for p in [a, b, c]):
-                    # Calculate angle in detected pose
-                    detected_angle = self._calculate_angle(
-                        detected_dict[a], 
-                        detected_dict[b], 
-                        detected_dict[c]
-                    )
-                    
-                    # Get expected angle
-                    expected_angle = pose_angles['expected_values'][i]
-                    
-                    # Calculate difference
-                    angle_diff = abs(detected_angle - expected_angle)
-                    
-                    # If difference is significant, add issue
-                    if angle_diff > 25:
-                        # Map joint names to readable form
-                        joint_names = {
-                            'left_shoulder': 'left shoulder',
-                            'right_shoulder': 'right shoulder',
-                            'left_elbow': 'left elbow',
-                            'right_elbow': 'right elbow',
-                            'left_wrist': 'left wrist',
-                            'right_wrist': 'right wrist',
-                            'left_hip': 'left hip',
-                            'right_hip': 'right hip',
-                            'left_knee': 'left knee',
-                            'right_knee': 'right knee',
-                            'left_ankle': 'left ankle',
-                            'right_ankle': 'right ankle',
-                            'nose': 'head'
-                        }
-                        
-                        # Get readable joint names
-                        point_a = joint_names.get(a, a)
-                        point_b = joint_names.get(b, b)
-                        point_c = joint_names.get(c, c)
-                        
-                        # Create issue description based on the direction of error
-                        if detected_angle < expected_angle:
-                            if 'knee' in b:
-                                issue = f"Bend your {point_b} more"
-                            elif 'elbow' in b:
-                                issue = f"Bend your {point_b} more"
-                            elif 'hip' in b:
-                                if expected_angle > 160:
-                                    issue = f"Straighten your {point_b} to {point_c} alignment"
-                                else:
-                                    issue = f"Bend more at the {point_b}"
-                            else:
-                                issue = f"Adjust the angle between {point_a}, {point_b}, and {point_c}"
+            # Only significant differences become issues
+            for i in np.flatnonzero(angle_diffs > 25):
+                a, b, c = pose_angles['angles'][i]
+                detected_angle = detected_angles[i]
+                expected_angle = pose_angles['expected_values'][i]
+                
+                # Get readable joint names
+                point_a = JOINT_DISPLAY_NAMES.get(a, a)
+                point_b = JOINT_DISPLAY_NAMES.get(b, b)
+                point_c = JOINT_DISPLAY_NAMES.get(c, c)
+                
+                # Create issue description based on the direction of error
+                if detected_angle < expected_angle:
+                    if 'knee' in b:
+                        issue = f"Bend your {point_b} more"
+                    elif 'elbow' in b:
+                        issue = f"Bend your {point_b} more"
+                    elif 'hip' in b:
+                        if expected_angle > 160:
+                            issue = f"Straighten your {point_b} to {point_c} alignment"
                         else:
-                            if 'knee' in b:
-                                issue = f"Straighten your {point_b} more"
-                            elif 'elbow' in b:
-                                issue = f"Straighten your {point_b} more"
-                            elif 'hip' in b:
-                                if expected_angle < 100:
-                                    issue = f"Bend more at the {point_b}"
-                                else:
-                                    issue = f"Straighten your {point_b} to {point_c} alignment"
-                            else:
-                                issue = f"Adjust the angle between {point_a}, {point_b}, and {point_c}"
-                        
-                        # Add severity score based on difference and joint importance
-                        weight = pose_angles['weights'][i] if i < len(pose_angles['weights']) else 1.0
-                        severity = angle_diff * weight
-                        
-                        angle_issues.append((issue, severity))
+                            issue = f"Bend more at the {point_b}"
+                    else:
+                        issue = f"Adjust the angle between {point_a}, {point_b}, and {point_c}"
+                else:
+                    if 'knee' in b:
+                        issue = f"Straighten your {point_b} more"
+                    elif 'elbow' in b:
+                        issue = f"Straighten your {point_b} more"
+                    elif 'hip' in b:
+                        if expected_angle < 100:
+                            issue = f"Bend more at the {point_b}"
+                        else:
+                            issue = f"Straighten your {point_b} to {point_c} alignment"
+                    else:
+                        issue = f"Adjust the angle between {point_a}, {point_b}, and {point_c}"
+                
+                # Add severity score based on difference and joint importance
+                severity = float(angle_diffs[i] * compiled.weights[i])
+                
+                angle_issues.append((issue, severity))
             
             # Sort issues by severity and add top issues
             angle_issues.sort(key=lambda x: x[1], reverse=True)
@@ -1250,36 +1297,25 @@ class YogaPoseEstimator:
             # Add pose-specific checks
             if pose_id == '1-1':  # Mountain Pose
                 # Check if shoulders are level
-                if all(p in detected_dict for p in ['left_shoulder', 'right_shoulder']):
-                    left_y = detected_dict['left_shoulder']['y']
-                    right_y = detected_dict['right_shoulder']['y']
-                    if abs(left_y - right_y) > 0.05:
-                        issues.append("Level your shoulders")
+                if abs(xy[KEYPOINT_INDEX['left_shoulder'], 1] - xy[KEYPOINT_INDEX['right_shoulder'], 1]) > 0.05:
+                    issues.append("Level your shoulders")
                 
                 # Check if hips are level
-                if all(p in detected_dict for p in ['left_hip', 'right_hip']):
-                    left_y = detected_dict['left_hip']['y']
-                    right_y = detected_dict['right_hip']['y']
-                    if abs(left_y - right_y) > 0.05:
-                        issues.append("Level your hips")
+                if abs(xy[KEYPOINT_INDEX['left_hip'], 1] - xy[KEYPOINT_INDEX['right_hip'], 1]) > 0.05:
+                    issues.append("Level your hips")
             
             elif pose_id == '2-1':  # Warrior II
                 # Check front knee alignment over ankle
-                if all(p in detected_dict for p in ['left_knee', 'left_ankle']):
-                    knee_x = detected_dict['left_knee']['x']
-                    ankle_x = detected_dict['left_ankle']['x']
-                    if abs(knee_x - ankle_x) > 0.1:
-                        issues.append("Align front knee over ankle")
+                if abs(xy[KEYPOINT_INDEX['left_knee'], 0] - xy[KEYPOINT_INDEX['left_ankle'], 0]) > 0.1:
+                    issues.append("Align front knee over ankle")
             
             # Generic checks for all poses
             
             # Check if body is in frame
-            points_outside_frame = 0
-            for part in ['nose', 'left_ankle', 'right_ankle', 'left_wrist', 'right_wrist']:
-                if part in detected_dict:
-                    pos = detected_dict[part]
-                    if pos['x'] < 0.05 or pos['x'] > 0.95 or pos['y'] < 0.05 or pos['y'] > 0.95:
-                        points_outside_frame += 1
+            edge_points = xy[FRAME_CHECK_INDICES]
+            points_outside_frame = int(np.count_nonzero(
+                ((edge_points < 0.05) | (edge_points > 0.95)).any(axis=1)
+            ))
             
             if points_outside_frame > 1:
                 issues.append("Position your full body in the camera frame")
@@ -1297,7 +1333,7 @@ class YogaPoseEstimator:
             return ["Focus on your alignment and breathing"]
     
     def generate_pose_feedback(self, 
-                              detected_keypoints: List[Dict[str, Any]], 
+                              detected_keypoints: KeypointsLike, 
                               pose_id: str, 
                               accuracy: float,
                               is_final: bool = False) -> str:
@@ -1305,7 +1341,7 @@ class YogaPoseEstimator:
         Generate specific feedback for the detected pose.
         
         Args:
-            detected_keypoints: List of detected keypoints
+            detected_keypoints: Detected keypoints (PoseFrame or list of keypoint dictionaries)
             pose_id: Pose identifier
             accuracy: Current accuracy score
             is_final: Whether this is the final feedback
@@ -1314,10 +1350,9 @@ class YogaPoseEstimator:
             String with specific feedback
         """
         # Get reference pose and analyze issues
-        reference_pose = self.get_reference_pose(pose_id)
-        reference_keypoints = reference_pose['keypoints']
+        reference_frame = self._get_reference_frame(pose_id)
         
-        issues = self.analyze_pose_issues(detected_keypoints, reference_keypoints, pose_id)
+        issues = self.analyze_pose_issues(detected_keypoints, reference_frame, pose_id)
         pose_info = self._get_pose_info(pose_id)
         pose_title = pose_info.get('title', 'this pose')
         
@@ -1363,24 +1398,28 @@ class YogaPoseEstimator:
     def estimate_pose_with_feedback(self, 
                                    image_data: bytes, 
                                    pose_id: str, 
-                                   is_final: bool = False) -> Dict[str, Any]:
+                                   is_final: bool = False,
+                                   session_id: Optional[str] = None,
+                                   trimester: str = None) -> Dict[str, Any]:
         """
         Complete pose estimation with detailed feedback.
         
         Args:
-            image_data: Image data as bytes or base64 string
+            image_data: Image data as bytes, base64 string or binary file object
             pose_id: Pose identifier
             is_final: Whether this is the final feedback session
+            session_id: Optional client practice session ID
+            trimester: Optional pregnancy trimester ('first', 'second', 'third')
             
         Returns:
             Dictionary with estimation results and feedback
         """
         # Estimate pose
-        results = self.estimate_pose(image_data, pose_id)
+        results, detected_frame = self._estimate_pose_frame(image_data, pose_id, trimester, session_id)
         
         # Generate feedback
         feedback = self.generate_pose_feedback(
-            results['keypoints'],
+            detected_frame,
             pose_id,
             results['accuracy'],
             is_final
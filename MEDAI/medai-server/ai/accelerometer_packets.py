@@ -0,0 +1,173 @@
+"""
+accelerometer_packets.py - Compact binary encoding of accelerometer uploads
+
+At 50-100 Hz from many wearers, parsing JSON lists of {x, y, z} objects
+costs far more CPU than the fall detection itself. Devices can instead send
+a packet (Content-Type application/x-accelerometer) that is decoded with
+np.frombuffer, without copying the samples:
+
+    offset  size  field
+    0       4     magic b'ACC1'
+    4       1     version (1)
+    5       1     flags (reserved, 0)
+    6       2     device id length in bytes (uint16)
+    8       4     sample rate in Hz (float32, 0 if unknown)
+    12      8     timestamp of the first sample, ms since the Unix epoch (int64)
+    20      n     device id (UTF-8), zero-padded to a multiple of 4 bytes
+    ...     12*N  samples: x, y, z as float32, in g
+
+All fields are little-endian. The JSON format remains supported.
+
+A batch (Content-Type application/x-accelerometer-batch, for relays that
+forward many devices at once) is a sequence of packets, each preceded by its
+length in bytes as a little-endian uint32.
+"""
+
+import struct
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+PACKET_MIMETYPE = 'application/x-accelerometer'
+BATCH_MIMETYPE = 'application/x-accelerometer-batch'
+PACKET_MAGIC = b'ACC1'
+PACKET_VERSION = 1
+
+_HEADER = struct.Struct('<4sBBHfq')
+_LENGTH = struct.Struct('<I')
+_SAMPLE_DTYPE = np.dtype('<f4')
+SAMPLE_SIZE = 3 * _SAMPLE_DTYPE.itemsize
+
+
+class InvalidPacketError(ValueError):
+    """Raised when an accelerometer packet is truncated or malformed."""
+
+
+class AccelerometerPacket(NamedTuple):
+    """A decoded accelerometer packet."""
+    device_id: str
+    sample_rate: Optional[float]  # Hz, None if the device did not declare it
+    start_time: int               # Timestamp of the first sample, ms since the Unix epoch
+    samples: np.ndarray           # (N, 3) float32 x, y, z; a read-only view of the packet
+
+
+def _padded(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def decode_packet(data: bytes) -> AccelerometerPacket:
+    """
+    Decode a binary accelerometer packet.
+
+    Args:
+        data: Packet bytes (bytes, bytearray or memoryview)
+
+    Returns:
+        The decoded packet; its samples share memory with data
+
+    Raises:
+        InvalidPacketError: If the packet is truncated or malformed
+    """
+    if len(data) < _HEADER.size:
+        raise InvalidPacketError('Accelerometer packet is too short')
+    magic, version, _, device_id_length, sample_rate, start_time = _HEADER.unpack_from(data)
+    if magic != PACKET_MAGIC:
+        raise InvalidPacketError('Not an accelerometer packet')
+    if version != PACKET_VERSION:
+        raise InvalidPacketError(f'Unsupported accelerometer packet version {version}')
+
+    offset = _HEADER.size + _padded(device_id_length)
+    if len(data) < offset or (len(data) - offset) % SAMPLE_SIZE:
+        raise InvalidPacketError('Accelerometer packet is truncated')
+    try:
+        device_id = bytes(data[_HEADER.size:_HEADER.size + device_id_length]).decode('utf-8')
+    except UnicodeDecodeError:
+        raise InvalidPacketError('Device ID is not valid UTF-8')
+
+    samples = np.frombuffer(data, dtype=_SAMPLE_DTYPE, offset=offset).reshape(-1, 3)
+    return AccelerometerPacket(device_id, sample_rate if sample_rate > 0 else None, start_time, samples)
+
+
+def decode_packets(data: bytes) -> List[AccelerometerPacket]:
+    """
+    Decode a batch of length-prefixed accelerometer packets.
+
+    Args:
+        data: Batch bytes
+
+    Returns:
+        The decoded packets, in order; their samples share memory with data
+
+    Raises:
+        InvalidPacketError: If the batch or one of its packets is malformed
+    """
+    data = memoryview(data)
+    packets = []
+    offset = 0
+    while offset < len(data):
+        if offset + _LENGTH.size > len(data):
+            raise InvalidPacketError('Accelerometer batch is truncated')
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        if offset + length > len(data):
+            raise InvalidPacketError('Accelerometer batch is truncated')
+        packets.append(decode_packet(data[offset:offset + length]))
+        offset += length
+    return packets
+
+
+def encode_packet(samples: np.ndarray, device_id: str = '', sample_rate: Optional[float] = None,
+                  start_time: int = 0) -> bytes:
+    """
+    Encode samples as a binary accelerometer packet (for devices and tests).
+
+    Args:
+        samples: Array-like of shape (N, 3) with x, y, z values in g
+        device_id: Device the samples come from
+        sample_rate: Sample rate in Hz, if known
+        start_time: Timestamp of the first sample, ms since the Unix epoch
+
+    Returns:
+        Packet bytes
+    """
+    device_id = device_id.encode('utf-8')
+    header = _HEADER.pack(PACKET_MAGIC, PACKET_VERSION, 0, len(device_id), sample_rate or 0.0, start_time)
+    padding = b'\0' * (_padded(len(device_id)) - len(device_id))
+    payload = np.ascontiguousarray(samples, dtype=_SAMPLE_DTYPE).reshape(-1, 3)
+    return header + device_id + padding + payload.tobytes()
+
+
+def encode_packets(packets: List[bytes]) -> bytes:
+    """Join encoded packets into a batch."""
+    return b''.join(_LENGTH.pack(len(packet)) + packet for packet in packets)
+
+
+if __name__ == '__main__':
+    # Benchmark: decoding JSON uploads (what request.json and the analyzer do)
+    # vs. binary packets, at realistic upload sizes
+    import json
+    import time
+
+    from ai.fall_detection import AXES, to_sample_array
+
+    rng = np.random.default_rng(0)
+    for label, size in [('0.5 s @ 50 Hz', 25), ('1 s @ 100 Hz', 100),
+                        ('5 s @ 100 Hz', 500), ('30 s @ 100 Hz', 3000)]:
+        samples = rng.normal([0.0, 0.0, 1.0], 0.05, (size, 3)).astype(np.float32)
+        body = json.dumps({'deviceId': 'wearer-0042', 'sampleRate': 100,
+                           'accelerometerData': [dict(zip(AXES, sample)) for sample in samples.tolist()]}).encode()
+        packet = encode_packet(samples, 'wearer-0042', 100.0, 1700000000000)
+        assert np.array_equal(decode_packet(packet).samples, samples)
+        repeat = max(20, 20000 // size)
+
+        timings = {}
+        for name, fn, data in [('json', lambda data: to_sample_array(json.loads(data)['accelerometerData']), body),
+                               ('binary', decode_packet, packet)]:
+            fn(data)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn(data)
+            timings[name] = (time.perf_counter() - start) / repeat * 1e6
+
+        print(f"{label:>14} ({size:>4} samples): json {timings['json']:8.1f} us {len(body):>7} B, "
+              f"binary {timings['binary']:5.1f} us {len(packet):>6} B ({timings['json'] / timings['binary']:.0f}x)")
@@ -1,6 +1,9 @@
+import os
 import numpy as np
 import json
 import logging
+from functools import lru_cache
+from typing import NamedTuple
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -9,102 +12,442 @@ logger = logging.getLogger(__name__)
 FALL_THRESHOLD = 2.5  # g-force threshold for potential fall
 IMPACT_THRESHOLD = 3.0  # g-force threshold for impact
 FREE_FALL_THRESHOLD = 0.3  # g-force threshold for free fall period
+PRE_FALL_THRESHOLD = 0.8  # g-force the sample before free fall must exceed (normal activity)
 
-def analyze_accelerometer_data(accelerometer_data):
+# The thresholds and windows were tuned on the mobile app's 10 Hz stream
+# (Accelerometer.setUpdateInterval(100)); faster input is decimated to this rate
+DETECTION_RATE = 10.0  # Hz
+# Measured rates this close to DETECTION_RATE are clock jitter of a native
+# 10 Hz stream; such input is analyzed as is, at DETECTION_RATE
+NATIVE_RATE_TOLERANCE = 0.2
+
+# Windows, in milliseconds
+IMPACT_WINDOW_MS = 1400  # Searched for an impact after the free fall onset
+INACTIVITY_WINDOW_MS = 900  # After the impact, checked for low movement
+INACTIVITY_STD = 0.5  # Magnitude standard deviation below which the wearer is considered still
+ORIENTATION_WINDOW_MS = 500  # Averaged for the orientation before the fall and after the impact
+
+AXES = ('x', 'y', 'z')
+
+# Batch analysis limits: windows per request, and entries (windows x longest
+# window) of the padded arrays analyze_batch works on at once
+FALL_BATCH_MAX_DEVICES = int(os.environ.get('FALL_BATCH_MAX_DEVICES', 1000))
+FALL_BATCH_MAX_CELLS = int(os.environ.get('FALL_BATCH_MAX_CELLS', 1 << 20))
+
+
+class DetectionWindows(NamedTuple):
+    """Detection windows, in samples at a given sample rate."""
+    impact: int
+    inactivity: int
+    orientation: int
+
+
+@lru_cache(maxsize=64)
+def detection_windows(sample_rate):
+    """Convert the millisecond windows to samples at sample_rate (Hz); each is at least 1 sample."""
+    def samples(duration_ms):
+        return max(1, int(round(duration_ms * sample_rate / 1000)))
+    return DetectionWindows(samples(IMPACT_WINDOW_MS), samples(INACTIVITY_WINDOW_MS),
+                            samples(ORIENTATION_WINDOW_MS))
+
+
+# Windows at the detection rate (14, 9 and 5 samples)
+IMPACT_WINDOW, INACTIVITY_WINDOW, ORIENTATION_WINDOW = detection_windows(DETECTION_RATE)
+
+
+def to_sample_array(accelerometer_data):
+    """
+    Convert accelerometer data to an (N, 3) float32 array of x, y, z samples.
+
+    Args:
+        accelerometer_data: List of dictionaries with x, y, z values (missing
+            axes count as 0), a JSON string of such a list, or an array-like of
+            shape (N, 3)
+
+    Returns:
+        numpy.ndarray: Array of shape (N, 3), dtype float32
+    """
+    if isinstance(accelerometer_data, str):
+        # If data is provided as a JSON string
+        accelerometer_data = json.loads(accelerometer_data)
+
+    if isinstance(accelerometer_data, np.ndarray):
+        return np.asarray(accelerometer_data, dtype=np.float32).reshape(-1, 3)
+
+    samples = np.empty((len(accelerometer_data), 3), dtype=np.float32)
+    # One list per axis is considerably faster than building an (N, 3) list of tuples
+    for column, axis in enumerate(AXES):
+        samples[:, column] = [sample.get(axis, 0) for sample in accelerometer_data]
+    return samples
+
+
+def acceleration_magnitudes(samples):
+    """Return the magnitude of each (x, y, z) sample, in g."""
+    x, y, z = samples[:, 0], samples[:, 1], samples[:, 2]
+    return np.sqrt(x * x + y * y + z * z)
+
+
+def sample_timestamps(accelerometer_data):
+    """
+    Get the per-sample 'timestamp' values (seconds, as reported by expo-sensors).
+
+    Returns:
+        numpy.ndarray or None: Timestamps in ms, or None if the samples have none
+    """
+    if (not isinstance(accelerometer_data, list) or not accelerometer_data
+            or not isinstance(accelerometer_data[0], dict) or 'timestamp' not in accelerometer_data[0]):
+        return None
+    timestamps = np.array([sample.get('timestamp') for sample in accelerometer_data], dtype=np.float64) * 1000
+    if not np.isfinite(timestamps).all():
+        logger.warning("Ignoring incomplete accelerometer timestamps")
+        return None
+    return timestamps
+
+
+def normalize_sample_rate(sample_rate):
+    """
+    Validate a declared sample rate.
+
+    Returns:
+        float or None: Sample rate in Hz, or None if none was declared
+
+    Raises:
+        ValueError: If the sample rate is not a positive number
+    """
+    if sample_rate is None or sample_rate == '':
+        return None
+    sample_rate = float(sample_rate)
+    if not 0 < sample_rate < float('inf'):
+        raise ValueError(f"Invalid sample rate: {sample_rate}")
+    return sample_rate
+
+
+def decimate(samples, bins):
+    """
+    Keep one sample per bin: the one whose magnitude deviates most from 1 g.
+
+    Averaging or picking every n-th sample would flatten the short impact
+    peak and the free fall drop the detector looks for; keeping each bin's
+    extreme sample preserves both.
+
+    Args:
+        samples (numpy.ndarray): (N, 3) samples
+        bins (numpy.ndarray): Non-decreasing output sample index of each sample
+
+    Returns:
+        numpy.ndarray: One sample per bin from bins[0] to bins[-1]; empty bins
+        (gaps in the input) repeat the previous sample
+    """
+    deviation = np.abs(acceleration_magnitudes(samples) - 1.0)
+    order = np.lexsort((-deviation, bins))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = bins[order[1:]] != bins[order[:-1]]
+    chosen = order[first]
+    positions = np.full(bins[-1] - bins[0] + 1, -1)
+    positions[bins[chosen] - bins[0]] = np.arange(len(chosen))
+    return samples[chosen][np.maximum.accumulate(positions)]
+
+
+def measured_sample_rate(timestamps):
+    """
+    Sample rate implied by per-sample timestamps (ms).
+
+    Returns:
+        float or None: Rate in Hz, or None if it cannot be measured (fewer
+        than two samples, or no time elapsed)
+    """
+    if timestamps is None or len(timestamps) < 2:
+        return None
+    duration = timestamps.max() - timestamps.min()
+    return (len(timestamps) - 1) * 1000 / duration if duration > 0 else None
+
+
+def nominal_sample_rate(measured_rate):
+    """Map a measured rate within NATIVE_RATE_TOLERANCE of DETECTION_RATE to DETECTION_RATE."""
+    if abs(measured_rate - DETECTION_RATE) <= NATIVE_RATE_TOLERANCE * DETECTION_RATE:
+        return DETECTION_RATE
+    return measured_rate
+
+
+def time_bins(timestamps, origin):
+    """Output sample index, at DETECTION_RATE, of samples taken at timestamps (ms) since origin."""
+    return np.floor((timestamps - origin) * (DETECTION_RATE / 1000)).astype(np.int64)
+
+
+def decimation_bins(first_index, count, sample_rate):
+    """Output sample index, at DETECTION_RATE, of input samples first_index.. at sample_rate."""
+    return np.floor((first_index + np.arange(count)) * (DETECTION_RATE / sample_rate)).astype(np.int64)
+
+
+def resample(samples, sample_rate=None, timestamps=None):
+    """
+    Bring samples to a rate the detector's windows can be applied at.
+
+    Input faster than DETECTION_RATE is decimated to it; slower input is kept
+    as is and analyzed with windows converted to its rate. Timestamped input
+    measured within NATIVE_RATE_TOLERANCE of DETECTION_RATE is native 10 Hz
+    input with clock jitter, and is kept as is at DETECTION_RATE.
+
+    Args:
+        samples (numpy.ndarray): (N, 3) samples
+        sample_rate (float): Declared sample rate in Hz (DETECTION_RATE if None)
+        timestamps (numpy.ndarray): Optional per-sample timestamps in ms; they
+            take precedence over the declared rate
+
+    Returns:
+        tuple: (samples, sample rate in Hz)
+    """
+    measured_rate = measured_sample_rate(timestamps) if len(samples) > 1 else None
+    if measured_rate is not None:
+        order = np.argsort(timestamps, kind='stable')
+        samples, timestamps = samples[order], timestamps[order]
+        sample_rate = nominal_sample_rate(measured_rate)
+        if sample_rate <= DETECTION_RATE:
+            return samples, sample_rate
+        # Bin by time, so jitter and dropped samples do not shift the windows
+        return decimate(samples, time_bins(timestamps, timestamps[0])), DETECTION_RATE
+
+    sample_rate = sample_rate or DETECTION_RATE
+    if sample_rate <= DETECTION_RATE or not len(samples):
+        return samples, sample_rate
+    return decimate(samples, decimation_bins(0, len(samples), sample_rate)), DETECTION_RATE
+
+
+def find_free_fall(magnitudes):
+    """
+    Find the onset of the first free fall.
+
+    Returns:
+        int or None: Index of the last normal sample before the magnitude drops
+        below FREE_FALL_THRESHOLD, or None if there is no free fall
+    """
+    onsets = np.flatnonzero((magnitudes[:-1] > PRE_FALL_THRESHOLD) & (magnitudes[1:] < FREE_FALL_THRESHOLD))
+    return int(onsets[0]) if onsets.size else None
+
+
+def find_impact(magnitudes, free_fall_index, window=IMPACT_WINDOW):
+    """
+    Find the first impact within window samples after a free fall onset.
+
+    Returns:
+        int or None: Index of the impact, or None if there is none
+    """
+    start = free_fall_index + 1
+    impacts = np.flatnonzero(magnitudes[start:start + window] > IMPACT_THRESHOLD)
+    return start + int(impacts[0]) if impacts.size else None
+
+
+def is_inactive_after(magnitudes, impact_index, window=INACTIVITY_WINDOW):
+    """Check for low movement in the window samples after the impact."""
+    # The window must be followed by at least one more sample
+    if impact_index + window + 1 >= len(magnitudes):
+        return False
+    post_impact = magnitudes[impact_index + 1:impact_index + window + 1]
+    return bool(np.std(post_impact, dtype=np.float64) < INACTIVITY_STD)
+
+
+def fall_confidence(impact_value, inactive):
+    """Confidence (0-120) of a fall from its impact magnitude and low movement afterwards."""
+    confidence = min(100, (float(impact_value) / IMPACT_THRESHOLD) * 70)
+    if inactive:
+        confidence += 20
+    return round(confidence)
+
+
+def analyze_samples(samples, sample_rate=DETECTION_RATE):
+    """
+    Detect a fall in an (N, 3) array of accelerometer samples.
+
+    Looks for a pattern of: normal activity -> sudden drop -> impact -> inactivity.
+
+    Args:
+        samples (numpy.ndarray): Array of shape (N, 3) with x, y, z values in g
+        sample_rate (float): Sample rate in Hz, at most DETECTION_RATE (see resample)
+
+    Returns:
+        tuple: (fall_detected, confidence, fall_type)
+    """
+    windows = detection_windows(sample_rate)
+    magnitudes = acceleration_magnitudes(samples)
+
+    # 1. Check for free fall (sudden drop in acceleration)
+    free_fall_index = find_free_fall(magnitudes)
+    if free_fall_index is None:
+        return False, 0, "unknown"
+    logger.debug("Free fall detected at index: %d", free_fall_index)
+
+    # 2. Check for impact after free fall
+    impact_index = find_impact(magnitudes, free_fall_index, windows.impact)
+    if impact_index is None:
+        return False, 0, "unknown"
+
+    # 3. Calculate confidence based on impact strength and inactivity after impact
+    confidence = fall_confidence(magnitudes[impact_index],
+                                 is_inactive_after(magnitudes, impact_index, windows.inactivity))
+
+    # Determine fall type based on orientation changes
+    fall_type = determine_fall_type(samples, free_fall_index, impact_index, windows.orientation)
+
+    return True, confidence, fall_type
+
+
+def _gather(values, offsets, start, width, end):
+    """
+    Take width consecutive values of each window of a concatenated array.
+
+    Args:
+        values: Concatenated windows (samples or magnitudes)
+        offsets: Position of each window in values
+        start: Per-window index of the first value to take
+        width: Number of values to take
+        end: Per-window index past the last value that may be taken
+
+    Returns:
+        tuple: (values, mask) of shape (windows, width, ...); the mask is False
+        for positions before 0 or at/after end, whose values are arbitrary
+    """
+    indices = start[:, None] + np.arange(width)
+    mask = (indices >= 0) & (indices < end[:, None])
+    return values[np.clip(offsets[:, None] + indices, 0, len(values) - 1)], mask
+
+
+def _masked_mean(values, mask):
+    """Per-window mean of the (windows, width, 3) values where mask is set (NaN if none)."""
+    counts = mask.sum(axis=1, keepdims=True)
+    totals = np.where(mask[:, :, None], values, 0).sum(axis=1, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return totals / counts
+
+
+def _analyze_concatenated(samples, lengths, windows):
+    """Run analyze_samples on every window of concatenated (sum(lengths), 3) samples."""
+    rows = np.arange(len(lengths))
+    offsets = np.cumsum(lengths) - lengths
+    magnitudes = acceleration_magnitudes(samples)
+
+    # 1. First free fall onset of each window, on zero-padded (D, L) magnitudes;
+    # the mask keeps onsets whose next sample is not padding
+    width = max(int(lengths.max()), 2)
+    valid = np.arange(width) < lengths[:, None]
+    padded = np.zeros((len(lengths), width), dtype=np.float32)
+    padded[valid] = magnitudes
+    onsets = (padded[:, :-1] > PRE_FALL_THRESHOLD) & (padded[:, 1:] < FREE_FALL_THRESHOLD) & valid[:, 1:]
+    has_free_fall = onsets.any(axis=1)
+    free_fall_index = onsets.argmax(axis=1)
+
+    # 2. First impact in the window after the onset
+    window, mask = _gather(magnitudes, offsets, free_fall_index + 1, windows.impact, lengths)
+    impacts = (window > IMPACT_THRESHOLD) & mask
+    fall_detected = has_free_fall & impacts.any(axis=1)
+    impact_index = np.where(fall_detected, free_fall_index + 1 + impacts.argmax(axis=1), 0)
+
+    # 3. Confidence, with the inactivity bonus when the whole window was received
+    post_impact, _ = _gather(magnitudes, offsets, impact_index + 1, windows.inactivity, lengths)
+    inactive = ((impact_index + windows.inactivity + 1 < lengths)
+                & (post_impact.std(axis=1, dtype=np.float64) < INACTIVITY_STD))
+    impact_value = padded[rows, impact_index].astype(np.float64)
+    confidence = np.round(np.minimum(100, (impact_value / IMPACT_THRESHOLD) * 70) + 20 * inactive)
+
+    # Fall type from the axis with the largest orientation change (first axis on ties)
+    pre_fall = _masked_mean(*_gather(samples, offsets, free_fall_index - windows.orientation,
+                                     windows.orientation, free_fall_index))
+    post_impact = _masked_mean(*_gather(samples, offsets, impact_index, windows.orientation, lengths))
+    delta = post_impact - pre_fall
+    axis = np.abs(delta).argmax(axis=1)
+    fall_types = np.select([np.isnan(delta[:, 0]), axis == 1, axis == 2, delta[:, 0] > 0],
+                           ["vertical", "sideways", "vertical", "forward"], "backward")
+
+    return [(True, int(confidence[row]), str(fall_types[row])) if fall_detected[row] else (False, 0, "unknown")
+            for row in rows]
+
+
+def analyze_batch(sample_windows, sample_rates=None, max_cells=FALL_BATCH_MAX_CELLS):
+    """
+    Detect falls in many sample windows at once (e.g. one per device).
+
+    Windows with the same sample rate are sorted by length and analyzed in
+    groups whose zero-padded (devices x longest window) magnitude array has at
+    most max_cells entries, so the detection runs vectorized across devices
+    with little padding. Results are those of analyze_samples.
+
+    Args:
+        sample_windows (list): (N, 3) float32 sample arrays, of any lengths
+        sample_rates (list): Sample rate of each window in Hz, at most
+            DETECTION_RATE (see resample); all DETECTION_RATE if None
+        max_cells (int): Maximum number of entries of a padded array
+
+    Returns:
+        list: (fall_detected, confidence, fall_type) per window, in input order
+    """
+    results = [(False, 0, "unknown")] * len(sample_windows)
+    lengths = np.array([len(window) for window in sample_windows], dtype=np.int64)
+    if sample_rates is None:
+        sample_rates = [DETECTION_RATE] * len(sample_windows)
+    sample_rates = np.asarray(sample_rates, dtype=np.float64)
+
+    for sample_rate in np.unique(sample_rates):
+        windows = detection_windows(float(sample_rate))
+        # Empty windows keep the no-fall result
+        same_rate = np.flatnonzero((sample_rates == sample_rate) & (lengths > 0))
+        order = same_rate[np.argsort(lengths[same_rate], kind='stable')]
+
+        start = 0
+        while start < len(order):
+            # Shortest first: the last window of a group is its longest
+            end = start + 1
+            while end < len(order) and (end - start + 1) * lengths[order[end]] <= max_cells:
+                end += 1
+            group = order[start:end]
+            samples = np.concatenate([sample_windows[index] for index in group])
+            for index, result in zip(group, _analyze_concatenated(samples, lengths[group], windows)):
+                results[index] = result
+            start = end
+    return results
+
+
+def analyze_accelerometer_data(accelerometer_data, sample_rate=None):
     """
     Analyze accelerometer data to detect falls.
-    
+
     Args:
-        accelerometer_data (list): List of dictionaries containing x, y, z accelerometer values
-        
+        accelerometer_data (list): List of dictionaries containing x, y, z accelerometer values,
+            and optionally a 'timestamp' in seconds
+        sample_rate (float): Declared sample rate in Hz; the timestamps take
+            precedence, DETECTION_RATE is assumed without either
+
     Returns:
         tuple: (fall_detected, confidence, fall_type)
     """
     try:
-        # Convert to numpy array for easier processing
         if isinstance(accelerometer_data, str):
             # If data is provided as a JSON string
             accelerometer_data = json.loads(accelerometer_data)
-            
-        # Extract x, y, z values
-        x_values = [data.get('x', 0) for data in accelerometer_data]
-        y_values = [data.get('y', 0) for data in accelerometer_data]
-        z_values = [data.get('z', 0) for data in accelerometer_data]
-
-
-        # print(x_values)
-        # print(y_values)
-        # print(z_values)
-        
-        # Calculate magnitude of acceleration
-        magnitudes = [np.sqrt(x**2 + y**2 + z**2) for x, y, z in zip(x_values, y_values, z_values)]
-        
-        # Simple fall detection algorithm
-        # Look for a pattern of: normal activity -> sudden drop -> impact -> inactivity
-        
-        fall_detected = False
-        free_fall_index = None
-        impact_index = None
-        
-        # 1. Check for free fall (sudden drop in acceleration)
-        for i in range(len(magnitudes) - 1):
-            if magnitudes[i] > 0.8 and magnitudes[i+1] < FREE_FALL_THRESHOLD:
-                print("Free fall detected at index:", i)
-                free_fall_index = i
-                break
-        
-        # 2. Check for impact after free fall
-        if free_fall_index is not None:
-            for i in range(free_fall_index + 1, min(free_fall_index + 15, len(magnitudes))):
-                if magnitudes[i] > IMPACT_THRESHOLD:
-                    impact_index = i
-                    fall_detected = True
-                    break
-        
-        # 3. Calculate confidence based on impact strength
-        confidence = 0
-        fall_type = "unknown"
-        
-        if fall_detected:
-            impact_value = magnitudes[impact_index]
-            confidence = min(100, (impact_value / IMPACT_THRESHOLD) * 70)
-            
-            # Check for inactivity after impact (optional)
-            if impact_index + 10 < len(magnitudes):
-                post_impact = magnitudes[impact_index+1:impact_index+10]
-                if np.std(post_impact) < 0.5:  # Low movement after impact
-                    confidence += 20
-            
-            # Determine fall type based on orientation changes
-            fall_type = determine_fall_type(x_values, y_values, z_values, free_fall_index, impact_index)
-        
-        return fall_detected, round(confidence), fall_type
+        samples, sample_rate = resample(to_sample_array(accelerometer_data), sample_rate,
+                                        sample_timestamps(accelerometer_data))
+        return analyze_samples(samples, sample_rate)
     except Exception as e:
         logger.exception("Error analyzing accelerometer data")
         # In case of error, default to safe behavior
         return False, 0, None
 
-def determine_fall_type(x_values, y_values, z_values, free_fall_index, impact_index):
-    """Determine the type of fall based on orientation changes."""
+
+def determine_fall_type(samples, free_fall_index, impact_index, window=ORIENTATION_WINDOW):
+    """Determine the type of fall based on orientation changes over window samples."""
     try:
-        # Get orientation before fall
-        pre_fall_x = np.mean(x_values[max(0, free_fall_index-5):free_fall_index])
-        pre_fall_y = np.mean(y_values[max(0, free_fall_index-5):free_fall_index])
-        pre_fall_z = np.mean(z_values[max(0, free_fall_index-5):free_fall_index])
-        
-        # Get orientation after impact
-        post_impact_x = np.mean(x_values[impact_index:min(len(x_values), impact_index+5)])
-        post_impact_y = np.mean(y_values[impact_index:min(len(y_values), impact_index+5)])
-        post_impact_z = np.mean(z_values[impact_index:min(len(z_values), impact_index+5)])
-        
+        # Get orientation before fall and after impact
+        pre_fall = samples[max(0, free_fall_index - window):free_fall_index]
+        post_impact = samples[impact_index:impact_index + window]
+        if len(pre_fall) == 0:
+            # No orientation before the fall: the changes are unknown
+            return "vertical"
+
         # Calculate changes in orientation
-        delta_x = post_impact_x - pre_fall_x
-        delta_y = post_impact_y - pre_fall_y
-        delta_z = post_impact_z - pre_fall_z
-        
+        delta_x, delta_y, delta_z = (post_impact.mean(axis=0, dtype=np.float64)
+                                     - pre_fall.mean(axis=0, dtype=np.float64)).tolist()
+
         # Determine fall type based on largest orientation change
         max_delta = max(abs(delta_x), abs(delta_y), abs(delta_z))
-        
+
         if max_delta == abs(delta_x):
             return "forward" if delta_x > 0 else "backward"
         elif max_delta == abs(delta_y):
@@ -113,4 +456,131 @@ def determine_fall_type(x_values, y_values, z_values, free_fall_index, impact_in
             return "vertical"
     except Exception as e:
         logger.error(f"Error determining fall type: {str(e)}")
-        return "unknown"
\ No newline at end of file
+        return "unknown"
+
+
+if __name__ == '__main__':
+    # Benchmark: the previous per-sample Python implementation vs. the
+    # vectorized analyzer, on windows with a fall near the end
+    import time
+
+    def previous_analyzer(accelerometer_data):
+        x_values = [data.get('x', 0) for data in accelerometer_data]
+        y_values = [data.get('y', 0) for data in accelerometer_data]
+        z_values = [data.get('z', 0) for data in accelerometer_data]
+        magnitudes = [np.sqrt(x**2 + y**2 + z**2) for x, y, z in zip(x_values, y_values, z_values)]
+        free_fall_index = impact_index = None
+        for i in range(len(magnitudes) - 1):
+            if magnitudes[i] > 0.8 and magnitudes[i+1] < FREE_FALL_THRESHOLD:
+                free_fall_index = i
+                break
+        if free_fall_index is not None:
+            for i in range(free_fall_index + 1, min(free_fall_index + 15, len(magnitudes))):
+                if magnitudes[i] > IMPACT_THRESHOLD:
+                    impact_index = i
+                    break
+        if impact_index is None:
+            return False, 0, "unknown"
+        confidence = min(100, (magnitudes[impact_index] / IMPACT_THRESHOLD) * 70)
+        if impact_index + 10 < len(magnitudes):
+            if np.std(magnitudes[impact_index+1:impact_index+10]) < 0.5:
+                confidence += 20
+        pre = [np.mean(values[max(0, free_fall_index-5):free_fall_index]) for values in (x_values, y_values, z_values)]
+        post = [np.mean(values[impact_index:impact_index+5]) for values in (x_values, y_values, z_values)]
+        delta_x, delta_y, delta_z = (b - a for a, b in zip(pre, post))
+        max_delta = max(abs(delta_x), abs(delta_y), abs(delta_z))
+        if max_delta == abs(delta_x):
+            fall_type = "forward" if delta_x > 0 else "backward"
+        elif max_delta == abs(delta_y):
+            fall_type = "sideways"
+        else:
+            fall_type = "vertical"
+        return True, round(confidence), fall_type
+
+    rng = np.random.default_rng(0)
+    fall = np.array([[0.0, 0.0, 1.0]] * 5 + [[0.05, 0.05, 0.1]] * 6 + [[3.5, 1.0, 0.5]]
+                    + [[1.0, 0.0, 0.1]] * 12, dtype=np.float32)
+    for size in (100, 1000, 10000, 100000):
+        trace = rng.normal([0.0, 0.0, 1.0], 0.05, (size, 3)).astype(np.float32)
+        trace[-len(fall) - 10:-10] = fall
+        accelerometer_data = [dict(zip(AXES, sample)) for sample in trace.tolist()]
+        repeat = max(3, 20000 // size)
+
+        timings = {}
+        results = {}
+        for name, fn, data in [('previous', previous_analyzer, accelerometer_data),
+                               ('vectorized', analyze_accelerometer_data, accelerometer_data),
+                               ('array', analyze_samples, trace)]:
+            results[name] = fn(data)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn(data)
+            timings[name] = (time.perf_counter() - start) / repeat * 1000
+
+        assert results['previous'] == results['vectorized'] == results['array'], results
+        print(f"{size:>7} samples: previous {timings['previous']:8.2f} ms, "
+              f"vectorized {timings['vectorized']:7.2f} ms ({timings['previous'] / timings['vectorized']:.1f}x), "
+              f"from array {timings['array']:6.3f} ms   {results['vectorized']}")
+
+    # Batch: one window per device, analyzed one by one vs. together
+    for devices in (10, 100, 1000):
+        windows = []
+        for device in range(devices):
+            window = rng.normal([0.0, 0.0, 1.0], 0.05, (int(rng.integers(200, 500)), 3)).astype(np.float32)
+            if device % 10 == 0:
+                window[-len(fall) - 10:-10] = fall
+            windows.append(window)
+        repeat = max(3, 2000 // devices)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            one_by_one = [analyze_samples(window) for window in windows]
+        single = (time.perf_counter() - start) / repeat * 1000
+        start = time.perf_counter()
+        for _ in range(repeat):
+            batched = analyze_batch(windows)
+        batch = (time.perf_counter() - start) / repeat * 1000
+
+        assert one_by_one == batched
+        print(f"{devices:>5} devices: one by one {single:7.2f} ms, batch {batch:6.2f} ms ({single / batch:.1f}x)")
+
+    # Sample rates: synthetic forward falls (sudden drop, 250-400 ms free fall,
+    # 50-80 ms impact peak, lying still) and sit-downs, sampled at different
+    # rates with 5% timestamp jitter. Detection with the fixed sample windows
+    # vs. resampled, rate-aware windows.
+    def synthetic_trace(sample_rate, fall, duration=4.0):
+        t = np.sort((np.arange(int(duration * sample_rate)) + rng.random()
+                     + rng.normal(0, 0.05, int(duration * sample_rate))) / sample_rate)
+        trace = np.zeros((len(t), 3))
+        trace[:, 2] = 1 + 0.1 * np.sin(2 * np.pi * 1.8 * t)  # Walking
+        start = rng.uniform(1.0, 2.0)
+        if fall:
+            drop, free_fall, width = rng.uniform(0.005, 0.015), rng.uniform(0.25, 0.4), rng.uniform(0.05, 0.08)
+            dropping = (t >= start) & (t < start + drop)
+            trace[dropping, 2] = 1 - 0.9 * (t[dropping] - start) / drop
+            trace[(t >= start + drop) & (t < start + free_fall), 2] = 0.1
+            impact = start + free_fall
+            trace[t >= impact] = [1.0, 0.0, 0.1]
+            peak = (t >= impact) & (t < impact + width)
+            trace[peak, 0] += rng.uniform(2.6, 5.0) * np.sin(np.pi * (t[peak] - impact) / width)
+        else:
+            sitting = (t >= start) & (t < start + 0.3)
+            trace[sitting, 2] = 1 - 0.5 * np.sin(np.pi * (t[sitting] - start) / 0.3)
+            landing = (t >= start + 0.3) & (t < start + 0.45)
+            trace[landing, 2] = 1 + 0.9 * np.sin(np.pi * (t[landing] - start - 0.3) / 0.15)
+        trace += rng.normal(0, 0.02, trace.shape)
+        return trace.astype(np.float32), t * 1000
+
+    traces = 200
+    print(f"\n{'rate':>7}  {'fixed windows':>13}  {'rate-aware':>10}  {'timestamps':>10}  {'sit-downs':>9}")
+    for sample_rate in (5, 10, 20, 25, 50, 100, 200):
+        detected = {'fixed': 0, 'rate': 0, 'timestamps': 0, 'sit-downs': 0}
+        for _ in range(traces):
+            trace, timestamps = synthetic_trace(sample_rate, fall=True)
+            detected['fixed'] += analyze_samples(trace)[0]
+            detected['rate'] += analyze_samples(*resample(trace, sample_rate))[0]
+            detected['timestamps'] += analyze_samples(*resample(trace, timestamps=timestamps))[0]
+            trace, timestamps = synthetic_trace(sample_rate, fall=False)
+            detected['sit-downs'] += analyze_samples(*resample(trace, timestamps=timestamps))[0]
+        print(f"{sample_rate:>4} Hz  {detected['fixed'] / traces:>13.0%}  {detected['rate'] / traces:>10.0%}  "
+              f"{detected['timestamps'] / traces:>10.0%}  {detected['sit-downs'] / traces:>9.0%}")
@@ -0,0 +1,378 @@
+"""
+fall_monitor.py - Incremental, per-device fall detection
+
+Wearables upload accelerometer samples in small consecutive batches. Each
+device gets a FallDetector that keeps the last few samples in a ring buffer
+and a small state machine (normal -> free fall -> impact -> inactivity check),
+so a fall that straddles two uploads is still found and every sample is
+examined once. The thresholds and windows are those of
+ai.fall_detection.analyze_accelerometer_data.
+
+Each detector runs at its device's declared sample rate, or the rate
+measured from the samples' timestamps (like /api/fall-detection/analyze,
+rates within NATIVE_RATE_TOLERANCE of DETECTION_RATE count as native). Input
+faster than DETECTION_RATE is decimated as it arrives, binned by timestamp
+when the samples have one, keeping the samples of a partially received
+output bin until the bin is complete. A device should either always or never
+send timestamps.
+
+Unlike the one-shot analyzer, which only examines the first free fall of a
+window, the detector keeps scanning after a free fall without impact and
+after a reported fall. A fall is reported once the inactivity window after
+its impact has been received.
+
+Detectors are kept in an LRU store and expire after a period of inactivity.
+"""
+
+import os
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from ai.fall_detection import (DETECTION_RATE, NATIVE_RATE_TOLERANCE, acceleration_magnitudes, decimate,
+                               decimation_bins, detection_windows, determine_fall_type, fall_confidence,
+                               find_impact, is_inactive_after, measured_sample_rate, nominal_sample_rate,
+                               time_bins, to_sample_array, PRE_FALL_THRESHOLD, FREE_FALL_THRESHOLD)
+from ai.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Detector store limits (override through the environment)
+FALL_DEVICE_MAX = int(os.environ.get('FALL_DEVICE_MAX', 10000))
+FALL_DEVICE_TTL = float(os.environ.get('FALL_DEVICE_TTL', 600))  # seconds idle before eviction
+
+NORMAL = 'normal'
+FREE_FALL = 'free_fall'
+IMPACT = 'impact'  # Waiting for the inactivity window after the impact
+
+
+class FallDetector:
+    """Fall detection state for a single device."""
+
+    __slots__ = ('sample_rate', 'rate', '_windows', '_pending', '_pending_bins', '_origin', '_last_timestamp',
+                 '_timestamped', '_next_bin', 'received',
+                 '_samples', '_head', '_stored', 'count', 'state',
+                 '_cursor', '_free_fall_index', '_impact_index', 'falls_detected', 'lock')
+
+    def __init__(self, sample_rate: float = DETECTION_RATE):
+        """
+        Initialize the detector.
+
+        Args:
+            sample_rate: Sample rate of the device in Hz
+        """
+        self.sample_rate = sample_rate
+        self.rate = min(sample_rate, DETECTION_RATE)  # Rate the detector runs at
+        self._windows = detection_windows(self.rate)
+        self._pending = np.empty((0, 3), dtype=np.float32)  # Input samples of an incomplete output bin
+        self._pending_bins = np.empty(0, dtype=np.int64)  # Their output bins (timestamped input)
+        self._origin = None  # First timestamp (ms) received, that of output bin 0
+        self._last_timestamp = None
+        self._timestamped = 0  # Timestamped input samples received so far
+        self._next_bin = 0  # First output bin not yet produced (timestamped input)
+        self.received = 0  # Input samples received so far
+        # Ring buffer of the most recent (x, y, z) samples, as many as a pending
+        # fall can still need: the orientation window before the free fall
+        # onset, the onset, the impact window and the inactivity window plus
+        # the sample that must follow it
+        history_size = (self._windows.orientation + 1 + self._windows.impact
+                        + self._windows.inactivity + 1)
+        self._samples = np.zeros((history_size, 3), dtype=np.float32)
+        self._head = 0  # Next slot to write
+        self._stored = 0
+        self.count = 0  # Samples at the detector rate so far; detector indices count from the first one
+        self.state = NORMAL
+        self._cursor = 0  # First sample not yet examined as a free fall onset
+        self._free_fall_index = None
+        self._impact_index = None
+        self.falls_detected = 0
+        self.lock = threading.Lock()
+
+    def _push(self, samples: np.ndarray):
+        """Append samples, overwriting the oldest when full."""
+        size = len(self._samples)
+        samples = samples[-size:]
+        first = min(len(samples), size - self._head)
+        self._samples[self._head:self._head + first] = samples[:first]
+        self._samples[:len(samples) - first] = samples[first:]
+        self._head = (self._head + len(samples)) % size
+        self._stored = min(self._stored + len(samples), size)
+
+    def _window(self, samples: np.ndarray) -> np.ndarray:
+        """Return the buffered samples followed by the new ones, oldest first."""
+        window = np.empty((self._stored + len(samples), 3), dtype=np.float32)
+        wrapped = self._stored - self._head  # Buffered samples at the end of the ring
+        if wrapped > 0:
+            window[:wrapped] = self._samples[-wrapped:]
+        window[max(0, wrapped):self._stored] = self._samples[max(0, -wrapped):self._head]
+        window[self._stored:] = samples
+        return window
+
+    def _decimate(self, samples: np.ndarray) -> np.ndarray:
+        """Decimate input samples to DETECTION_RATE, holding back an incomplete last bin."""
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        first_index = self.received - len(self._pending)
+        self.received = first_index + len(samples)
+        bins = decimation_bins(first_index, len(samples), self.sample_rate)
+        # A bin is complete once the next input sample falls into a later one
+        complete = bins < decimation_bins(self.received, 1, self.sample_rate)[0]
+        self._pending = samples[~complete]
+        if not complete.any():
+            return self._pending[:0]
+        return decimate(samples[complete], bins[complete])
+
+    def _decimate_timed(self, samples: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+        """Decimate timestamped input samples to DETECTION_RATE by time, holding back the last bin."""
+        self.received += len(samples)
+        bins = time_bins(timestamps, self._origin)
+        # Samples of bins already produced (overlapping uploads) come too late
+        current = bins >= self._next_bin
+        samples = np.concatenate((self._pending, samples[current]))
+        bins = np.concatenate((self._pending_bins, bins[current]))
+        if not len(samples):
+            return samples
+        order = np.argsort(bins, kind='stable')
+        samples, bins = samples[order], bins[order]
+
+        # The last bin is complete once a sample of a later bin arrives
+        complete = bins < bins[-1]
+        self._pending, self._pending_bins = samples[~complete], bins[~complete]
+        if not complete.any():
+            return samples[:0]
+        samples, bins = samples[complete], bins[complete]
+
+        gap = int(bins[0]) - self._next_bin  # Bins without samples since the last output
+        self._next_bin = int(bins[-1]) + 1
+        decimated = decimate(samples, bins)
+        if gap > len(self._samples) or (gap > 0 and not self._stored):
+            # Samples were lost for longer than any pending fall could wait
+            # (or none came before): start over at the first new bin
+            self.count += gap
+            self._stored = self._head = 0
+            self._cursor = self.count
+            self.state = NORMAL
+        elif gap > 0:
+            # Like decimate, repeat the previous sample over the gap
+            previous = self._samples[self._head - 1]
+            decimated = np.concatenate((np.repeat(previous[None], gap, axis=0), decimated))
+        return decimated
+
+    def continue_from(self, previous: 'FallDetector'):
+        """Keep the timestamp origin of the detector this one replaces, so bins stay aligned."""
+        self._origin = previous._origin
+        self._last_timestamp = previous._last_timestamp
+        self._timestamped = previous._timestamped
+
+    def measure_rate(self, timestamps: np.ndarray) -> Optional[float]:
+        """
+        Sample rate (Hz) measured over every timestamped sample received so far plus these.
+
+        Single uploads hold too few samples to measure the rate reliably;
+        over the whole stream the jitter averages out.
+        """
+        if self._origin is None:
+            return measured_sample_rate(timestamps)
+        duration = max(self._last_timestamp, timestamps.max()) - min(self._origin, timestamps.min())
+        samples = self._timestamped + len(timestamps)
+        return (samples - 1) * 1000 / duration if samples > 1 and duration > 0 else None
+
+    def update(self, samples: Any, timestamps: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+        """
+        Consume newly received samples.
+
+        Only the new samples and the few buffered ones a pending fall still
+        needs are examined.
+
+        Args:
+            samples: New samples, in any format accepted by to_sample_array
+            timestamps: Optional per-sample timestamps in ms (see
+                ai.fall_detection.sample_timestamps); input faster than
+                DETECTION_RATE is then decimated by time
+
+        Returns:
+            Falls completed by these samples (usually none), each a dict with
+            confidence, fallType, sampleIndex (index of the impact sample at
+            the detector rate) and timeMs (time of the impact since the first
+            sample)
+        """
+        samples = to_sample_array(samples)
+        if timestamps is not None and len(timestamps) != len(samples):
+            timestamps = None
+        if timestamps is not None and len(timestamps):
+            if self._origin is None:
+                self._origin = self._last_timestamp = timestamps.min()
+            self._last_timestamp = max(self._last_timestamp, timestamps.max())
+            self._timestamped += len(timestamps)
+
+        if self.sample_rate > DETECTION_RATE and timestamps is not None:
+            samples = self._decimate_timed(samples, timestamps)
+        elif self.sample_rate > DETECTION_RATE:
+            samples = self._decimate(samples)
+        else:
+            self.received += len(samples)
+        if not len(samples):
+            return []
+
+        window = self._window(samples)
+        base = self.count - self._stored  # Detector index of window[0]
+        magnitudes = acceleration_magnitudes(window)
+        onsets = None
+        falls = []
+
+        while True:
+            if self.state == NORMAL:
+                if onsets is None:
+                    onsets = np.flatnonzero((magnitudes[:-1] > PRE_FALL_THRESHOLD) &
+                                            (magnitudes[1:] < FREE_FALL_THRESHOLD))
+                position = np.searchsorted(onsets, self._cursor - base)
+                if position == len(onsets):
+                    # The last sample still needs its successor
+                    self._cursor = base + len(window) - 1
+                    break
+                self._free_fall_index = base + int(onsets[position])
+                self.state = FREE_FALL
+
+            free_fall_index = self._free_fall_index - base
+            if self.state == FREE_FALL:
+                impact_index = find_impact(magnitudes, free_fall_index, self._windows.impact)
+                if impact_index is not None:
+                    self._impact_index = base + impact_index
+                    self.state = IMPACT
+                elif free_fall_index + self._windows.impact < len(window):
+                    # No impact: look for the next free fall
+                    self._cursor = self._free_fall_index + 1
+                    self.state = NORMAL
+                    continue
+                else:
+                    break
+
+            impact_index = self._impact_index - base
+            if impact_index + self._windows.inactivity + 1 >= len(window):
+                break
+            falls.append({
+                'confidence': fall_confidence(magnitudes[impact_index],
+                                              is_inactive_after(magnitudes, impact_index, self._windows.inactivity)),
+                'fallType': determine_fall_type(window, free_fall_index, impact_index, self._windows.orientation),
+                'sampleIndex': self._impact_index,
+                'timeMs': round(self._impact_index * 1000 / self.rate)
+            })
+            self.falls_detected += 1
+            self._cursor = self._impact_index + 1
+            self.state = NORMAL
+
+        self._push(samples)
+        self.count += len(samples)
+        return falls
+
+
+class FallDetectorStore:
+    """Device-keyed store of FallDetector objects with LRU/TTL eviction."""
+
+    def __init__(self, max_devices: int = FALL_DEVICE_MAX, ttl: float = FALL_DEVICE_TTL):
+        self._detectors = TTLCache(max_size=max_devices, ttl=ttl)
+
+    def __len__(self) -> int:
+        return len(self._detectors)
+
+    def get(self, device_id: str, sample_rate: Optional[float] = DETECTION_RATE,
+            tolerance: float = 0.0) -> FallDetector:
+        """
+        Return the detector for a device, creating it on first use or when the sample rate changed.
+
+        Args:
+            device_id: Device the detector belongs to
+            sample_rate: Sample rate of the device in Hz; None keeps the
+                current detector (DETECTION_RATE for a new one)
+            tolerance: Relative rate difference still treated as the same rate
+                (for measured rates, which jitter between uploads)
+        """
+        detector = self._detectors.get_or_create(device_id, lambda: FallDetector(sample_rate or DETECTION_RATE))
+        if sample_rate is not None and abs(sample_rate - detector.sample_rate) > tolerance * detector.sample_rate:
+            logger.info(f"Sample rate of device {device_id} changed to {sample_rate} Hz, restarting detection")
+            detector, previous = FallDetector(sample_rate), detector
+            detector.continue_from(previous)
+            self._detectors.put(device_id, detector)
+        return detector
+
+    def discard(self, device_id: str):
+        """Drop a device's state (e.g. when the wearer takes the device off)."""
+        self._detectors.pop(device_id)
+
+    def update(self, device_id: str, samples: Any, sample_rate: Optional[float] = None,
+               timestamps: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """
+        Feed a device's new samples to its detector.
+
+        Args:
+            device_id: Device the samples come from
+            samples: New samples, in any format accepted by to_sample_array
+            sample_rate: Declared sample rate of the device in Hz
+                (DETECTION_RATE if None)
+            timestamps: Optional per-sample timestamps in ms; the rate they
+                measure takes precedence over the declared one
+
+        Returns:
+            Dict with the falls completed by these samples, the detector state
+            and the number of samples received from the device so far
+        """
+        tolerance = 0.0
+        if timestamps is None:
+            sample_rate = sample_rate or DETECTION_RATE
+        else:
+            # Like /api/fall-detection/analyze, the timestamps take precedence;
+            # with too few samples to measure, the current detector is kept
+            detector = self._detectors.get(device_id)
+            measured_rate = (detector.measure_rate(timestamps) if detector is not None
+                             else measured_sample_rate(timestamps))
+            if measured_rate is not None:
+                sample_rate = nominal_sample_rate(measured_rate)
+            tolerance = NATIVE_RATE_TOLERANCE
+        detector = self.get(device_id, sample_rate, tolerance)
+        with detector.lock:
+            falls = detector.update(samples, timestamps)
+            return {'falls': falls, 'state': detector.state, 'samplesProcessed': detector.received}
+
+    def stats(self) -> Dict[str, int]:
+        return {'devices': len(self._detectors)}
+
+
+fall_detectors = FallDetectorStore()
+
+
+if __name__ == '__main__':
+    # Benchmark: the client resending a sliding window of JSON samples on
+    # every upload vs. sending only the new samples to the incremental detector
+    import time
+
+    from ai.fall_detection import AXES, analyze_accelerometer_data
+
+    upload_size = 10  # One second at the app's 10 Hz
+    window_size = 50  # The app's five second analysis window
+    uploads = 1000
+    rng = np.random.default_rng(0)
+    trace = rng.normal([0.0, 0.0, 1.0], 0.05, (upload_size * uploads, 3)).astype(np.float32)
+    fall = np.array([[0.0, 0.0, 1.0]] * 5 + [[0.05, 0.05, 0.1]] * 6 + [[3.5, 1.0, 0.5]]
+                    + [[1.0, 0.0, 0.1]] * 12, dtype=np.float32)
+    # A fall straddling two uploads
+    trace[upload_size * 500 - 10:upload_size * 500 - 10 + len(fall)] = fall
+    accelerometer_data = [dict(zip(AXES, sample)) for sample in trace.tolist()]
+    ends = range(upload_size, len(trace) + 1, upload_size)
+
+    start = time.perf_counter()
+    for end in ends:
+        analyze_accelerometer_data(accelerometer_data[max(0, end - window_size):end])
+    windowed = (time.perf_counter() - start) / uploads * 1e6
+
+    detector = FallDetector()
+    falls = []
+    start = time.perf_counter()
+    for end in ends:
+        falls.extend(detector.update(accelerometer_data[end - upload_size:end]))
+    incremental = (time.perf_counter() - start) / uploads * 1e6
+
+    print(f"sliding {window_size}-sample window: {windowed:.1f} us/upload")
+    print(f"incremental {upload_size}-sample uploads: {incremental:.1f} us/upload ({windowed / incremental:.1f}x)")
+    print(f"falls: {falls}")
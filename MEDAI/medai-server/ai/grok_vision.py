@@ -1,37 +1,42 @@
 # ai/groq_vision.py
-import os
-import base64
-import requests
 import json
 import logging
 from typing import Dict, Any, Optional
 
+from ai.result_cache import vision_result_cache
+from ai.structured_output import StructuredOutputError, structured_completion
+from ai.vision_images import VisionImage
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Configure Groq API settings
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "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")
-GROQ_API_ENDPOINT = "https://api.groq.com/openai/v1/chat/completions"
-
 class GroqVision:
     """Groq Vision LLM integration for analyzing medical images"""
     
+    # Bump when the medication prompt or output format changes (invalidates cached results)
+    MEDICATION_PROMPT_VERSION = 1
+    
+    # Structures the LLM responses are validated against while they stream
+    PRESCRIPTION_SCHEMA = {
+        'type': 'object',
+        'properties': {
+            'medicines': {'type': 'array', 'items': {'type': 'object'}}
+        }
+    }
+    MEDICATION_SCHEMA = {'type': 'object'}
+    
     @staticmethod
-    def analyze_prescription(image_path: str) -> Dict[str, Any]:
+    def analyze_prescription(image: VisionImage) -> Dict[str, Any]:
         """
         Analyze a prescription image using Groq Vision
         
         Args:
-            image_path: Path to the prescription image
+            image: Validated prescription image (see ai.vision_images)
             
         Returns:
             Dict containing extracted prescription information
         """
         try:
-            # Convert image to base64
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-            
             # Create a more structured prompt for prescription analysis
             combined_prompt = """
             You are a specialized medical data extraction AI. Analyze the prescription image and extract ONLY the following data in JSON format:
@@ -63,74 +68,40 @@ class GroqVision:
             Do not include any explanations, descriptions, or analysis outside the JSON structure.
             """
             
-            # Call Groq Vision API
-            response = requests.post(
-                GROQ_API_ENDPOINT,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {GROQ_API_KEY}"
-                },
-                json={
-                    "model": "meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq model
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": combined_prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                            ]
-                        }
-                    ],
-                    "temperature": 0.2,
-                    "max_tokens": 1024
-                }
+            # Call Groq Vision API; malformed JSON is caught while it streams
+            content = structured_completion(
+                GroqVision.PRESCRIPTION_SCHEMA,
+                label='prescription',
+                model="meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq model
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": combined_prompt},
+                            {"type": "image_url", "image_url": {"url": image.data_uri}}
+                        ]
+                    }
+                ],
+                temperature=0.2,
+                max_tokens=1024
             )
             
-            # Parse the response
-            if response.status_code == 200:
-                result = response.json()
-                # Extract content from Groq's response structure
-                content_text = result['choices'][0]['message']['content']
-
-                print(f"Groq response: {content_text}")
-                
-                # Try to extract JSON from the response
-                # First, check if the entire response is valid JSON
-                try:
-                    content = json.loads(content_text)
-                except json.JSONDecodeError:
-                    # If not, try to extract JSON from the text (in case there's extra text)
-                    try:
-                        # Look for JSON pattern
-                        import re
-                        json_pattern = r'({[\s\S]*})'
-                        match = re.search(json_pattern, content_text)
-                        if match:
-                            json_str = match.group(1)
-                            content = json.loads(json_str)
-                        else:
-                            # Fallback to default structure
-                            content = {"date": None, "medicines": []}
-                    except Exception:
-                        content = {"date": None, "medicines": []}
-                
-                # Ensure proper structure
-                if 'medicines' not in content:
-                    content['medicines'] = []
-                if 'date' not in content:
-                    content['date'] = None
-                
-                # Normalize the data format
-                for medicine in content['medicines']:
-                    for field in ['name', 'dosage', 'frequency', 'quantity', 'pillsPerDay']:
-                        if field not in medicine:
-                            medicine[field] = None
-                
-                return content
-            else:
-                logger.error(f"Groq API Error: {response.status_code} - {response.text}")
-                raise Exception(f"Groq API Error: {response.status_code}")
-                
+            print(f"Groq response: {json.dumps(content)}")
+            
+            # Ensure proper structure
+            if 'medicines' not in content:
+                content['medicines'] = []
+            if 'date' not in content:
+                content['date'] = None
+            
+            # Normalize the data format
+            for medicine in content['medicines']:
+                for field in ['name', 'dosage', 'frequency', 'quantity', 'pillsPerDay']:
+                    if field not in medicine:
+                        medicine[field] = None
+            
+            return content
+            
         except Exception as e:
             logger.exception(f"Error analyzing prescription with Groq: {str(e)}")
             # Return default structure if analysis fails
@@ -140,20 +111,22 @@ class GroqVision:
             }
     
     @staticmethod
-    def identify_medication(image_path: str) -> Dict[str, Any]:
+    def identify_medication(image: VisionImage) -> Dict[str, Any]:
         """
         Identify medication from an image using Groq Vision
         
         Args:
-            image_path: Path to the medication image
+            image: Validated medication image (see ai.vision_images)
             
         Returns:
             Dict containing identified medication information
         """
         try:
-            # Convert image to base64
-            with open(image_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            # Re-scans of the same box are answered from the result cache
+            cache_key = vision_result_cache.key('medicine', GroqVision.MEDICATION_PROMPT_VERSION, image)
+            cached = vision_result_cache.get(cache_key)
+            if cached is not None:
+                return cached
             
             # Create a structured prompt for medication identification
             combined_prompt = """
@@ -177,76 +150,48 @@ class GroqVision:
             Do not include any explanations, descriptions, or analysis outside the JSON structure.
             """
             
-            # Call Groq Vision API
-            response = requests.post(
-                GROQ_API_ENDPOINT,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {GROQ_API_KEY}"
-                },
-                json={
-                    "model": "meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq model
-                    "messages": [
+            parsed = True
+            try:
+                # Call Groq Vision API; malformed JSON is caught while it streams
+                content = structured_completion(
+                    GroqVision.MEDICATION_SCHEMA,
+                    label='medication identification',
+                    model="meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq model
+                    messages=[
                         {
                             "role": "user",
                             "content": [
                                 {"type": "text", "text": combined_prompt},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                                {"type": "image_url", "image_url": {"url": image.data_uri}}
                             ]
                         }
                     ],
-                    "temperature": 0.2,
-                    "max_tokens": 1024
+                    temperature=0.2,
+                    max_tokens=1024
+                )
+                print(f"Groq response: {json.dumps(content)}")
+            except StructuredOutputError as e:
+                logger.error(f"Error parsing medication JSON: {str(e)}")
+                # Fallback to default structure
+                parsed = False
+                content = {
+                    "name": None,
+                    "pillCount": None,
+                    "expiryDate": None,
+                    "description": "Could not analyze medication image"
                 }
-            )
             
-            # Parse the response
-            if response.status_code == 200:
-                result = response.json()
-                # Extract content from Groq's response structure
-                content_text = result['choices'][0]['message']['content']
-                print(f"Groq response: {content_text}")
-                
-                # Try to extract JSON from the response
-                # First, check if the entire response is valid JSON
-                try:
-                    content = json.loads(content_text)
-                except json.JSONDecodeError:
-                    # If not, try to extract JSON from the text (in case there's extra text)
-                    try:
-                        # Look for JSON pattern
-                        import re
-                        json_pattern = r'({[\s\S]*})'
-                        match = re.search(json_pattern, content_text)
-                        if match:
-                            json_str = match.group(1)
-                            content = json.loads(json_str)
-                        else:
-                            # Fallback to default structure
-                            content = {
-                                "name": None,
-                                "pillCount": None,
-                                "expiryDate": None,
-                                "description": "Could not analyze medication image"
-                            }
-                    except Exception:
-                        content = {
-                            "name": None,
-                            "pillCount": None,
-                            "expiryDate": None,
-                            "description": "Could not analyze medication image"
-                        }
-                
-                # Ensure proper structure
-                for required_field in ['name', 'pillCount', 'expiryDate', 'description']:
-                    if required_field not in content:
-                        content[required_field] = None
-                
-                return content
-            else:
-                logger.error(f"Groq API Error: {response.status_code} - {response.text}")
-                raise Exception(f"Groq API Error: {response.status_code}")
-                
+            # Ensure proper structure
+            for required_field in ['name', 'pillCount', 'expiryDate', 'description']:
+                if required_field not in content:
+                    content[required_field] = None
+            
+            # Only answers the model actually gave are worth reusing
+            if parsed:
+                vision_result_cache.put(cache_key, content)
+            
+            return content
+            
         except Exception as e:
             logger.exception(f"Error identifying medication with Groq: {str(e)}")
             # Return default structure if analysis fails
@@ -0,0 +1,215 @@
+"""
+inference_batcher.py - Micro-batching scheduler for model inference
+
+Concurrent requests each submit a single input and wait on a future. A
+worker thread collects inputs for a short window (or until the batch is
+full), runs them through the model as one batched call and hands each
+result back to its waiting request. This amortizes per-call dispatch
+overhead when many clients are streaming frames at once.
+"""
+
+import os
+import threading
+import time
+import logging
+import queue
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Batching limits (override through the environment)
+BATCH_MAX_SIZE = int(os.environ.get('POSE_BATCH_MAX_SIZE', 8))
+BATCH_WINDOW_MS = float(os.environ.get('POSE_BATCH_WINDOW_MS', 5))
+BATCH_TIMEOUT = float(os.environ.get('POSE_BATCH_TIMEOUT', 10))  # seconds a request waits for its result
+
+LATENCY_SAMPLE_SIZE = 2048  # Recent requests kept for percentile metrics
+
+
+class BatchStats:
+    """Rolling throughput and latency metrics for an InferenceBatcher."""
+
+    def __init__(self, max_size: int, sample_size: int = LATENCY_SAMPLE_SIZE):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=sample_size)  # submit -> result, seconds
+        self._completions = deque(maxlen=sample_size)  # completion timestamps
+        self._batch_sizes = [0] * (max_size + 1)
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._model_time = 0.0
+
+    def record_batch(self, size: int, model_time: float, latencies: List[float], failed: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            self._batches += 1
+            self._requests += size
+            self._batch_sizes[size] += 1
+            self._model_time += model_time
+            if failed:
+                self._errors += size
+            self._latencies.extend(latencies)
+            self._completions.extend([now] * size)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return current metrics as a JSON-serializable dictionary."""
+        with self._lock:
+            latencies = np.array(self._latencies, dtype=np.float64)
+            completions = list(self._completions)
+            batch_sizes = list(self._batch_sizes)
+            requests, batches, errors, model_time = self._requests, self._batches, self._errors, self._model_time
+
+        throughput = 0.0
+        if len(completions) > 1 and completions[-1] > completions[0]:
+            throughput = (len(completions) - 1) / (completions[-1] - completions[0])
+
+        def percentile(q):
+            return round(float(np.percentile(latencies, q)) * 1000, 2) if len(latencies) else None
+
+        return {
+            'requests': requests,
+            'batches': batches,
+            'errors': errors,
+            'mean_batch_size': round(requests / batches, 2) if batches else 0.0,
+            'batch_size_histogram': {str(i): n for i, n in enumerate(batch_sizes) if n},
+            'throughput_fps': round(throughput, 2),
+            'latency_ms': {
+                'p50': percentile(50),
+                'p95': percentile(95),
+                'p99': percentile(99),
+                'max': round(float(latencies.max()) * 1000, 2) if len(latencies) else None
+            },
+            'model_time_per_batch_ms': round(model_time / batches * 1000, 2) if batches else None
+        }
+
+
+class InferenceBatcher:
+    """Collects single inputs from concurrent callers and runs them as batches."""
+
+    def __init__(self, run_batch: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = BATCH_MAX_SIZE,
+                 window_ms: float = BATCH_WINDOW_MS,
+                 name: str = 'inference-batcher'):
+        """
+        Initialize the batcher and start its worker thread.
+
+        Args:
+            run_batch: Function taking a stacked (N, ...) input array and returning
+                       an array whose first dimension has one result per input
+            max_batch_size: Largest batch passed to run_batch
+            window_ms: How long to wait for more inputs after the first one arrives
+            name: Name of the worker thread
+        """
+        self._run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.stats = BatchStats(self.max_batch_size)
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._serve, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item: np.ndarray) -> Future:
+        """
+        Queue one input; the returned future resolves to its result.
+
+        The input is copied, so the caller may reuse its buffer as soon as
+        submit returns, even while the batch holding it is being stacked.
+        """
+        future = Future()
+        self._queue.put((np.array(item, copy=True), future, time.monotonic()))
+        return future
+
+    def infer(self, item: np.ndarray, timeout: Optional[float] = BATCH_TIMEOUT) -> np.ndarray:
+        """
+        Submit one input and block until its result is ready.
+
+        On timeout the request is cancelled so it does not take up a slot
+        in a later batch.
+        """
+        future = self.submit(item)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def _collect(self) -> list:
+        """Block for the first request, then gather more until the window closes or the batch is full."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Window closed: only take what is already waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._collect()
+            # Skip requests whose callers already gave up
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.monotonic()
+            failed = False
+            try:
+                outputs = self._run_batch(np.stack([item for item, _, _ in batch]))
+                if len(outputs) != len(batch):
+                    raise ValueError(f"Model returned {len(outputs)} results for a batch of {len(batch)}")
+                for (_, future, _), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                failed = True
+                logger.error(f"Batched inference failed for {len(batch)} requests: {str(e)}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            finished = time.monotonic()
+            self.stats.record_batch(len(batch), finished - started,
+                                    [finished - submitted for _, _, submitted in batch], failed)
+
+
+if __name__ == '__main__':
+    # Benchmark: sequential single calls vs. concurrent batched calls with a
+    # dummy model that has a fixed per-call cost plus a small per-item cost.
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description='Micro-batching benchmark')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--call-ms', type=float, default=8.0, help='fixed cost per model call')
+    parser.add_argument('--item-ms', type=float, default=1.0, help='extra cost per batch item')
+    args = parser.parse_args()
+
+    def dummy_model(batch):
+        time.sleep((args.call_ms + args.item_ms * len(batch)) / 1000.0)
+        return batch.reshape(len(batch), -1)[:, :51].reshape(-1, 17, 3)
+
+    frame = np.zeros((256, 256, 3), dtype=np.uint8)
+
+    start = time.monotonic()
+    for _ in range(args.requests):
+        dummy_model(frame[None])
+    sequential = time.monotonic() - start
+
+    batcher = InferenceBatcher(dummy_model)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        list(pool.map(lambda _: batcher.infer(frame), range(args.requests)))
+    batched = time.monotonic() - start
+
+    print(f"sequential: {args.requests / sequential:.1f} req/s")
+    print(f"batched ({args.clients} clients): {args.requests / batched:.1f} req/s")
+    print(batcher.stats.snapshot())
@@ -0,0 +1,491 @@
+"""
+llm_gateway.py - Shared, pooled client for all Groq LLM calls
+
+Every chat, vision and feedback request goes through one gateway instead of
+a fresh connection per call:
+
+- One Groq SDK client on a keep-alive httpx connection pool (HTTP/2 when
+  the 'h2' package is installed), so TLS setup is paid once per connection
+  rather than once per request.
+- At most LLM_MAX_CONCURRENCY calls in flight; callers wait up to
+  LLM_QUEUE_TIMEOUT seconds for a slot.
+- Per-call timeouts (LLM_TIMEOUT by default).
+- Retries with jittered exponential backoff on 429, 5xx and connection
+  errors (honouring Retry-After).
+- A circuit breaker: after LLM_BREAKER_THRESHOLD consecutive failures, calls
+  fail fast with LLMUnavailableError for LLM_BREAKER_COOLDOWN seconds, then
+  a single trial call decides whether to close it again.
+- Request coalescing: concurrent calls with the same prompt fingerprint
+  (model, messages, temperature, max tokens, ...) share one upstream call,
+  and identical concurrent streams share one upstream stream whose chunks
+  are fanned out to every caller. Disable with LLM_COALESCE=0.
+
+AsyncLLMGateway offers the same pooling, retries, circuit breaker (shared
+with the threaded gateway) and request coalescing on asyncio, for the ASGI
+serving mode in asgi.py; it allows up to LLM_ASYNC_MAX_CONCURRENCY calls in
+flight, since waiting on the LLM costs a coroutine instead of a thread.
+Calls are coalesced within each gateway (and so within each worker
+process), not between the threaded and the asyncio gateway.
+"""
+
+import os
+import json
+import asyncio
+import time
+import random
+import hashlib
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional
+
+import httpx
+import groq
+from groq import AsyncGroq, Groq
+
+from ai.single_flight import AsyncSingleFlight, AsyncStreamBroadcast, SingleFlight, StreamBroadcast
+
+logger = logging.getLogger(__name__)
+
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "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")
+
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 16))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 10.0))   # seconds to wait for a free slot
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 30.0))               # seconds per call (read timeout)
+LLM_CONNECT_TIMEOUT = float(os.environ.get('LLM_CONNECT_TIMEOUT', 5.0))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2))
+LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 0.5))     # seconds, doubled per retry
+LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 8.0))
+LLM_BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))
+LLM_BREAKER_COOLDOWN = float(os.environ.get('LLM_BREAKER_COOLDOWN', 30.0))
+LLM_COALESCE_ENABLED = os.environ.get('LLM_COALESCE', '1') != '0'
+LLM_ASYNC_MAX_CONCURRENCY = int(os.environ.get('LLM_ASYNC_MAX_CONCURRENCY', 512))
+
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Errors worth retrying: rate limits, server errors, timeouts and dropped connections
+RETRYABLE_ERRORS = (groq.RateLimitError, groq.InternalServerError, groq.APIConnectionError)
+
+
+def prompt_fingerprint(kwargs: Dict[str, Any]) -> str:
+    """Hash of the call arguments; identical prompts give identical fingerprints."""
+    payload = json.dumps(kwargs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def backoff_delay(attempt: int, error: Exception) -> float:
+    """Seconds to wait before retry number attempt + 1."""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(LLM_BACKOFF_MAX, float(retry_after))
+        except ValueError:
+            pass
+    # Full jitter: spreads retries from concurrent callers apart
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+
+class LLMUnavailableError(Exception):
+    """Raised when the LLM service is not accepting calls (circuit open or no free slot)."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open trial call."""
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_THRESHOLD,
+                 cooldown: float = LLM_BREAKER_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None  # monotonic time the circuit opened, None when closed
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return 'open'
+            return 'half_open'
+
+    def allow(self) -> bool:
+        """Whether a call may go out now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("LLM circuit closed")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            half_open_trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if half_open_trial or (self._opened_at is None and self._failures >= self.failure_threshold):
+                logger.warning(f"LLM circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+
+
+class LLMGateway:
+    """Pooled Groq client with bounded concurrency, retries and a circuit breaker."""
+
+    def __init__(self, api_key: str = GROQ_API_KEY, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 breaker: Optional[CircuitBreaker] = None, coalesce: bool = LLM_COALESCE_ENABLED):
+        """
+        Initialize the gateway.
+
+        Args:
+            api_key: Groq API key
+            max_concurrency: Maximum calls in flight (also the connection pool size)
+            timeout: Default per-call timeout in seconds
+            max_retries: Retries after the first attempt for retryable errors
+            breaker: Circuit breaker (a new one by default)
+            coalesce: Share one upstream call between identical concurrent calls
+        """
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.coalesce = coalesce
+        self._http_client = httpx.Client(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=max_concurrency,
+                                max_keepalive_connections=max_concurrency,
+                                keepalive_expiry=60.0),
+            timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT)
+        )
+        # Retries are handled here, so they also feed the circuit breaker
+        self.client = Groq(api_key=api_key, http_client=self._http_client, max_retries=0)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._counts = {'calls': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'in_flight': 0,
+                        'coalesced_streams': 0}
+        self._single_flight = SingleFlight()
+        self._streams: Dict[str, StreamBroadcast] = {}  # fingerprint -> stream in flight
+
+    def _count(self, name: str, delta: int = 1):
+        with self._lock:
+            self._counts[name] += delta
+
+    @contextmanager
+    def _slot(self):
+        if not self._slots.acquire(timeout=LLM_QUEUE_TIMEOUT):
+            self._count('rejected')
+            raise LLMUnavailableError(f"No free LLM slot after {LLM_QUEUE_TIMEOUT:.0f}s")
+        self._count('in_flight')
+        try:
+            yield
+        finally:
+            self._count('in_flight', -1)
+            self._slots.release()
+
+    def _call_with_retries(self, call: Callable[[], Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._count('rejected')
+                raise LLMUnavailableError("LLM circuit is open after repeated failures")
+
+            self._count('calls')
+            try:
+                result = call()
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    self._count('failures')
+                    raise
+                delay = backoff_delay(attempt, e)
+                self._count('retries')
+                logger.warning(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            except groq.APIStatusError:
+                # Request errors (400, 401, ...) say nothing about the service's health
+                self.breaker.record_success()
+                self._count('failures')
+                raise
+            self.breaker.record_success()
+            return result
+
+    def chat_completion(self, timeout: Optional[float] = None, coalesce: Optional[bool] = None, **kwargs):
+        """
+        Create a (non-streaming) chat completion.
+
+        Identical concurrent calls are coalesced: callers that arrive while the
+        same prompt is in flight wait for it and get the same completion.
+
+        Args:
+            timeout: Seconds for this call (defaults to the gateway timeout)
+            coalesce: Override the gateway's coalescing for this call (False
+                      forces a fresh upstream call, e.g. when retrying output
+                      the caller rejected)
+            **kwargs: Arguments for client.chat.completions.create (model, messages, ...)
+
+        Returns:
+            The ChatCompletion (shared between coalesced callers; do not modify)
+
+        Raises:
+            LLMUnavailableError: If the circuit is open or no slot frees up in time
+            groq.APIError: If the call still fails after retries
+        """
+        def call():
+            with self._slot():
+                return self._call_with_retries(lambda: self.client.chat.completions.create(
+                    timeout=timeout or self.timeout, **kwargs))
+
+        if not (self.coalesce if coalesce is None else coalesce):
+            return call()
+        return self._single_flight.do(prompt_fingerprint(kwargs), call)
+
+    def chat_text(self, timeout: Optional[float] = None, coalesce: Optional[bool] = None, **kwargs) -> str:
+        """Create a chat completion and return the text of its first choice."""
+        return self.chat_completion(timeout=timeout, coalesce=coalesce, **kwargs).choices[0].message.content
+
+    def _stream(self, timeout: Optional[float], kwargs: Dict[str, Any]) -> Iterator[Any]:
+        with self._slot():
+            stream = self._call_with_retries(lambda: self.client.chat.completions.create(
+                timeout=timeout or self.timeout, stream=True, **kwargs))
+            try:
+                yield from stream
+            finally:
+                stream.close()
+
+    def _broadcast(self, key: str, broadcast: StreamBroadcast, timeout: Optional[float],
+                   kwargs: Dict[str, Any]):
+        try:
+            broadcast.run(self._stream(timeout, kwargs))
+        finally:
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+
+    def stream_chat_completion(self, timeout: Optional[float] = None, coalesce: Optional[bool] = None,
+                               **kwargs) -> Iterator[Any]:
+        """
+        Stream a chat completion chunk by chunk.
+
+        The concurrency slot is held until the stream is exhausted or closed.
+        Retries only cover opening the stream, never a partly sent response.
+        Identical concurrent streams are coalesced (unless coalesce is False):
+        one upstream stream is read in a background thread and every caller
+        receives all of its chunks, including those sent before it joined. The
+        upstream stream is closed once every caller has stopped reading.
+        """
+        if not (self.coalesce if coalesce is None else coalesce):
+            return self._stream(timeout, kwargs)
+
+        key = prompt_fingerprint(kwargs)
+        with self._lock:
+            broadcast = self._streams.get(key)
+            subscription = broadcast.subscribe() if broadcast is not None else None
+            if subscription is not None:
+                self._counts['coalesced_streams'] += 1
+                return subscription
+            broadcast = self._streams[key] = StreamBroadcast()
+            subscription = broadcast.subscribe()
+
+        threading.Thread(target=self._broadcast, args=(key, broadcast, timeout, kwargs),
+                         name='llm-stream', daemon=True).start()
+        return subscription
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            'max_concurrency': self.max_concurrency,
+            'http2': HTTP2_AVAILABLE,
+            'circuit': self.breaker.state,
+            'coalesce': self.coalesce,
+            **counts,
+            'coalesced': self._single_flight.stats()['coalesced']
+        }
+
+
+
+class AsyncLLMGateway:
+    """asyncio counterpart of LLMGateway, for the ASGI serving mode."""
+
+    def __init__(self, api_key: str = GROQ_API_KEY, max_concurrency: int = LLM_ASYNC_MAX_CONCURRENCY,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 breaker: Optional[CircuitBreaker] = None, coalesce: bool = LLM_COALESCE_ENABLED):
+        """
+        Initialize the gateway.
+
+        The HTTP client is created on first use, inside the event loop that
+        serves requests.
+
+        Args:
+            api_key: Groq API key
+            max_concurrency: Maximum calls in flight (also the connection pool size)
+            timeout: Default per-call timeout in seconds
+            max_retries: Retries after the first attempt for retryable errors
+            breaker: Circuit breaker (share the threaded gateway's to fail fast in both)
+            coalesce: Share one upstream call between identical concurrent calls
+        """
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.coalesce = coalesce
+        self._client = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._counts = {'calls': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'in_flight': 0,
+                        'coalesced_streams': 0}
+        self._single_flight = AsyncSingleFlight()
+        self._streams: Dict[str, AsyncStreamBroadcast] = {}  # fingerprint -> stream in flight
+        self._producers = set()  # Tasks reading coalesced upstream streams
+
+    @property
+    def client(self) -> AsyncGroq:
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency,
+                                    keepalive_expiry=60.0),
+                timeout=httpx.Timeout(self.timeout, connect=LLM_CONNECT_TIMEOUT)
+            )
+            self._client = AsyncGroq(api_key=self.api_key, http_client=http_client, max_retries=0)
+        return self._client
+
+    @asynccontextmanager
+    async def _slot(self):
+        # Counters are only touched from the event loop thread, so no lock
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._counts['rejected'] += 1
+            raise LLMUnavailableError(f"No free LLM slot after {LLM_QUEUE_TIMEOUT:.0f}s")
+        self._counts['in_flight'] += 1
+        try:
+            yield
+        finally:
+            self._counts['in_flight'] -= 1
+            self._slots.release()
+
+    async def _call_with_retries(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                self._counts['rejected'] += 1
+                raise LLMUnavailableError("LLM circuit is open after repeated failures")
+
+            self._counts['calls'] += 1
+            try:
+                result = await call()
+            except RETRYABLE_ERRORS as e:
+                self.breaker.record_failure()
+                if attempt == self.max_retries:
+                    self._counts['failures'] += 1
+                    raise
+                delay = backoff_delay(attempt, e)
+                self._counts['retries'] += 1
+                logger.warning(f"LLM call failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            except groq.APIStatusError:
+                # Request errors (400, 401, ...) say nothing about the service's health
+                self.breaker.record_success()
+                self._counts['failures'] += 1
+                raise
+            self.breaker.record_success()
+            return result
+
+    async def chat_completion(self, timeout: Optional[float] = None, coalesce: Optional[bool] = None,
+                              **kwargs):
+        """
+        Create a (non-streaming) chat completion.
+
+        Identical concurrent calls are coalesced like in LLMGateway.chat_completion.
+
+        Raises:
+            LLMUnavailableError: If the circuit is open or no slot frees up in time
+            groq.APIError: If the call still fails after retries
+        """
+        async def call():
+            async with self._slot():
+                return await self._call_with_retries(lambda: self.client.chat.completions.create(
+                    timeout=timeout or self.timeout, **kwargs))
+
+        if not (self.coalesce if coalesce is None else coalesce):
+            return await call()
+        return await self._single_flight.do(prompt_fingerprint(kwargs), call)
+
+    async def _stream(self, timeout: Optional[float], kwargs: Dict[str, Any]) -> AsyncIterator[Any]:
+        async with self._slot():
+            stream = await self._call_with_retries(lambda: self.client.chat.completions.create(
+                timeout=timeout or self.timeout, stream=True, **kwargs))
+            try:
+                async for chunk in stream:
+                    yield chunk
+            finally:
+                await stream.close()
+
+    async def _broadcast(self, key: str, broadcast: AsyncStreamBroadcast, timeout: Optional[float],
+                         kwargs: Dict[str, Any]):
+        try:
+            await broadcast.run(self._stream(timeout, kwargs))
+        finally:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+
+    def stream_chat_completion(self, timeout: Optional[float] = None, coalesce: Optional[bool] = None,
+                               **kwargs) -> AsyncIterator[Any]:
+        """
+        Stream a chat completion chunk by chunk.
+
+        The concurrency slot is held until the stream is exhausted or closed.
+        Retries only cover opening the stream, never a partly sent response.
+        Identical concurrent streams are coalesced like in
+        LLMGateway.stream_chat_completion, with the upstream stream read by a
+        task on the event loop. Must be called from the event loop; close
+        (aclose) the iterator when abandoning it early.
+        """
+        if not (self.coalesce if coalesce is None else coalesce):
+            return self._stream(timeout, kwargs)
+
+        key = prompt_fingerprint(kwargs)
+        broadcast = self._streams.get(key)
+        subscription = broadcast.subscribe() if broadcast is not None else None
+        if subscription is not None:
+            self._counts['coalesced_streams'] += 1
+            return subscription
+        broadcast = self._streams[key] = AsyncStreamBroadcast()
+        subscription = broadcast.subscribe()
+
+        producer = asyncio.get_running_loop().create_task(self._broadcast(key, broadcast, timeout, kwargs))
+        self._producers.add(producer)
+        producer.add_done_callback(self._producers.discard)
+        return subscription
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'http2': HTTP2_AVAILABLE,
+            'circuit': self.breaker.state,
+            'coalesce': self.coalesce,
+            **self._counts,
+            'coalesced': self._single_flight.stats()['coalesced']
+        }
+
+
+llm_gateway = LLMGateway()
+async_llm_gateway = AsyncLLMGateway(breaker=llm_gateway.breaker)
@@ -0,0 +1,564 @@
+"""
+meal_plans.py - Pregnancy meal plans, cached by canonicalized preferences
+
+A meal plan only depends on a handful of preferences (dietary flags,
+cuisines, allergies, health conditions, calorie and protein goals and the
+pregnancy week), and many users send the same combination. Preferences are
+canonicalized into a key (lists sorted and lower-cased, calorie goals rounded
+to MEAL_PLAN_CALORIE_STEP kcal, protein goals to MEAL_PLAN_PROTEIN_STEP
+grams, weeks grouped into MEAL_PLAN_WEEK_SPAN-week ranges) and the prompt is
+built from the canonical values, so a cached plan is exactly what any user
+with the same key would have been given.
+
+Plans are kept in an LRU cache of MEAL_PLAN_CACHE_SIZE keys and regenerated
+after MEAL_PLAN_CACHE_TTL seconds. With MEAL_PLAN_VARIANTS > 1, up to that
+many different plans are kept per key and one is picked at random for each
+request; missing variants are generated in the background while the cached
+ones are served. Only plans parsed from a valid LLM response are cached, so
+a hit skips both the LLM call and the JSON repair pass.
+
+MealPlanCache.stream() returns the same plans one meal at a time, each meal
+as soon as the LLM has finished writing it, for the streaming endpoint.
+"""
+
+import os
+import copy
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from ai.nutrition_tips import normalize_week
+from ai.structured_output import StructuredOutputError, stream_structured_items, structured_completion
+from ai.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+MEAL_PLAN_MODEL = "llama-3.3-70b-versatile"
+# Bump when the prompt or output format changes (cached plans are then regenerated)
+MEAL_PLAN_PROMPT_VERSION = 1
+MEAL_PLAN_CACHE_SIZE = int(os.environ.get('MEAL_PLAN_CACHE_SIZE', 512))
+MEAL_PLAN_CACHE_TTL = float(os.environ.get('MEAL_PLAN_CACHE_TTL', 24 * 3600))  # seconds until plans are regenerated
+MEAL_PLAN_VARIANTS = max(1, int(os.environ.get('MEAL_PLAN_VARIANTS', 1)))     # different plans served per key
+MEAL_PLAN_CALORIE_STEP = int(os.environ.get('MEAL_PLAN_CALORIE_STEP', 250))
+MEAL_PLAN_PROTEIN_STEP = int(os.environ.get('MEAL_PLAN_PROTEIN_STEP', 10))
+MEAL_PLAN_WEEK_SPAN = int(os.environ.get('MEAL_PLAN_WEEK_SPAN', 4))
+DEFAULT_CALORIE_GOAL = 2000
+DEFAULT_PROTEIN_GOAL = 70
+
+DEFAULT_MEAL_PLAN = {
+    "breakfast": [{
+        "name": "Simple Oatmeal with Berries",
+        "ingredients": ["Rolled oats", "Milk", "Mixed berries", "Honey"],
+        "instructions": "Cook oats with milk, top with berries and honey.",
+        "calories": 300,
+        "protein": "10g",
+        "carbs": "45g",
+        "fat": "5g",
+        "nutrients": ["Fiber", "Iron", "B Vitamins"],
+        "pregnancyBenefits": "Provides steady energy and essential nutrients for pregnancy."
+    }],
+    "lunch": [{
+        "name": "Spinach and Chickpea Salad",
+        "ingredients": ["Fresh spinach", "Chickpeas", "Cherry tomatoes", "Olive oil", "Lemon juice"],
+        "instructions": "Combine ingredients in a bowl and toss with olive oil and lemon juice.",
+        "calories": 350,
+        "protein": "15g",
+        "carbs": "40g",
+        "fat": "12g",
+        "nutrients": ["Folate", "Iron", "Protein"],
+        "pregnancyBenefits": "Rich in folate for neural tube development."
+    }],
+    "dinner": [{
+        "name": "Baked Salmon with Sweet Potato",
+        "ingredients": ["Salmon fillet", "Sweet potato", "Broccoli", "Olive oil", "Lemon"],
+        "instructions": "Bake salmon and sweet potato. Steam broccoli as a side.",
+        "calories": 420,
+        "protein": "28g",
+        "carbs": "35g",
+        "fat": "18g",
+        "nutrients": ["Omega-3", "Vitamin A", "Protein"],
+        "pregnancyBenefits": "Omega-3 fatty acids support brain development."
+    }],
+    "snacks": [
+        {
+            "name": "Greek Yogurt with Honey",
+            "ingredients": ["Greek yogurt", "Honey", "Almonds"],
+            "instructions": "Top yogurt with honey and chopped almonds.",
+            "calories": 180,
+            "protein": "15g",
+            "carbs": "15g",
+            "fat": "8g",
+            "nutrients": ["Calcium", "Protein", "Probiotics"],
+            "pregnancyBenefits": "Calcium supports bone development."
+        },
+        {
+            "name": "Apple with Nut Butter",
+            "ingredients": ["Apple", "Almond butter"],
+            "instructions": "Slice apple and serve with almond butter for dipping.",
+            "calories": 200,
+            "protein": "5g",
+            "carbs": "25g",
+            "fat": "10g",
+            "nutrients": ["Fiber", "Vitamin C", "Healthy fats"],
+            "pregnancyBenefits": "Provides steady energy between meals."
+        }
+    ]
+}
+
+MEAL_SECTIONS = ['breakfast', 'lunch', 'dinner', 'snacks']
+
+# Structure the LLM response is validated against while it streams
+MEAL_PLAN_SCHEMA = {
+    'type': 'object',
+    'required': MEAL_SECTIONS,
+    'properties': {
+        section: {'type': 'array', 'items': {'type': 'object', 'required': ['name']}}
+        for section in MEAL_SECTIONS
+    }
+}
+
+
+class MealPlanPreferences(NamedTuple):
+    """Canonical meal plan preferences; equal tuples get the same plans."""
+    vegetarian: bool
+    vegan: bool
+    gluten_free: bool
+    dairy_free: bool
+    cuisines: Tuple[str, ...]           # Sorted, lower-cased, without duplicates
+    allergies: Tuple[str, ...]
+    health_conditions: Tuple[str, ...]
+    calorie_goal: int                   # Rounded to MEAL_PLAN_CALORIE_STEP
+    protein_goal: int                   # Rounded to MEAL_PLAN_PROTEIN_STEP
+    weeks: Optional[Tuple[int, int]]    # First and last week of the range, None if unknown
+
+
+def _canonical_list(values: Any) -> Tuple[str, ...]:
+    if isinstance(values, str):
+        values = [values]
+    elif not isinstance(values, (list, tuple)):
+        return ()
+    return tuple(sorted({' '.join(str(value).split()).lower() for value in values} - {''}))
+
+
+def _bucket(value: Any, step: int, default: int) -> int:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = default
+    if not value > 0:
+        value = default
+    return max(step, int(round(value / step)) * step)
+
+
+def canonicalize_preferences(preferences: Dict[str, Any], pregnancy_week: Any) -> MealPlanPreferences:
+    """
+    Reduce request preferences to their canonical form.
+
+    Args:
+        preferences: 'preferences' object of the meal plan request
+        pregnancy_week: Pregnancy week as sent by the client
+
+    Returns:
+        Canonical preferences (the cache key, and what the prompt is built from)
+    """
+    preferences = preferences if isinstance(preferences, dict) else {}
+    week = normalize_week(pregnancy_week)
+    weeks = None
+    if week is not None:
+        first = (week - 1) // MEAL_PLAN_WEEK_SPAN * MEAL_PLAN_WEEK_SPAN + 1
+        weeks = (first, first + MEAL_PLAN_WEEK_SPAN - 1)
+    return MealPlanPreferences(
+        vegetarian=bool(preferences.get('isVegetarian')),
+        vegan=bool(preferences.get('isVegan')),
+        gluten_free=bool(preferences.get('isGlutenFree')),
+        dairy_free=bool(preferences.get('isDairyFree')),
+        cuisines=_canonical_list(preferences.get('cuisines')),
+        allergies=_canonical_list(preferences.get('allergies')),
+        health_conditions=_canonical_list(preferences.get('healthConditions')),
+        calorie_goal=_bucket(preferences.get('calorieGoal'), MEAL_PLAN_CALORIE_STEP, DEFAULT_CALORIE_GOAL),
+        protein_goal=_bucket(preferences.get('proteinGoal'), MEAL_PLAN_PROTEIN_STEP, DEFAULT_PROTEIN_GOAL),
+        weeks=weeks
+    )
+
+
+def build_user_prefs_text(preferences: MealPlanPreferences) -> str:
+    """Format canonical preferences for the LLM prompt."""
+    dietary_restrictions = []
+    if preferences.vegetarian:
+        dietary_restrictions.append('Vegetarian')
+    if preferences.vegan:
+        dietary_restrictions.append('Vegan')
+    if preferences.gluten_free:
+        dietary_restrictions.append('Gluten-Free')
+    if preferences.dairy_free:
+        dietary_restrictions.append('Dairy-Free')
+
+    weeks = f"{preferences.weeks[0]}-{preferences.weeks[1]}" if preferences.weeks else 'Unknown'
+    return f"""
+        Pregnancy Week: {weeks}
+        Preferred Cuisines: {', '.join(preferences.cuisines) or 'No specific preferences'}
+        Allergies: {', '.join(preferences.allergies) or 'None'}
+        Health Conditions: {', '.join(preferences.health_conditions) or 'None'}
+        Dietary Restrictions: {', '.join(dietary_restrictions) or 'None'}
+        Daily Calorie Goal: {preferences.calorie_goal} calories
+        Daily Protein Goal: {preferences.protein_goal} grams
+    """
+
+
+def build_meal_plan_messages(preferences: MealPlanPreferences) -> List[Dict[str, str]]:
+    """Chat messages asking the LLM for a one-day meal plan."""
+    user_prefs_text = build_user_prefs_text(preferences)
+
+    # Provide exact JSON structure format in the prompt
+    json_example = """
+    {
+      "breakfast": [
+        {
+          "name": "Recipe Name",
+          "ingredients": ["ingredient 1", "ingredient 2"],
+          "instructions": "Step by step instructions",
+          "calories": 320,
+          "protein": "15g",
+          "carbs": "40g",
+          "fat": "10g",
+          "nutrients": ["nutrient 1", "nutrient 2"],
+          "pregnancyBenefits": "Benefits description"
+        }
+      ],
+      "lunch": [
+        {
+          "name": "Recipe Name",
+          "ingredients": ["ingredient 1", "ingredient 2"],
+          "instructions": "Step by step instructions",
+          "calories": 380,
+          "protein": "22g",
+          "carbs": "45g",
+          "fat": "12g",
+          "nutrients": ["nutrient 1", "nutrient 2"],
+          "pregnancyBenefits": "Benefits description"
+        }
+      ],
+      "dinner": [
+        {
+          "name": "Recipe Name",
+          "ingredients": ["ingredient 1", "ingredient 2"],
+          "instructions": "Step by step instructions",
+          "calories": 450,
+          "protein": "30g",
+          "carbs": "50g",
+          "fat": "15g",
+          "nutrients": ["nutrient 1", "nutrient 2"],
+          "pregnancyBenefits": "Benefits description"
+        }
+      ],
+      "snacks": [
+        {
+          "name": "Recipe Name",
+          "ingredients": ["ingredient 1", "ingredient 2"],
+          "instructions": "Step by step instructions",
+          "calories": 150,
+          "protein": "5g",
+          "carbs": "20g",
+          "fat": "5g",
+          "nutrients": ["nutrient 1", "nutrient 2"],
+          "pregnancyBenefits": "Benefits description"
+        }
+      ]
+    }
+    """
+
+    # Create the prompt for the LLM
+    messages = [
+        {
+            "role": "system",
+            "content": """You are a knowledgeable nutrition expert specializing in prenatal diet. Your task is to create a personalized meal plan that is safe and nutritious for pregnant women, accounting for their specific week of pregnancy, food preferences, allergies, and health conditions. Provide detailed recipes with nutritional information.
+
+            Your response MUST be valid JSON following the exact structure of the example provided by the user, with no extra text before or after the JSON. Include only one meal for each category (breakfast, lunch, dinner, and two items in snacks)."""
+        },
+        {
+            "role": "user",
+            "content": f"""Please create a one-day meal plan based on these preferences:
+
+            {user_prefs_text}
+
+            Return your response as JSON with exactly this structure:
+
+            {json_example}
+
+            Follow this structure precisely and include only ONE item in each of the breakfast, lunch, and dinner arrays, and TWO items in the snacks array. Make sure all string values use double quotes, not single quotes, to ensure valid JSON.
+
+            Make sure to include the "ingredients" as an array of strings, and make each meal nutritious and appropriate for pregnancy.
+            """
+        }
+    ]
+
+    return messages
+
+
+def normalize_meal(meal: Any) -> Dict[str, Any]:
+    """Fill in missing or malformed fields of one meal from the LLM."""
+    if not isinstance(meal, dict):
+        return {
+            "name": "Invalid meal",
+            "ingredients": ["Please try again"],
+            "instructions": "There was an error generating this meal.",
+            "calories": 0,
+            "protein": "0g",
+            "carbs": "0g",
+            "fat": "0g",
+            "nutrients": []
+        }
+
+    # Ensure required fields exist
+    required_fields = {
+        "name": "Recipe",
+        "ingredients": [],
+        "instructions": "Instructions not provided",
+        "calories": 0,
+        "protein": "0g",
+        "carbs": "0g",
+        "fat": "0g",
+        "nutrients": []
+    }
+
+    for field, default in required_fields.items():
+        if field not in meal or meal[field] is None:
+            meal[field] = default
+
+    # Ensure ingredients is an array
+    if not isinstance(meal["ingredients"], list):
+        if isinstance(meal["ingredients"], str):
+            meal["ingredients"] = [meal["ingredients"]]
+        else:
+            meal["ingredients"] = []
+
+    # Ensure nutrients is an array
+    if not isinstance(meal["nutrients"], list):
+        if isinstance(meal["nutrients"], str):
+            meal["nutrients"] = [meal["nutrients"]]
+        else:
+            meal["nutrients"] = []
+    return meal
+
+
+def generate_meal_plan(preferences: MealPlanPreferences) -> Tuple[Dict[str, List[Dict[str, Any]]], bool]:
+    """
+    Ask the LLM for a one-day meal plan.
+
+    Args:
+        preferences: Canonical preferences
+
+    Returns:
+        Tuple of (meal plan, whether it came from a valid LLM response). The
+        default plan is returned, with False, when the response cannot be parsed.
+    """
+    # Request the plan; malformed JSON is caught while it streams
+    try:
+        meal_plan_data = structured_completion(
+            MEAL_PLAN_SCHEMA,
+            label='meal plan',
+            messages=build_meal_plan_messages(preferences),
+            model=MEAL_PLAN_MODEL,
+            temperature=0.7,
+            max_completion_tokens=1500
+        )
+    except StructuredOutputError as e:
+        logger.error(f"Error parsing meal plan JSON: {str(e)}")
+        # Default meal plan if parsing fails
+        return copy.deepcopy(DEFAULT_MEAL_PLAN), False
+
+    # Ensure every section is a list of complete meals
+    for key in MEAL_SECTIONS:
+        meals = meal_plan_data.get(key)
+        meal_plan_data[key] = [normalize_meal(meal) for meal in meals] if isinstance(meals, list) else []
+    return meal_plan_data, True
+
+
+def stream_meal_plan(preferences: MealPlanPreferences) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Ask the LLM for a one-day meal plan and yield each meal as soon as it is complete.
+
+    Yields:
+        Tuples of (section, meal)
+
+    Raises:
+        StructuredOutputError: If the response is malformed
+    """
+    for section, meal in stream_structured_items(
+            MEAL_PLAN_SCHEMA,
+            label='meal plan',
+            messages=build_meal_plan_messages(preferences),
+            model=MEAL_PLAN_MODEL,
+            temperature=0.7,
+            max_completion_tokens=1500):
+        if section in MEAL_SECTIONS:
+            yield section, normalize_meal(meal)
+
+
+class MealPlanCache:
+    """Meal plans per canonical preference key, with LRU eviction, expiry and optional variants."""
+
+    def __init__(self, max_size: int = MEAL_PLAN_CACHE_SIZE, ttl: float = MEAL_PLAN_CACHE_TTL,
+                 variants: int = MEAL_PLAN_VARIANTS, model: str = MEAL_PLAN_MODEL,
+                 prompt_version: int = MEAL_PLAN_PROMPT_VERSION):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size: Maximum number of preference keys kept
+            ttl: Seconds after which a key's plans are regenerated
+            variants: Number of different plans kept and served per key
+            model: LLM model name (part of the cache key)
+            prompt_version: Prompt version (part of the cache key)
+        """
+        self.ttl = ttl
+        self.variants = variants
+        self.model = model
+        self.prompt_version = prompt_version
+        # key -> {'plans': [...], 'generated_at': ...}; idle keys expire after ttl too
+        self._entries = TTLCache(max_size=max_size, ttl=ttl)
+        self._lock = threading.Lock()
+        self._generating = set()  # Keys with a background variant in flight
+        self._counts = {'hits': 0, 'misses': 0, 'generated': 0, 'errors': 0}
+
+    def _key(self, preferences: MealPlanPreferences) -> Tuple[Any, ...]:
+        return (*preferences, self.prompt_version, self.model)
+
+    def _fresh_plans(self, key: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry['generated_at'] > self.ttl:
+            return []
+        return entry['plans']
+
+    def _generate(self, key: Tuple[Any, ...], preferences: MealPlanPreferences) -> Dict[str, Any]:
+        """Generate a plan and add it to the key's variants if the LLM response was valid."""
+        try:
+            plan, valid = generate_meal_plan(preferences)
+        except Exception as e:
+            logger.error(f"Error generating meal plan: {str(e)}")
+            with self._lock:
+                self._counts['errors'] += 1
+            return copy.deepcopy(DEFAULT_MEAL_PLAN)
+
+        self._store(key, plan, valid)
+        return plan
+
+    def _store(self, key: Tuple[Any, ...], plan: Dict[str, Any], valid: bool):
+        """Add a plan to the key's variants if it came from a valid LLM response."""
+        with self._lock:
+            if valid:
+                plans = self._fresh_plans(key)
+                if len(plans) < self.variants:
+                    # Entries are replaced, never mutated, so readers need no lock
+                    generated_at = self._entries.get(key)['generated_at'] if plans else time.time()
+                    self._entries.put(key, {'plans': plans + [plan], 'generated_at': generated_at})
+                self._counts['generated'] += 1
+            else:
+                self._counts['errors'] += 1
+
+    def _add_variant_in_background(self, key: Tuple[Any, ...], preferences: MealPlanPreferences):
+        with self._lock:
+            if key in self._generating:
+                return
+            self._generating.add(key)
+
+        def generate():
+            try:
+                self._generate(key, preferences)
+            finally:
+                with self._lock:
+                    self._generating.discard(key)
+
+        threading.Thread(target=generate, name='meal-plan-variant', daemon=True).start()
+
+    def get(self, preferences: Dict[str, Any], pregnancy_week: Any) -> Dict[str, Any]:
+        """
+        Return a meal plan for the given preferences.
+
+        Args:
+            preferences: 'preferences' object of the meal plan request
+            pregnancy_week: Pregnancy week as sent by the client
+
+        Returns:
+            Meal plan with breakfast, lunch, dinner and snacks
+        """
+        canonical = canonicalize_preferences(preferences, pregnancy_week)
+        key = self._key(canonical)
+        plans = self._fresh_plans(key)
+        with self._lock:
+            self._counts['hits' if plans else 'misses'] += 1
+
+        if not plans:
+            return self._generate(key, canonical)
+        if len(plans) < self.variants:
+            self._add_variant_in_background(key, canonical)
+        return random.choice(plans)
+
+    def stream(self, preferences: Dict[str, Any], pregnancy_week: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Return a meal plan as a sequence of events, one meal at a time.
+
+        Cached plans are replayed at once; otherwise each meal is yielded as
+        soon as the LLM has finished writing it.
+
+        Args:
+            preferences: 'preferences' object of the meal plan request
+            pregnancy_week: Pregnancy week as sent by the client
+
+        Yields:
+            {'type': 'meal', 'section': ..., 'meal': ...} for every meal, then
+            {'type': 'complete', 'data': meal plan}. The final plan is
+            authoritative: if the response broke off it holds the meals
+            already sent, or is the default plan if there were none.
+        """
+        canonical = canonicalize_preferences(preferences, pregnancy_week)
+        key = self._key(canonical)
+        plans = self._fresh_plans(key)
+        with self._lock:
+            self._counts['hits' if plans else 'misses'] += 1
+
+        if plans:
+            if len(plans) < self.variants:
+                self._add_variant_in_background(key, canonical)
+            plan = random.choice(plans)
+            for section in MEAL_SECTIONS:
+                for meal in plan.get(section, []):
+                    yield {'type': 'meal', 'section': section, 'meal': meal}
+            yield {'type': 'complete', 'data': plan}
+            return
+
+        plan = {section: [] for section in MEAL_SECTIONS}
+        try:
+            for section, meal in stream_meal_plan(canonical):
+                plan[section].append(meal)
+                yield {'type': 'meal', 'section': section, 'meal': meal}
+            valid = True
+        except Exception as e:
+            logger.error(f"Error streaming meal plan: {str(e)}")
+            valid = False
+            # Never contradict meals the client already received; partial plans are not cached
+            if not any(plan.values()):
+                plan = copy.deepcopy(DEFAULT_MEAL_PLAN)
+        self._store(key, plan, valid)
+        yield {'type': 'complete', 'data': plan}
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts['hits'] + counts['misses']
+        return {
+            'entries': len(self._entries),
+            'variants': self.variants,
+            'model': self.model,
+            'prompt_version': self.prompt_version,
+            **counts,
+            'hit_rate': counts['hits'] / lookups if lookups else 0.0
+        }
+
+
+meal_plan_cache = MealPlanCache()
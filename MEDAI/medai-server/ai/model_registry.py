@@ -0,0 +1,482 @@
+"""
+model_registry.py - Local, versioned model artifacts for pose estimation
+
+Models are loaded from the bundled ai/models/ folder instead of being
+downloaded at startup. MoveNet artifacts live in versioned directories:
+
+    ai/models/movenet/<variant>/<version>/
+        manifest.json      # format, source URL and SHA-256 of every file
+        saved_model/       # SavedModel export (saved_model.pb, variables/)
+        model.tflite       # optional precompiled TFLite model (float32)
+        model_fp16.tflite  # optional float16-quantized TFLite model
+        model_int8.tflite  # optional int8 (dynamic range) quantized TFLite model
+
+Every file is checked against the manifest before the model is loaded, so
+a partial or tampered copy is rejected instead of silently producing bad
+keypoints. Populate the folder as part of every deploy (a variant that is
+already installed and verified is left alone):
+
+    python -m ai.model_registry fetch thunder --tflite
+    python -m ai.model_registry fetch lightning --tflite
+    python -m ai.model_registry fetch mediapipe
+
+Downloads are never trusted on first use: the upstream SavedModel must
+match the SHA-256 pinned for its variant (a digest over the checksums of
+all its files, see tree_sha256), or it is rejected. Pins live in
+MOVENET_SOURCES and can be set per deploy with MOVENET_THUNDER_SHA256 /
+MOVENET_LIGHTNING_SHA256. Runtime downloads are off by default and only
+attempted when MODEL_ALLOW_DOWNLOAD=1.
+
+model_status reports what is installed; it is exposed through /api/metrics
+so a server running without its pose model is visible.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = os.environ.get('MEDAI_MODEL_DIR', os.path.join(os.path.dirname(__file__), 'models'))
+MODEL_ALLOW_DOWNLOAD = os.environ.get('MODEL_ALLOW_DOWNLOAD', '0') == '1'
+MODEL_VERIFY_CHECKSUMS = os.environ.get('MODEL_VERIFY_CHECKSUMS', '1') != '0'
+
+MANIFEST_NAME = 'manifest.json'
+SAVED_MODEL_DIR = 'saved_model'
+TFLITE_FILE = 'model.tflite'
+
+# TFLite artifacts by quantization, and the manifest format name for each
+TFLITE_VARIANTS = {
+    'float32': ('tflite', TFLITE_FILE),
+    'float16': ('tflite_fp16', 'model_fp16.tflite'),
+    'int8': ('tflite_int8', 'model_int8.tflite')
+}
+
+# Upstream sources used by the fetch command (and by runtime downloads if allowed).
+# 'sha256' pins the expected tree_sha256 of the downloaded SavedModel; a
+# variant without a pin cannot be downloaded until one is recorded with
+# 'python -m ai.model_registry fetch <variant> --trust' from a trusted network
+# (in MOVENET_<VARIANT>_SHA256 or here).
+MOVENET_SOURCES = {
+    'thunder': {
+        'version': '4',
+        'url': 'https://www.kaggle.com/models/google/movenet/TensorFlow2/singlepose-thunder/4',
+        'input_size': 256,
+        'sha256': os.environ.get('MOVENET_THUNDER_SHA256')
+    },
+    'lightning': {
+        'version': '4',
+        'url': 'https://www.kaggle.com/models/google/movenet/TensorFlow2/singlepose-lightning/4',
+        'input_size': 192,
+        'sha256': os.environ.get('MOVENET_LIGHTNING_SHA256')
+    }
+}
+
+_verified = set()  # Artifact directories already checked in this process
+_verify_lock = threading.Lock()
+
+
+class ModelIntegrityError(Exception):
+    """A local model artifact does not match its manifest."""
+
+
+class ModelArtifact:
+    """A verified model directory and the manifest describing it."""
+
+    def __init__(self, path: str, manifest: Dict[str, Any]):
+        self.path = path
+        self.manifest = manifest
+
+    @property
+    def name(self) -> str:
+        return self.manifest.get('name', os.path.basename(os.path.dirname(self.path)))
+
+    @property
+    def version(self) -> str:
+        return str(self.manifest.get('version', os.path.basename(self.path)))
+
+    @property
+    def formats(self) -> List[str]:
+        """Artifact formats present in this version ('saved_model', 'tflite', ...)."""
+        return list(self.manifest.get('formats', []))
+
+    @property
+    def saved_model_path(self) -> str:
+        return os.path.join(self.path, SAVED_MODEL_DIR)
+
+    def tflite_path(self, quantization: str = 'float32') -> str:
+        return os.path.join(self.path, TFLITE_VARIANTS[quantization][1])
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _list_files(root: str) -> List[str]:
+    """All files under root as sorted, '/'-separated relative paths (manifest excluded)."""
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, filename), root).replace(os.sep, '/')
+            if rel != MANIFEST_NAME:
+                files.append(rel)
+    return sorted(files)
+
+
+def tree_sha256(root: str) -> str:
+    """SHA-256 over the relative path and SHA-256 of every file under root (manifest excluded)."""
+    digest = hashlib.sha256()
+    for rel in _list_files(root):
+        digest.update(f"{rel}\0{_sha256(os.path.join(root, rel))}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+
+def verify_download(variant: str, path: str, trust: bool = False) -> str:
+    """
+    Check a downloaded MoveNet SavedModel against the digest pinned for its variant.
+
+    Args:
+        variant: 'thunder' or 'lightning'
+        path: Directory of the downloaded SavedModel
+        trust: Accept a variant that has no pinned digest yet (fetch --trust)
+
+    Returns:
+        The digest of the download
+
+    Raises:
+        ModelIntegrityError: If the digest differs from the pin, or there is
+            no pin and trust is not set
+    """
+    expected = MOVENET_SOURCES[variant].get('sha256')
+    actual = tree_sha256(path)
+    if expected is None:
+        if not trust:
+            raise ModelIntegrityError(
+                f"No SHA-256 is pinned for MoveNet {variant}; refusing to use an unverified download "
+                f"(record one with 'python -m ai.model_registry fetch {variant} --trust')"
+            )
+        logger.warning(f"No SHA-256 pinned for MoveNet {variant}, trusting download {actual}")
+    elif actual != expected:
+        raise ModelIntegrityError(f"Downloaded MoveNet {variant} does not match its pinned checksum "
+                                  f"(expected {expected[:12]}, got {actual[:12]})")
+    return actual
+
+
+def _version_key(version: str):
+    """Sort key that orders '10' after '9' and numeric parts before named ones."""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part)
+            for part in version.replace('-', '.').split('.')]
+
+
+def movenet_dir(variant: str, version: Optional[str] = None) -> str:
+    """Directory for a MoveNet variant (and version, if given)."""
+    path = os.path.join(MODELS_DIR, 'movenet', variant)
+    return os.path.join(path, version) if version else path
+
+
+def read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(path: str, name: str, version: str, source: Optional[str] = None,
+                   extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Checksum every file in an artifact directory and write its manifest."""
+    files = _list_files(path)
+    formats = []
+    if any(f.startswith(SAVED_MODEL_DIR + '/') for f in files):
+        formats.append('saved_model')
+    for fmt, filename in TFLITE_VARIANTS.values():
+        if filename in files:
+            formats.append(fmt)
+
+    manifest = {
+        'name': name,
+        'version': version,
+        'source': source,
+        'formats': formats,
+        'files': {rel: _sha256(os.path.join(path, rel)) for rel in files}
+    }
+    if extra:
+        manifest.update(extra)
+
+    with open(os.path.join(path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def verify_artifact(path: str, manifest: Dict[str, Any]):
+    """
+    Check every file listed in the manifest against its SHA-256.
+
+    Raises:
+        ModelIntegrityError: If a file is missing or its checksum differs
+    """
+    for rel, expected in manifest.get('files', {}).items():
+        file_path = os.path.join(path, rel)
+        if not os.path.exists(file_path):
+            raise ModelIntegrityError(f"{path}: missing file {rel}")
+        actual = _sha256(file_path)
+        if actual != expected:
+            raise ModelIntegrityError(f"{path}: checksum mismatch for {rel} "
+                                      f"(expected {expected[:12]}, got {actual[:12]})")
+
+
+def resolve_movenet(variant: str = 'thunder', version: Optional[str] = None,
+                    fmt: Optional[str] = None) -> Optional[ModelArtifact]:
+    """
+    Find the newest local (or requested) version of a MoveNet variant.
+
+    Args:
+        variant: 'thunder' or 'lightning'
+        version: Specific version directory, or None for the newest
+        fmt: Required artifact format ('saved_model', 'tflite', 'tflite_fp16',
+             'tflite_int8'), or None for any
+
+    Returns:
+        Verified ModelArtifact, or None if no local copy exists
+
+    Raises:
+        ModelIntegrityError: If the local copy fails checksum verification
+    """
+    root = movenet_dir(variant)
+    if version:
+        candidates = [version]
+    elif os.path.isdir(root):
+        candidates = sorted(os.listdir(root), key=_version_key, reverse=True)
+    else:
+        candidates = []
+
+    for candidate in candidates:
+        path = os.path.join(root, candidate)
+        manifest = read_manifest(path)
+        if manifest is None:
+            continue
+        artifact = ModelArtifact(path, manifest)
+        if fmt and fmt not in artifact.formats:
+            continue
+
+        if MODEL_VERIFY_CHECKSUMS:
+            with _verify_lock:
+                if path not in _verified:
+                    verify_artifact(path, manifest)
+                    _verified.add(path)
+        return artifact
+
+    return None
+
+
+def load_movenet(variant: str = 'thunder', version: Optional[str] = None):
+    """
+    Load a MoveNet SavedModel.
+
+    The local registry is used when present. Otherwise the model is
+    downloaded from its upstream source, but only if MODEL_ALLOW_DOWNLOAD is
+    set, and only loaded if it matches the variant's pinned checksum.
+
+    Returns:
+        Loaded model object (use .signatures['serving_default'] for inference)
+
+    Raises:
+        FileNotFoundError: If no local copy exists and downloads are disabled
+        ModelIntegrityError: If the local copy or the download fails checksum verification
+    """
+    import tensorflow as tf
+
+    artifact = resolve_movenet(variant, version, fmt='saved_model')
+    if artifact is not None:
+        logger.info(f"Loading MoveNet {variant} v{artifact.version} from {artifact.path}")
+        return tf.saved_model.load(artifact.saved_model_path)
+
+    source = MOVENET_SOURCES[variant]
+    if not MODEL_ALLOW_DOWNLOAD:
+        raise FileNotFoundError(
+            f"No local MoveNet {variant} model in {movenet_dir(variant)} and downloads are disabled; "
+            f"run 'python -m ai.model_registry fetch {variant}'"
+        )
+    import tensorflow_hub as hub
+    logger.warning(f"No local MoveNet {variant} model, downloading from {source['url']}")
+    # hub.resolve downloads (or reuses) the SavedModel and returns its local directory
+    path = hub.resolve(source['url'])
+    verify_download(variant, path)
+    return tf.saved_model.load(path)
+
+
+def model_status(variant: str = 'thunder') -> Dict[str, Any]:
+    """
+    Describe the local copy of a MoveNet variant, without loading it.
+
+    Returns:
+        Dictionary with 'installed', 'version', 'formats', 'error' (why the
+        local copy cannot be used, or None), 'pinned' and 'download_allowed'
+    """
+    status = {'installed': False, 'version': None, 'formats': [], 'error': None,
+              'pinned': MOVENET_SOURCES[variant].get('sha256') is not None,
+              'download_allowed': MODEL_ALLOW_DOWNLOAD}
+    try:
+        artifact = resolve_movenet(variant)
+    except (ModelIntegrityError, OSError, ValueError) as e:
+        status['error'] = str(e)
+        return status
+    if artifact is None:
+        status['error'] = f"not installed in {movenet_dir(variant)}"
+    else:
+        status.update(installed=True, version=artifact.version, formats=artifact.formats)
+    return status
+
+
+def mediapipe_pose_complexity(requested: int) -> int:
+    """
+    Choose a MediaPipe Pose model complexity that can be loaded offline.
+
+    Only the 'full' model (complexity 1) ships inside the mediapipe package;
+    'lite' and 'heavy' are downloaded on first use. When downloads are
+    disabled and the requested model is not cached, fall back to 'full'.
+    """
+    if requested == 1 or MODEL_ALLOW_DOWNLOAD:
+        return requested
+    try:
+        import mediapipe as mp
+        model_name = {0: 'pose_landmark_lite.tflite', 2: 'pose_landmark_heavy.tflite'}[requested]
+        model_path = os.path.join(os.path.dirname(mp.__file__), 'modules', 'pose_landmark', model_name)
+        if os.path.exists(model_path):
+            return requested
+        logger.warning(f"MediaPipe {model_name} is not cached and downloads are disabled, "
+                       f"using the bundled full model")
+    except Exception as e:
+        logger.warning(f"Could not check MediaPipe model cache: {str(e)}")
+    return 1
+
+
+def fetch_movenet(variant: str, tflite: bool = False, force: bool = False,
+                  trust: bool = False) -> ModelArtifact:
+    """
+    Download a MoveNet variant into the registry and write its manifest.
+
+    A verified copy that is already installed (with the TFLite artifacts, if
+    requested) is returned as is unless force is set, so this can run on
+    every deploy. The download must match the variant's pinned checksum; with trust, a
+    variant without a pin is accepted and its digest recorded in the manifest
+    so it can be pinned in MOVENET_SOURCES.
+    """
+    import tensorflow as tf
+    import tensorflow_hub as hub
+
+    source = MOVENET_SOURCES[variant]
+    path = movenet_dir(variant, source['version'])
+    if os.path.exists(path) and not force:
+        manifest = read_manifest(path)
+        if manifest is None:
+            raise FileExistsError(f"{path} exists without a {MANIFEST_NAME} (use --force to replace it)")
+        artifact = ModelArtifact(path, manifest)
+        missing = [fmt for fmt, _ in TFLITE_VARIANTS.values() if fmt not in artifact.formats] if tflite else []
+        if missing:
+            raise FileExistsError(f"{path} has no {', '.join(missing)} artifacts (use --force to rebuild it)")
+        verify_artifact(path, manifest)
+        logger.info(f"MoveNet {variant} v{artifact.version} is already installed in {path}")
+        return artifact
+
+    # hub.resolve downloads (or reuses) the SavedModel and returns its local directory
+    download = hub.resolve(source['url'])
+    digest = verify_download(variant, download, trust)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    shutil.copytree(download, os.path.join(path, SAVED_MODEL_DIR))
+
+    if tflite:
+        for quantization, (_, filename) in TFLITE_VARIANTS.items():
+            converter = tf.lite.TFLiteConverter.from_saved_model(os.path.join(path, SAVED_MODEL_DIR))
+            if quantization == 'float16':
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+                converter.target_spec.supported_types = [tf.float16]
+            elif quantization == 'int8':
+                # Dynamic range quantization: int8 weights, no calibration data needed
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            with open(os.path.join(path, filename), 'wb') as f:
+                f.write(converter.convert())
+
+    manifest = write_manifest(path, f"movenet-{variant}", source['version'], source['url'],
+                              extra={'input_size': source['input_size'], 'source_sha256': digest})
+    return ModelArtifact(path, manifest)
+
+
+def fetch_mediapipe(model_complexity: int = 2):
+    """Download MediaPipe's pose landmark model into its package cache."""
+    import mediapipe as mp
+    with mp.solutions.pose.Pose(static_image_mode=True, model_complexity=model_complexity):
+        pass
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Manage local pose estimation models')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subparsers.add_parser('fetch', help='download a model into ai/models')
+    fetch_parser.add_argument('model', choices=sorted(MOVENET_SOURCES) + ['mediapipe'])
+    fetch_parser.add_argument('--tflite', action='store_true',
+                              help='also convert to TFLite (float32, float16 and int8)')
+    fetch_parser.add_argument('--force', action='store_true', help='replace an existing copy')
+    fetch_parser.add_argument('--trust', action='store_true',
+                              help='accept a variant without a pinned checksum and print its digest')
+
+    verify_parser = subparsers.add_parser('verify', help='check local models against their manifests')
+    verify_parser.add_argument('variant', nargs='?', choices=sorted(MOVENET_SOURCES))
+
+    manifest_parser = subparsers.add_parser('manifest', help='(re)write the manifest for a directory')
+    manifest_parser.add_argument('path')
+    manifest_parser.add_argument('--name', required=True)
+    manifest_parser.add_argument('--version', required=True)
+    manifest_parser.add_argument('--source')
+
+    args = parser.parse_args()
+
+    if args.command == 'fetch':
+        if args.model == 'mediapipe':
+            fetch_mediapipe()
+            print("MediaPipe pose models cached")
+        else:
+            artifact = fetch_movenet(args.model, tflite=args.tflite, force=args.force, trust=args.trust)
+            print(f"Installed {artifact.name} v{artifact.version} ({', '.join(artifact.formats)}) to {artifact.path}")
+            if MOVENET_SOURCES[args.model]['sha256'] is None and 'source_sha256' in artifact.manifest:
+                print(f"Pin it in MOVENET_SOURCES['{args.model}']['sha256'] or "
+                      f"MOVENET_{args.model.upper()}_SHA256: {artifact.manifest['source_sha256']}")
+
+    elif args.command == 'verify':
+        failed = False
+        for variant in [args.variant] if args.variant else sorted(MOVENET_SOURCES):
+            root = movenet_dir(variant)
+            versions = sorted(os.listdir(root), key=_version_key) if os.path.isdir(root) else []
+            if not versions:
+                print(f"movenet/{variant}: not installed")
+            for version in versions:
+                path = os.path.join(root, version)
+                manifest = read_manifest(path)
+                try:
+                    if manifest is None:
+                        raise ModelIntegrityError(f"{path}: no {MANIFEST_NAME}")
+                    verify_artifact(path, manifest)
+                    print(f"movenet/{variant}/{version}: ok ({', '.join(manifest.get('formats', []))})")
+                except ModelIntegrityError as e:
+                    failed = True
+                    print(f"movenet/{variant}/{version}: FAILED - {e}")
+        raise SystemExit(1 if failed else 0)
+
+    elif args.command == 'manifest':
+        manifest = write_manifest(args.path, args.name, args.version, args.source)
+        print(f"Wrote manifest for {len(manifest['files'])} files")
@@ -0,0 +1,332 @@
+"""
+nutrition_tips.py - Pregnancy nutrition tips, generated once per week and cached
+
+Tips only depend on the pregnancy week, so they are cached per
+(week, prompt version, model) and persisted to NUTRITION_TIPS_CACHE_PATH.
+Requests are served with stale-while-revalidate: fresh tips are returned
+directly, tips older than NUTRITION_TIPS_TTL are still returned but
+regenerated in the background, and only a week that was never generated
+waits for the LLM.
+
+Pre-generate every week (e.g. after a deploy or a prompt change) with:
+
+    python -m ai.nutrition_tips warm
+
+or set NUTRITION_TIPS_WARM=1 to warm missing weeks in a background thread
+when the server starts.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ai.structured_output import StructuredOutputError, structured_completion
+
+logger = logging.getLogger(__name__)
+
+NUTRITION_TIPS_MODEL = "llama-3.3-70b-versatile"
+# Bump when the prompt or output format changes (cached tips are then regenerated)
+NUTRITION_TIPS_PROMPT_VERSION = 1
+NUTRITION_TIPS_CACHE_PATH = os.environ.get(
+    'NUTRITION_TIPS_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'nutrition_tips.json'))
+NUTRITION_TIPS_TTL = float(os.environ.get('NUTRITION_TIPS_TTL', 7 * 24 * 3600))  # seconds until tips are stale
+NUTRITION_TIPS_WARM_ON_START = os.environ.get('NUTRITION_TIPS_WARM', '0') == '1'
+PREGNANCY_WEEKS = range(1, 43)
+
+DEFAULT_TIPS = [
+    {
+        "title": "Folate for Brain Development",
+        "content": "Consuming adequate folate helps prevent neural tube defects. Include leafy greens, fortified cereals, and beans in your diet."
+    },
+    {
+        "title": "Hydration is Key",
+        "content": "Staying well-hydrated supports amniotic fluid levels and helps prevent common issues like constipation and urinary tract infections."
+    },
+    {
+        "title": "Iron for Oxygen Transport",
+        "content": "Iron needs increase during pregnancy to support additional blood volume and oxygen transport to your baby."
+    }
+]
+
+# Structure the LLM response is validated against while it streams
+NUTRITION_TIPS_SCHEMA = {
+    'type': 'array',
+    'minItems': 1,
+    'items': {'type': 'object', 'required': ['title', 'content']}
+}
+
+
+def normalize_week(week: Any) -> Optional[int]:
+    """Pregnancy week as an int in 1-42, or None if missing or invalid."""
+    try:
+        week = int(week)
+    except (TypeError, ValueError):
+        return None
+    return week if week in PREGNANCY_WEEKS else None
+
+
+def generate_nutrition_tips(pregnancy_week: Optional[int]) -> Tuple[List[Dict[str, str]], bool]:
+    """
+    Ask the LLM for three nutrition tips for a pregnancy week.
+
+    Args:
+        pregnancy_week: Week of pregnancy (None if unknown)
+
+    Returns:
+        Tuple of (tips, whether they came from a valid LLM response). Default
+        tips are returned, with False, when the response cannot be parsed.
+    """
+    # Define expected JSON structure in the prompt
+    json_example = """
+        [
+            {
+                "title": "Tip Title",
+                "content": "Detailed content about the nutrition tip with practical advice."
+            },
+            {
+                "title": "Another Tip Title",
+                "content": "More detailed content about another nutrition aspect."
+            },
+            {
+                "title": "Third Tip Title",
+                "content": "Further detailed content about another important nutrition aspect."
+            }
+        ]
+        """
+
+    # Create the prompt for the LLM
+    messages = [
+        {
+            "role": "system",
+            "content": """You are a prenatal nutrition expert. Provide concise, evidence-based nutrition tips specifically tailored for pregnant women.
+
+                Your response MUST be valid JSON following the exact structure of the example provided by the user, with no extra text before or after the JSON. Include exactly three nutrition tips."""
+        },
+        {
+            "role": "user",
+            "content": f"""Provide 3 important nutrition tips for a woman in week {pregnancy_week or 'unknown'} of pregnancy.
+
+Each tip should:
+1. Have a clear, concise title highlighting the nutrient or concept
+2. Include detailed content (30-80 words) with practical advice
+3. Be evidence-based and specifically relevant to week {pregnancy_week or 'unknown'} of pregnancy
+
+Return your response as JSON with exactly this structure:
+
+{json_example}
+
+Follow this structure precisely. Make sure all string values use double quotes, not single quotes, to ensure valid JSON.
+"""
+        }
+    ]
+
+    # Request the tips; malformed JSON is caught while it streams
+    try:
+        tips_data = structured_completion(
+            NUTRITION_TIPS_SCHEMA,
+            label='nutrition tips',
+            messages=messages,
+            model=NUTRITION_TIPS_MODEL,
+            temperature=0.7,
+            max_completion_tokens=800
+        )
+
+        # Ensure we have exactly 3 tips
+        while len(tips_data) < 3:
+            # Add default tips if we have fewer than 3
+            tips_data.append(DEFAULT_TIPS[len(tips_data) % 3])
+
+        # Trim to exactly 3 tips
+        tips_data = tips_data[:3]
+
+        # Validate each tip has required fields
+        for i, tip in enumerate(tips_data):
+            if not isinstance(tip, dict) or 'title' not in tip or 'content' not in tip:
+                # Replace invalid tip with a default one
+                tips_data[i] = tip = {
+                    "title": f"Nutrition Tip {i+1}",
+                    "content": "Important nutrients during pregnancy include folate, iron, calcium, and omega-3 fatty acids."
+                }
+
+            # Ensure the fields are strings
+            if not isinstance(tip.get('title'), str):
+                tip['title'] = str(tip.get('title', f"Nutrition Tip {i+1}"))
+
+            if not isinstance(tip.get('content'), str):
+                tip['content'] = str(tip.get('content', "Important nutrients during pregnancy include folate, iron, calcium, and omega-3 fatty acids."))
+
+        return tips_data, True
+
+    except StructuredOutputError as e:
+        logger.error(f"Error parsing nutrition tips JSON: {str(e)}")
+        # Default tips if parsing fails
+        return [dict(tip) for tip in DEFAULT_TIPS], False
+
+
+class NutritionTipsCache:
+    """Per-week nutrition tips, persisted as JSON and served stale-while-revalidate."""
+
+    def __init__(self, path: str = NUTRITION_TIPS_CACHE_PATH, ttl: float = NUTRITION_TIPS_TTL,
+                 model: str = NUTRITION_TIPS_MODEL, prompt_version: int = NUTRITION_TIPS_PROMPT_VERSION):
+        """
+        Initialize the cache and load previously generated tips.
+
+        Args:
+            path: JSON file the tips are persisted to
+            ttl: Seconds after which tips are regenerated in the background
+            model: LLM model name (part of the cache key)
+            prompt_version: Prompt version (part of the cache key)
+        """
+        self.path = path
+        self.ttl = ttl
+        self.model = model
+        self.prompt_version = prompt_version
+        self._lock = threading.Lock()
+        self._refreshing = set()  # Keys with a background refresh in flight
+        self._counts = {'fresh': 0, 'stale': 0, 'miss': 0, 'generated': 0, 'errors': 0}
+        self._entries = self._load()
+
+    def _key(self, week: Optional[int]) -> str:
+        return f"{week or 'unknown'}|v{self.prompt_version}|{self.model}"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+            logger.info(f"Loaded {len(entries)} cached nutrition tip sets from {self.path}")
+            return entries
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.error(f"Error loading nutrition tips cache: {str(e)}")
+            return {}
+
+    def _save(self):
+        """Write the cache atomically (callers hold the lock)."""
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self._entries, f, indent=1)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving nutrition tips cache: {str(e)}")
+
+    def _generate(self, week: Optional[int]) -> List[Dict[str, str]]:
+        """Generate tips for a week and store them if the LLM response was valid."""
+        try:
+            tips, valid = generate_nutrition_tips(week)
+        except Exception as e:
+            logger.error(f"Error generating nutrition tips for week {week}: {str(e)}")
+            with self._lock:
+                self._counts['errors'] += 1
+            return [dict(tip) for tip in DEFAULT_TIPS]
+
+        with self._lock:
+            if valid:
+                self._entries[self._key(week)] = {'tips': tips, 'generated_at': time.time()}
+                self._counts['generated'] += 1
+                self._save()
+            else:
+                self._counts['errors'] += 1
+        return tips
+
+    def _refresh_in_background(self, week: Optional[int]):
+        key = self._key(week)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._generate(week)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='nutrition-tips-refresh', daemon=True).start()
+
+    def get(self, week: Any) -> List[Dict[str, str]]:
+        """
+        Return nutrition tips for a pregnancy week.
+
+        Args:
+            week: Pregnancy week as sent by the client (invalid values mean unknown)
+
+        Returns:
+            List of three tips
+        """
+        week = normalize_week(week)
+        with self._lock:
+            entry = self._entries.get(self._key(week))
+            if entry is None:
+                self._counts['miss'] += 1
+            elif time.time() - entry['generated_at'] > self.ttl:
+                self._counts['stale'] += 1
+            else:
+                self._counts['fresh'] += 1
+                return entry['tips']
+
+        if entry is None:
+            return self._generate(week)
+        # Serve the stale tips now, regenerate for the next request
+        self._refresh_in_background(week)
+        return entry['tips']
+
+    def warm(self, weeks: Iterable[Optional[int]] = PREGNANCY_WEEKS, force: bool = False) -> int:
+        """
+        Generate tips for every week that is missing or stale.
+
+        Args:
+            weeks: Weeks to generate
+            force: Regenerate even fresh tips
+
+        Returns:
+            Number of weeks generated
+        """
+        generated = 0
+        now = time.time()
+        for week in weeks:
+            with self._lock:
+                entry = self._entries.get(self._key(week))
+            if not force and entry is not None and now - entry['generated_at'] <= self.ttl:
+                continue
+            self._generate(week)
+            generated += 1
+        logger.info(f"Warmed nutrition tips for {generated} weeks")
+        return generated
+
+    def warm_in_background(self):
+        threading.Thread(target=self.warm, name='nutrition-tips-warm', daemon=True).start()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'model': self.model,
+                'prompt_version': self.prompt_version,
+                **self._counts
+            }
+
+
+nutrition_tips_cache = NutritionTipsCache()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Pre-generate cached pregnancy nutrition tips')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    warm_parser = subparsers.add_parser('warm', help='generate tips for missing or stale weeks')
+    warm_parser.add_argument('--weeks', type=int, nargs='+', default=list(PREGNANCY_WEEKS))
+    warm_parser.add_argument('--force', action='store_true', help='regenerate fresh tips too')
+    args = parser.parse_args()
+
+    count = nutrition_tips_cache.warm(args.weeks, force=args.force)
+    print(f"Generated tips for {count} weeks; cache at {nutrition_tips_cache.path}")
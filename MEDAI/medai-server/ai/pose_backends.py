@@ -0,0 +1,297 @@
+"""
+pose_backends.py - Pluggable MoveNet inference backends
+
+Each backend takes a letterboxed RGB uint8 image at the model's input size
+and returns MoveNet keypoints as a (17, 3) array of [y, x, score]:
+
+- 'tf':          TensorFlow SavedModel (the reference implementation)
+- 'tflite':      TFLite interpreter, float32 model
+- 'tflite-fp16': TFLite interpreter, float16-quantized model
+- 'tflite-int8': TFLite interpreter, int8 (dynamic range) quantized model
+
+TFLite backends run with POSE_NUM_THREADS threads on the XNNPACK CPU
+delegate (POSE_XNNPACK=0 uses the reference kernels instead). Pick a backend
+per deployment with POSE_BACKEND ('auto' uses the fastest artifact available
+in the model registry), and check its accuracy against the TF backend with:
+
+    python -m ai.pose_backends parity tests/fixtures/pose
+
+tests/test_pose_backends.py runs the same check in the test suite.
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from ai.inference_batcher import BATCH_MAX_SIZE
+from ai.model_registry import MOVENET_SOURCES, TFLITE_VARIANTS, load_movenet, resolve_movenet
+from ai.preprocessing import letterbox, load_letterboxed
+
+logger = logging.getLogger(__name__)
+
+POSE_BACKEND = os.environ.get('POSE_BACKEND', 'auto')
+POSE_NUM_THREADS = max(1, int(os.environ.get('POSE_NUM_THREADS', os.cpu_count() or 1)))
+POSE_XNNPACK = os.environ.get('POSE_XNNPACK', '1') != '0'
+
+# Backend name -> TFLite quantization
+TFLITE_BACKENDS = {
+    'tflite': 'float32',
+    'tflite-fp16': 'float16',
+    'tflite-int8': 'int8'
+}
+# Preference order for POSE_BACKEND=auto (fastest first)
+AUTO_BACKEND_ORDER = ['tflite-int8', 'tflite-fp16', 'tflite', 'tf']
+
+
+class PoseBackend:
+    """Runs MoveNet on preprocessed images."""
+
+    name = 'base'
+
+    def __init__(self, input_size: int):
+        self.input_size = input_size
+
+    def infer(self, image: np.ndarray) -> np.ndarray:
+        """
+        Run the model on one image.
+
+        Args:
+            image: (input_size, input_size, 3) RGB uint8 image
+
+        Returns:
+            (17, 3) array of keypoints [y, x, score]
+        """
+        raise NotImplementedError
+
+    def infer_batch(self, images: np.ndarray) -> np.ndarray:
+        """Run the model on a (N, input_size, input_size, 3) stack of images."""
+        return np.stack([self.infer(image) for image in images])
+
+
+class TFBackend(PoseBackend):
+    """MoveNet SavedModel run through TensorFlow."""
+
+    name = 'tf'
+
+    def __init__(self, variant: str = 'thunder', model=None):
+        import tensorflow as tf
+
+        super().__init__(MOVENET_SOURCES[variant]['input_size'])
+        self._tf = tf
+        self.model = model if model is not None else load_movenet(variant)
+        movenet = self.model.signatures['serving_default']
+        self.movenet = movenet
+
+        @tf.function(input_signature=[
+            tf.TensorSpec([None, self.input_size, self.input_size, 3], tf.int32)
+        ])
+        def batched_movenet(images):
+            # The single-pose signature only takes one image per call, so map
+            # it over the batch inside one graph call
+            return tf.map_fn(
+                lambda image: movenet(tf.expand_dims(image, axis=0))['output_0'][0, 0],
+                images,
+                fn_output_signature=tf.float32,
+                parallel_iterations=BATCH_MAX_SIZE
+            )
+
+        self._batched_movenet = batched_movenet
+
+    def infer(self, image: np.ndarray) -> np.ndarray:
+        if image.shape[:2] != (self.input_size, self.input_size):
+            image, _ = letterbox(image, self.input_size)
+        outputs = self.movenet(self._tf.constant(image[np.newaxis], dtype=self._tf.int32))
+        return outputs['output_0'].numpy().reshape(17, 3)
+
+    def infer_batch(self, images: np.ndarray) -> np.ndarray:
+        return self._batched_movenet(self._tf.constant(images, dtype=self._tf.int32)).numpy()
+
+
+def _tflite_interpreter_class():
+    """
+    Return the TFLite Interpreter class and its OpResolverType enum.
+
+    Prefers the lightweight tflite_runtime package, falls back to full TensorFlow.
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter, OpResolverType
+        return Interpreter, OpResolverType
+    except ImportError:
+        import tensorflow as tf
+        return tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+
+
+class TFLiteBackend(PoseBackend):
+    """MoveNet TFLite model run on the XNNPACK CPU delegate."""
+
+    def __init__(self, model_path: str, input_size: int, num_threads: int = POSE_NUM_THREADS,
+                 name: str = 'tflite', xnnpack: bool = POSE_XNNPACK):
+        super().__init__(input_size)
+        self.name = name
+        self.model_path = model_path
+        self.num_threads = max(1, num_threads)
+        self.xnnpack = xnnpack
+        self._interpreter_class, op_resolver_types = _tflite_interpreter_class()
+        # BUILTIN applies the default XNNPACK delegate to the supported ops
+        self._op_resolver_type = (op_resolver_types.BUILTIN if xnnpack
+                                  else op_resolver_types.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+        # Interpreters are not thread-safe, so each worker thread gets its own
+        self._local = threading.local()
+        self._get_interpreter()
+
+    def _get_interpreter(self):
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            interpreter = self._interpreter_class(model_path=self.model_path, num_threads=self.num_threads,
+                                                  experimental_op_resolver_type=self._op_resolver_type)
+            interpreter.allocate_tensors()
+            input_details = interpreter.get_input_details()[0]
+            output_index = interpreter.get_output_details()[0]['index']
+            state = (interpreter, input_details['index'], input_details['dtype'], output_index)
+            self._local.state = state
+        return state
+
+    def infer(self, image: np.ndarray) -> np.ndarray:
+        interpreter, input_index, input_dtype, output_index = self._get_interpreter()
+        if image.shape[:2] != (self.input_size, self.input_size):
+            image, _ = letterbox(image, self.input_size)
+        interpreter.set_tensor(input_index, image[np.newaxis].astype(input_dtype, copy=False))
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index).reshape(17, 3).copy()
+
+
+def create_backend(name: Optional[str] = None, variant: str = 'thunder',
+                   num_threads: int = POSE_NUM_THREADS) -> PoseBackend:
+    """
+    Create a pose backend.
+
+    Args:
+        name: 'tf', 'tflite', 'tflite-fp16', 'tflite-int8' or 'auto' (defaults to POSE_BACKEND)
+        variant: MoveNet variant ('thunder' or 'lightning')
+        num_threads: CPU threads for TFLite backends
+
+    Returns:
+        Backend instance
+
+    Raises:
+        FileNotFoundError: If the requested TFLite artifact is not in the model registry
+        ValueError: If the backend name is unknown
+    """
+    name = name or POSE_BACKEND
+    input_size = MOVENET_SOURCES[variant]['input_size']
+
+    if name == 'auto':
+        # Fastest TFLite artifact present in the registry, else the TF SavedModel
+        name = next((candidate for candidate in AUTO_BACKEND_ORDER
+                     if candidate not in TFLITE_BACKENDS or
+                     resolve_movenet(variant, fmt=TFLITE_VARIANTS[TFLITE_BACKENDS[candidate]][0])),
+                    'tf')
+
+    if name == 'tf':
+        backend = TFBackend(variant)
+    elif name in TFLITE_BACKENDS:
+        quantization = TFLITE_BACKENDS[name]
+        artifact = resolve_movenet(variant, fmt=TFLITE_VARIANTS[quantization][0])
+        if artifact is None:
+            raise FileNotFoundError(f"No {name} artifact for MoveNet {variant}; "
+                                    f"run 'python -m ai.model_registry fetch {variant} --tflite'")
+        backend = TFLiteBackend(artifact.tflite_path(quantization), input_size, num_threads, name=name)
+    else:
+        raise ValueError(f"Unknown pose backend: {name}")
+
+    logger.info(f"Using {backend.name} pose backend for MoveNet {variant}")
+    return backend
+
+
+def parity_report(reference: np.ndarray, candidate: np.ndarray,
+                  min_score: float = 0.3, pck_threshold: float = 0.05) -> Dict[str, float]:
+    """
+    Compare keypoints from a candidate backend with the reference backend.
+
+    Args:
+        reference: (N, 17, 3) reference keypoints [y, x, score]
+        candidate: (N, 17, 3) candidate keypoints [y, x, score]
+        min_score: Only keypoints the reference is confident about are compared
+        pck_threshold: Distance (normalized) counted as a correct keypoint
+
+    Returns:
+        Mean/max position error, PCK and mean score difference
+    """
+    mask = reference[..., 2] >= min_score
+    errors = np.linalg.norm(reference[..., :2] - candidate[..., :2], axis=-1)[mask]
+    if errors.size == 0:
+        return {'compared_keypoints': 0}
+    return {
+        'compared_keypoints': int(errors.size),
+        'mean_error': float(errors.mean()),
+        'max_error': float(errors.max()),
+        'pck': float((errors < pck_threshold).mean()),
+        'mean_score_diff': float(np.abs(reference[..., 2] - candidate[..., 2]).mean())
+    }
+
+
+def _load_fixture_images(path: str, input_size: int) -> List[np.ndarray]:
+    images = []
+    for filename in sorted(os.listdir(path)):
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(path, filename), 'rb') as f:
+                # Each fixture needs its own buffer since they are all kept
+                buffer = np.empty((input_size, input_size, 3), dtype=np.uint8)
+                image, _ = load_letterboxed(f.read(), input_size, out=buffer)
+            images.append(image)
+    return images
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Pose backend accuracy parity and speed check')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parity_parser = subparsers.add_parser('parity', help='compare backends against the TF backend')
+    parity_parser.add_argument('images', help='directory of fixture images (jpg/png)')
+    parity_parser.add_argument('--variant', default='thunder', choices=sorted(MOVENET_SOURCES))
+    parity_parser.add_argument('--backends', nargs='+', default=list(TFLITE_BACKENDS))
+    parity_parser.add_argument('--threads', type=int, default=POSE_NUM_THREADS)
+    parity_parser.add_argument('--max-mean-error', type=float, default=0.02,
+                               help='fail if a backend exceeds this mean keypoint error')
+    parity_parser.add_argument('--repeat', type=int, default=3, help='timing passes per backend')
+    args = parser.parse_args()
+
+    fixtures = _load_fixture_images(args.images, MOVENET_SOURCES[args.variant]['input_size'])
+    if not fixtures:
+        raise SystemExit(f"No fixture images found in {args.images}")
+
+    def run(backend):
+        keypoints = np.stack([backend.infer(image) for image in fixtures])
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for image in fixtures:
+                backend.infer(image)
+        ms_per_frame = (time.perf_counter() - start) / (args.repeat * len(fixtures)) * 1000
+        return keypoints, ms_per_frame
+
+    reference, reference_ms = run(create_backend('tf', args.variant))
+    results = {'tf': {'ms_per_frame': round(reference_ms, 2)}}
+    failed = False
+
+    for name in args.backends:
+        try:
+            keypoints, ms = run(create_backend(name, args.variant, args.threads))
+        except FileNotFoundError as e:
+            results[name] = {'skipped': str(e)}
+            continue
+        report = parity_report(reference, keypoints)
+        report['ms_per_frame'] = round(ms, 2)
+        report['speedup'] = round(reference_ms / ms, 2) if ms else None
+        if report.get('mean_error', 0.0) > args.max_mean_error:
+            report['failed'] = True
+            failed = True
+        results[name] = report
+
+    print(json.dumps(results, indent=2))
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,127 @@
+"""
+pose_cropping.py - Crop-region tracking for MoveNet ("smart cropping")
+
+MoveNet is most accurate when the subject fills its input. Letterboxing the
+whole camera frame wastes most of the 256x256 input on background, so for
+tracked sessions the next frame is instead cropped around where the body
+was in the previous frame, following the MoveNet reference cropping
+algorithm: the crop is centered on the hips and sized from the torso and
+the full body extent. When the torso is lost the tracker returns to the
+full frame.
+
+Crop regions are squares expressed in "letterbox coordinates": normalized
+coordinates of the square the full frame is letterboxed into. Keypoints
+detected in a crop are mapped back to the same coordinates, so they are
+interchangeable with keypoints from a full-frame pass.
+"""
+
+import math
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from ai.pose_frame import KEYPOINT_INDEX
+from ai.preprocessing import letterbox_buffer
+
+CROP_MIN_KEYPOINT_SCORE = 0.2  # Keypoints below this score are ignored when sizing the crop
+CROP_TORSO_EXPANSION = 1.9     # Crop half-size relative to the torso extent
+CROP_BODY_EXPANSION = 1.2      # Crop half-size relative to the body extent
+
+TORSO_INDICES = [KEYPOINT_INDEX[name] for name in
+                 ('left_shoulder', 'right_shoulder', 'left_hip', 'right_hip')]
+SHOULDER_INDICES = TORSO_INDICES[:2]
+HIP_INDICES = TORSO_INDICES[2:]
+
+
+class CropRegion(NamedTuple):
+    """Square crop in letterbox coordinates."""
+    y_min: float
+    x_min: float
+    size: float  # Side length (1.0 = the whole letterbox square)
+
+
+FULL_FRAME = CropRegion(0.0, 0.0, 1.0)
+
+
+def torso_visible(keypoints: np.ndarray, min_score: float = CROP_MIN_KEYPOINT_SCORE) -> bool:
+    """Whether at least one shoulder and one hip are detected in (17, 3) MoveNet keypoints."""
+    scores = keypoints[:, 2]
+    return bool(scores[SHOULDER_INDICES].max() > min_score and scores[HIP_INDICES].max() > min_score)
+
+
+def next_crop_region(keypoints: np.ndarray, image_width: int, image_height: int) -> CropRegion:
+    """
+    Crop region for the next frame, from keypoints detected in this one.
+
+    Args:
+        keypoints: (17, 3) MoveNet keypoints [y, x, score] in letterbox coordinates
+        image_width: Width of the full frame in pixels
+        image_height: Height of the full frame in pixels
+
+    Returns:
+        Crop region, or FULL_FRAME if the torso was not found
+    """
+    if not torso_visible(keypoints):
+        return FULL_FRAME
+
+    side = max(image_width, image_height)
+    # Extent of the image inside the letterbox square
+    pad_x = (side - image_width) / 2 / side
+    pad_y = (side - image_height) / 2 / side
+
+    center_y = keypoints[HIP_INDICES, 0].mean()
+    center_x = keypoints[HIP_INDICES, 1].mean()
+    offsets = np.abs(keypoints[:, :2] - (center_y, center_x))
+    torso_range = offsets[TORSO_INDICES].max()
+    visible = keypoints[:, 2] > CROP_MIN_KEYPOINT_SCORE
+    body_range = offsets[visible].max()
+
+    half = max(torso_range * CROP_TORSO_EXPANSION, body_range * CROP_BODY_EXPANSION)
+    # No need to extend past the farthest image border
+    half = min(half, max(center_x - pad_x, 1 - pad_x - center_x, center_y - pad_y, 1 - pad_y - center_y))
+    if half <= 0 or half >= 0.5:
+        return FULL_FRAME
+    return CropRegion(float(center_y - half), float(center_x - half), float(2 * half))
+
+
+def crop_decode_size(region: CropRegion, input_size: int) -> int:
+    """Smallest long edge a frame must be decoded at for the crop to cover input_size pixels."""
+    return math.ceil(input_size / region.size)
+
+
+def crop_to_input(image: np.ndarray, region: CropRegion, input_size: int,
+                  out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Crop and resize a full frame to the model input, padding outside the image with black.
+
+    Args:
+        image: (H, W, 3) full frame
+        region: Crop region in letterbox coordinates
+        input_size: Side of the square model input
+        out: Destination buffer (defaults to this thread's reusable letterbox buffer)
+
+    Returns:
+        (input_size, input_size, 3) crop
+    """
+    if out is None:
+        out = letterbox_buffer(input_size)
+    height, width = image.shape[:2]
+    side = max(width, height)
+    scale = input_size / (region.size * side)
+    # Source pixel -> crop pixel
+    matrix = np.array([
+        [scale, 0.0, ((side - width) / 2 - region.x_min * side) * scale],
+        [0.0, scale, ((side - height) / 2 - region.y_min * side) * scale]
+    ])
+    cv2.warpAffine(image, matrix, (input_size, input_size), dst=out, flags=cv2.INTER_LINEAR,
+                   borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    return out
+
+
+def uncrop_keypoints(keypoints: np.ndarray, region: CropRegion) -> np.ndarray:
+    """Map (17, 3) MoveNet keypoints detected in a crop back to letterbox coordinates."""
+    mapped = keypoints.copy()
+    mapped[:, 0] = region.y_min + keypoints[:, 0] * region.size
+    mapped[:, 1] = region.x_min + keypoints[:, 1] * region.size
+    return mapped
@@ -0,0 +1,109 @@
+"""
+pose_frame.py - Array-backed keypoint representation for pose estimation
+
+A PoseFrame holds the 17 MoveNet keypoints as a single (17, 3) float32 array
+of [x, y, score] rows indexed by KEYPOINT_NAMES. All geometry (angles,
+distances) runs as batched NumPy operations on these arrays; the list of
+keypoint dictionaries used by the API is only built when a response is
+serialized.
+"""
+
+from typing import Any, Dict, Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+# MoveNet keypoint order
+KEYPOINT_NAMES = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
+    'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
+    'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
+    'left_knee', 'right_knee', 'left_ankle', 'right_ankle'
+]
+KEYPOINT_INDEX = {name: idx for idx, name in enumerate(KEYPOINT_NAMES)}
+NUM_KEYPOINTS = len(KEYPOINT_NAMES)
+
+
+class PoseFrame:
+    """Keypoints for one frame as a (17, 3) float32 array of [x, y, score]."""
+
+    __slots__ = ('data',)
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+
+    @classmethod
+    def from_movenet(cls, keypoints: np.ndarray) -> 'PoseFrame':
+        """Build a frame from MoveNet output rows of [y, x, score]."""
+        keypoints = np.asarray(keypoints, dtype=np.float32).reshape(NUM_KEYPOINTS, 3)
+        data = np.empty((NUM_KEYPOINTS, 3), dtype=np.float32)
+        # Clamp to normalized coordinates [0, 1]
+        np.clip(keypoints[:, 1], 0.0, 1.0, out=data[:, 0])
+        np.clip(keypoints[:, 0], 0.0, 1.0, out=data[:, 1])
+        data[:, 2] = keypoints[:, 2]
+        return cls(data)
+
+    @classmethod
+    def from_keypoints(cls, keypoints: Iterable[Dict[str, Any]]) -> 'PoseFrame':
+        """Build a frame from a list of {'part', 'position', 'score'} dictionaries."""
+        data = np.zeros((NUM_KEYPOINTS, 3), dtype=np.float32)
+        for kp in keypoints:
+            idx = KEYPOINT_INDEX.get(kp['part'])
+            if idx is not None:
+                data[idx] = (kp['position']['x'], kp['position']['y'], kp.get('score', 0.0))
+        return cls(data)
+
+    @classmethod
+    def coerce(cls, keypoints: Union['PoseFrame', List[Dict[str, Any]]]) -> 'PoseFrame':
+        """Accept either a PoseFrame or a list of keypoint dictionaries."""
+        if isinstance(keypoints, PoseFrame):
+            return keypoints
+        return cls.from_keypoints(keypoints)
+
+    @property
+    def xy(self) -> np.ndarray:
+        """(17, 2) view of the keypoint positions."""
+        return self.data[:, :2]
+
+    @property
+    def scores(self) -> np.ndarray:
+        """(17,) view of the keypoint confidence scores."""
+        return self.data[:, 2]
+
+    def copy(self) -> 'PoseFrame':
+        return PoseFrame(self.data.copy())
+
+    def to_keypoints(self) -> List[Dict[str, Any]]:
+        """Serialize to the API's list of keypoint dictionaries."""
+        rows = self.data.tolist()
+        return [
+            {
+                'part': name,
+                'position': {'x': x, 'y': y},
+                'score': score
+            }
+            for name, (x, y, score) in zip(KEYPOINT_NAMES, rows)
+        ]
+
+
+def angle_triplet_indices(triplets: Sequence[Tuple[str, str, str]]) -> np.ndarray:
+    """Convert (a, b, c) keypoint name triplets into a (N, 3) index array."""
+    return np.array([[KEYPOINT_INDEX[a], KEYPOINT_INDEX[b], KEYPOINT_INDEX[c]]
+                     for a, b, c in triplets], dtype=np.intp).reshape(-1, 3)
+
+
+def joint_angles(xy: np.ndarray, triplets: np.ndarray) -> np.ndarray:
+    """
+    Calculate the angles (in degrees, 0-180) at vertex b for many (a, b, c) triplets.
+
+    Args:
+        xy: (17, 2) keypoint positions
+        triplets: (N, 3) keypoint indices, with the vertex in the middle column
+
+    Returns:
+        (N,) array of angles; NaN where a limb has zero length
+    """
+    ba = xy[triplets[:, 0]] - xy[triplets[:, 1]]
+    bc = xy[triplets[:, 2]] - xy[triplets[:, 1]]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cosine = np.einsum('ij,ij->i', ba, bc) / (np.linalg.norm(ba, axis=1) * np.linalg.norm(bc, axis=1))
+    return np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0)))
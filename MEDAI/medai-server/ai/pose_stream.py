@@ -0,0 +1,219 @@
+"""
+pose_stream.py - Continuous pose feedback over a persistent connection
+
+A PoseStreamSession backs one streaming connection (e.g. a WebSocket).
+The connection handler pushes binary camera frames in with submit_frame();
+a worker thread estimates the pose of the newest frame and pushes results
+back through a send callback. If the client sends frames faster than they
+can be processed, older pending frames are dropped (latest-frame-wins), so
+results never lag further and further behind the camera.
+
+Keypoint smoothing state is tied to the connection and released when the
+session closes. Textual feedback is throttled to one message per
+POSE_STREAM_FEEDBACK_INTERVAL seconds.
+
+Messages sent to the client (JSON):
+    {"type": "config",   "data": {"poseId", "trimester", "referenceKeypoints"}}
+    {"type": "pose",     "data": {"accuracy", "keypoints", "processingTime",
+                                  "timestamp", "frameId", "droppedFrames", "reused"}}
+    {"type": "feedback", "data": {"feedback", "accuracy", "isFinal"}}
+    {"type": "error",    "data": {"error"}}
+
+Control messages from the client (JSON text):
+    {"type": "config", "poseId": "2-1", "trimester": "second"}
+    {"type": "end"}    final feedback for the last frame, then the stream closes
+"""
+
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+POSE_STREAM_FEEDBACK_INTERVAL = float(os.environ.get('POSE_STREAM_FEEDBACK_INTERVAL', 3.0))
+POSE_STREAM_IDLE_TIMEOUT = float(os.environ.get('POSE_STREAM_IDLE_TIMEOUT', 60.0))  # seconds without frames
+
+
+class LatestFrameSlot:
+    """Single-slot mailbox: a new frame replaces any frame still waiting."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._frame_id = 0
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame: Any) -> int:
+        """Store a frame, dropping the pending one if it was never taken. Returns its frame ID."""
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+            self._frame_id += 1
+            self._frame = frame
+            self._condition.notify()
+            return self._frame_id
+
+    def take(self, timeout: Optional[float] = None):
+        """
+        Wait for the newest frame.
+
+        Returns:
+            Tuple of (frame_id, frame), or None on timeout or when closed
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._frame is not None or self._closed, timeout):
+                return None
+            if self._frame is None:
+                return None
+            frame, self._frame = self._frame, None
+            return self._frame_id, frame
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class PoseStreamSession:
+    """Pose estimation state and worker for one streaming connection."""
+
+    def __init__(self, estimator, send: Callable[[str], None], pose_id: str = '1-1',
+                 trimester: Optional[str] = None,
+                 feedback_interval: float = POSE_STREAM_FEEDBACK_INTERVAL):
+        """
+        Initialize the session and start its worker thread.
+
+        Args:
+            estimator: YogaPoseEstimator used for detection and feedback
+            send: Callback that delivers a JSON text message to the client
+            pose_id: Initial yoga pose identifier
+            trimester: Optional pregnancy trimester
+            feedback_interval: Minimum seconds between feedback messages
+        """
+        self.estimator = estimator
+        self.session_id = f"stream-{uuid.uuid4().hex}"  # Tracker state lives as long as the connection
+        self.pose_id = pose_id
+        self.trimester = trimester
+        self.feedback_interval = feedback_interval
+        self._send = send
+        self._slot = LatestFrameSlot()
+        self._final_requested = threading.Event()
+        self._last_feedback = 0.0
+        self._last_frame_at = time.monotonic()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name='pose-stream', daemon=True)
+
+        self._send_config()
+        self._worker.start()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _emit(self, message_type: str, data: Dict[str, Any]):
+        if not self._closed:
+            try:
+                self._send(json.dumps({'type': message_type, 'data': data}))
+            except Exception as e:
+                # The connection is gone; stop processing frames for it
+                logger.info(f"Pose stream {self.session_id} send failed: {str(e)}")
+                self.close()
+
+    def _send_config(self):
+        self._emit('config', {
+            'poseId': self.pose_id,
+            'trimester': self.trimester,
+            'referenceKeypoints': self.estimator.get_reference_pose(self.pose_id)['keypoints']
+        })
+
+    def submit_frame(self, image_data: bytes) -> int:
+        """Queue a binary frame for processing (replacing any frame not yet started)."""
+        self._last_frame_at = time.monotonic()
+        return self._slot.put(image_data)
+
+    def handle_control(self, message: str):
+        """Apply a JSON control message from the client."""
+        try:
+            control = json.loads(message)
+        except ValueError:
+            self._emit('error', {'error': 'Invalid control message'})
+            return
+
+        if control.get('type') == 'config':
+            pose_changed = control.get('poseId', self.pose_id) != self.pose_id
+            self.pose_id = control.get('poseId', self.pose_id)
+            self.trimester = control.get('trimester', self.trimester)
+            if pose_changed:
+                # Smoothing history from the previous pose does not apply to the new one
+                self.estimator.end_session(self.session_id)
+            self._send_config()
+        elif control.get('type') == 'end':
+            self._final_requested.set()
+            self._slot.close()
+        else:
+            self._emit('error', {'error': f"Unknown message type: {control.get('type')}"})
+
+    def is_idle(self) -> bool:
+        return time.monotonic() - self._last_frame_at > POSE_STREAM_IDLE_TIMEOUT
+
+    def _run(self):
+        detected_frame = None
+        accuracy = None
+        while not self._closed:
+            item = self._slot.take(timeout=1.0)
+            if item is None:
+                if self._final_requested.is_set():
+                    break
+                continue
+
+            frame_id, image_data = item
+            start_time = time.time()
+            results, detected_frame = self.estimator._estimate_pose_frame(
+                image_data, self.pose_id, self.trimester, self.session_id)
+            accuracy = results['accuracy']
+
+            self._emit('pose', {
+                'accuracy': accuracy,
+                'keypoints': results['keypoints'],
+                'processingTime': time.time() - start_time,
+                'timestamp': time.time(),
+                'frameId': frame_id,
+                'droppedFrames': self._slot.dropped,
+                'reused': results.get('reused', False),
+                **({'error': results['error']} if 'error' in results else {})
+            })
+
+            now = time.monotonic()
+            if now - self._last_feedback >= self.feedback_interval:
+                self._last_feedback = now
+                self._emit_feedback(detected_frame, accuracy, is_final=False)
+
+        if self._final_requested.is_set() and detected_frame is not None:
+            self._emit_feedback(detected_frame, accuracy, is_final=True)
+        self.close()
+
+    def _emit_feedback(self, detected_frame, accuracy: float, is_final: bool):
+        try:
+            feedback = self.estimator.generate_pose_feedback(detected_frame, self.pose_id, accuracy, is_final)
+        except Exception as e:
+            logger.error(f"Error generating stream feedback: {str(e)}")
+            return
+        self._emit('feedback', {'feedback': feedback, 'accuracy': accuracy, 'isFinal': is_final})
+
+    def close(self):
+        """Stop the worker and release the connection's tracking state."""
+        if self._closed:
+            return
+        self._closed = True
+        self._slot.close()
+        self.estimator.end_session(self.session_id)
+
+    def wait_closed(self, timeout: Optional[float] = None):
+        """Wait for the worker to finish (e.g. after an 'end' message)."""
+        if threading.current_thread() is not self._worker:
+            self._worker.join(timeout)
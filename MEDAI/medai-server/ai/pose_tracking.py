@@ -0,0 +1,187 @@
+"""
+pose_tracking.py - Per-session keypoint tracking state for yoga pose estimation
+
+Each practice session gets its own small ring buffer of recent keypoint
+frames so temporal smoothing never mixes frames from different users.
+Sessions are kept in an LRU store and expire after a period of inactivity.
+
+Each tracker also holds a motion gate: a 32x32 grayscale thumbnail of the
+last frame that went through the model. While the user holds a pose,
+consecutive frames barely differ, so the last keypoints are reused instead
+of running inference again (up to a maximum number of frames and age).
+It also remembers the crop region for the session's next MoveNet pass.
+"""
+
+import os
+import time
+import threading
+import logging
+from typing import Optional
+
+import cv2
+
+import numpy as np
+from scipy.ndimage import gaussian_filter1d
+
+from ai.pose_cropping import FULL_FRAME
+from ai.pose_frame import NUM_KEYPOINTS
+from ai.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Tracker store limits (override through the environment)
+POSE_SESSION_MAX = int(os.environ.get('POSE_SESSION_MAX', 5000))
+POSE_SESSION_TTL = float(os.environ.get('POSE_SESSION_TTL', 600))  # seconds idle before eviction
+
+SMOOTHING_HISTORY_SIZE = 5  # Number of frames to keep for smoothing
+SMOOTHING_MIN_HISTORY = 3   # Frames needed before smoothing kicks in
+SMOOTHING_SIGMA = 1.0
+
+# Motion gate (set MOTION_GATE_THRESHOLD to 0 to always run inference)
+MOTION_GATE_THRESHOLD = float(os.environ.get('MOTION_GATE_THRESHOLD', 0.02))  # mean abs. gray difference (0-1)
+MOTION_GATE_MAX_REUSE = int(os.environ.get('MOTION_GATE_MAX_REUSE', 5))       # consecutive reused frames
+MOTION_GATE_MAX_AGE = float(os.environ.get('MOTION_GATE_MAX_AGE', 1.0))       # seconds since last inference
+MOTION_SIGNATURE_SIZE = 32
+
+
+def _last_sample_gaussian_weights(length: int, sigma: float) -> np.ndarray:
+    """
+    Weights that give gaussian_filter1d(history, sigma)[-1] as a dot product.
+
+    Filtering an identity matrix shows how much each input frame contributes
+    to the last output sample (including the reflected boundary), so we can
+    smooth a window of any length with a single weighted sum.
+    """
+    return gaussian_filter1d(np.eye(length), sigma=sigma, axis=0)[-1].astype(np.float32)
+
+
+_SMOOTHING_WEIGHTS = {
+    length: _last_sample_gaussian_weights(length, SMOOTHING_SIGMA)
+    for length in range(SMOOTHING_MIN_HISTORY, SMOOTHING_HISTORY_SIZE + 1)
+}
+
+
+def motion_signature(image: np.ndarray) -> np.ndarray:
+    """Downsampled grayscale thumbnail of an RGB image, for cheap change detection."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    return cv2.resize(gray, (MOTION_SIGNATURE_SIZE, MOTION_SIGNATURE_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def motion_between(signature_a: np.ndarray, signature_b: np.ndarray) -> float:
+    """Mean absolute difference between two motion signatures, scaled to 0-1."""
+    return float(cv2.absdiff(signature_a, signature_b).mean()) / 255.0
+
+
+class PoseTracker:
+    """Keypoint history and motion gate for a single practice session."""
+
+    __slots__ = ('_frames', '_head', '_count', 'lock',
+                 '_signature', '_last_output', '_last_inference_at', '_reuse_count',
+                 'crop_region')
+
+    def __init__(self, history_size: int = SMOOTHING_HISTORY_SIZE):
+        # Ring buffer of frames, each a (17, 3) array of [x, y, score]
+        self._frames = np.zeros((history_size, NUM_KEYPOINTS, 3), dtype=np.float32)
+        self._head = 0  # Next slot to write
+        self._count = 0
+        self.lock = threading.Lock()
+        # Motion gate state: thumbnail and keypoints of the last model inference
+        self._signature = None
+        self._last_output = None
+        self._last_inference_at = 0.0
+        self._reuse_count = 0
+        # Where to crop the next frame for MoveNet (see ai.pose_cropping)
+        self.crop_region = FULL_FRAME
+
+    def __len__(self) -> int:
+        return self._count
+
+    def push(self, frame: np.ndarray):
+        """Append a (17, 3) [x, y, score] frame, overwriting the oldest when full."""
+        self._frames[self._head] = frame
+        self._head = (self._head + 1) % len(self._frames)
+        self._count = min(self._count + 1, len(self._frames))
+
+    def _recent(self, n: int) -> np.ndarray:
+        """Return the last n frames, oldest first."""
+        size = len(self._frames)
+        indices = (self._head - n + np.arange(n)) % size
+        return self._frames[indices]
+
+    def smooth(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Add a frame to the history and return its temporally smoothed version.
+
+        Positions use a Gaussian filter over the history; scores use the mean
+        of the three most recent frames.
+
+        Args:
+            frame: Current (17, 3) [x, y, score] keypoint array
+
+        Returns:
+            Smoothed (17, 3) array (the input frame until enough history exists)
+        """
+        self.push(frame)
+        if self._count < SMOOTHING_MIN_HISTORY:
+            return frame
+
+        history = self._recent(self._count)
+        smoothed = np.empty((NUM_KEYPOINTS, 3), dtype=np.float32)
+        smoothed[:, :2] = np.tensordot(_SMOOTHING_WEIGHTS[self._count], history[:, :, :2], axes=1)
+        smoothed[:, 2] = history[-SMOOTHING_MIN_HISTORY:, :, 2].mean(axis=0)
+        return smoothed
+
+    def reuse_if_static(self, signature: np.ndarray,
+                        threshold: float = MOTION_GATE_THRESHOLD) -> Optional[np.ndarray]:
+        """
+        Return the last keypoints if the frame has barely changed since the last inference.
+
+        Args:
+            signature: motion_signature() of the current frame
+            threshold: Maximum mean grayscale difference (0-1) treated as "no motion"
+
+        Returns:
+            (17, 3) keypoints to reuse, or None if the model should run
+        """
+        if (threshold <= 0 or self._last_output is None or
+                self._reuse_count >= MOTION_GATE_MAX_REUSE or
+                time.monotonic() - self._last_inference_at > MOTION_GATE_MAX_AGE or
+                motion_between(signature, self._signature) > threshold):
+            return None
+        self._reuse_count += 1
+        return self._last_output
+
+    def record_inference(self, signature: np.ndarray, output: np.ndarray):
+        """Remember the frame thumbnail and keypoints produced by a model inference."""
+        self._signature = signature
+        self._last_output = output
+        self._last_inference_at = time.monotonic()
+        self._reuse_count = 0
+
+    def reset(self):
+        self._head = 0
+        self._count = 0
+        self._signature = None
+        self._last_output = None
+        self._reuse_count = 0
+        self.crop_region = FULL_FRAME
+
+
+class PoseTrackerStore:
+    """Session-keyed store of PoseTracker objects with LRU/TTL eviction."""
+
+    def __init__(self, max_sessions: int = POSE_SESSION_MAX, ttl: float = POSE_SESSION_TTL):
+        self._trackers = TTLCache(max_size=max_sessions, ttl=ttl)
+
+    def __len__(self) -> int:
+        return len(self._trackers)
+
+    def get(self, session_id: Optional[str]) -> Optional[PoseTracker]:
+        """Return the tracker for a session, creating it on first use."""
+        if not session_id:
+            return None
+        return self._trackers.get_or_create(session_id, PoseTracker)
+
+    def discard(self, session_id: str):
+        """Drop a session's state (e.g. when the client ends the practice)."""
+        self._trackers.pop(session_id)
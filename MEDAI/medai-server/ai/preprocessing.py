@@ -0,0 +1,187 @@
+"""
+preprocessing.py - Shared image decoding and letterboxing for the pose estimators
+
+Camera frames arrive as full-resolution JPEGs (often 12MP) but MoveNet only
+needs a 256x256 input. Instead of decoding at full size, resizing, padding
+and then resizing again in TensorFlow, frames go through one fused stage:
+
+1. JPEGs are decoded at a reduced DCT scale (1/2, 1/4 or 1/8) using PIL's
+   draft mode, so most of the pixels are never decoded at all.
+2. The decoded image is resized once, straight into the content area of a
+   preallocated, per-thread letterbox buffer; only the padding bars are
+   cleared.
+
+Benchmark at common phone camera resolutions with:
+
+    python -m ai.preprocessing
+"""
+
+import threading
+from io import BytesIO
+from typing import BinaryIO, NamedTuple, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+MEDIAPIPE_MAX_EDGE = 640  # MediaPipe resizes internally; larger inputs only cost decode time
+
+_buffers = threading.local()
+
+
+class LetterboxInfo(NamedTuple):
+    """How an image was placed in a square letterbox."""
+    scale: float     # Letterbox pixels per source pixel
+    offset_x: int    # Left padding in letterbox pixels
+    offset_y: int    # Top padding in letterbox pixels
+    width: int       # Width of the scaled image inside the letterbox
+    height: int      # Height of the scaled image inside the letterbox
+    source_width: int
+    source_height: int
+
+
+def letterbox_buffer(size: int) -> np.ndarray:
+    """
+    Return this thread's reusable (size, size, 3) uint8 buffer.
+
+    The contents are overwritten by the next letterbox() call on the same
+    thread, so copy the array if it has to outlive the current request.
+    """
+    cache = getattr(_buffers, 'letterbox', None)
+    if cache is None:
+        cache = _buffers.letterbox = {}
+    buffer = cache.get(size)
+    if buffer is None:
+        buffer = cache[size] = np.zeros((size, size, 3), dtype=np.uint8)
+    return buffer
+
+
+def decode_image(image_data: Union[bytes, BinaryIO], min_size: Optional[int] = None,
+                 max_edge: Optional[int] = None) -> np.ndarray:
+    """
+    Decode image bytes to an RGB uint8 array, at reduced scale when possible.
+
+    Args:
+        image_data: JPEG/PNG image data as bytes or a seekable binary file object
+                    (e.g. an upload stream, decoded without copying it into memory first)
+        min_size: Smallest acceptable length of the longer edge after decoding.
+                  JPEGs are DCT-scaled down as far as possible without going below it.
+        max_edge: If set, the decoded image is also resized so its longer edge
+                  is at most this many pixels
+
+    Returns:
+        (H, W, 3) RGB image
+    """
+    image = Image.open(image_data if hasattr(image_data, 'read') else BytesIO(image_data))
+
+    target = min_size or max_edge
+    if target and image.format == 'JPEG':
+        # draft() keeps both sides >= the requested box, so ask for a box
+        # with the same aspect ratio as the image
+        width, height = image.size
+        ratio = target / max(width, height)
+        image.draft('RGB', (max(1, int(width * ratio)), max(1, int(height * ratio))))
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    array = np.asarray(image)
+
+    if max_edge and max(array.shape[:2]) > max_edge:
+        height, width = array.shape[:2]
+        scale = max_edge / max(width, height)
+        array = cv2.resize(array, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    return array
+
+
+def letterbox(image: np.ndarray, size: int,
+              out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, LetterboxInfo]:
+    """
+    Resize an image to fit a size x size square, padding the rest with black.
+
+    Args:
+        image: (H, W, 3) uint8 image
+        size: Side of the square output
+        out: Destination buffer (defaults to this thread's reusable buffer)
+
+    Returns:
+        Tuple of (letterboxed image, placement info)
+    """
+    if out is None:
+        out = letterbox_buffer(size)
+
+    source_height, source_width = image.shape[:2]
+    scale = size / max(source_width, source_height)
+    width = min(size, max(1, int(source_width * scale)))
+    height = min(size, max(1, int(source_height * scale)))
+    offset_x = (size - width) // 2
+    offset_y = (size - height) // 2
+
+    # Clear only the padding bars; the content area is fully overwritten below
+    out[:offset_y] = 0
+    out[offset_y + height:] = 0
+    out[offset_y:offset_y + height, :offset_x] = 0
+    out[offset_y:offset_y + height, offset_x + width:] = 0
+
+    content = out[offset_y:offset_y + height, offset_x:offset_x + width]
+    if (width, height) == (source_width, source_height):
+        content[...] = image
+    else:
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+        cv2.resize(image, (width, height), dst=content, interpolation=interpolation)
+
+    return out, LetterboxInfo(scale, offset_x, offset_y, width, height, source_width, source_height)
+
+
+def load_letterboxed(image_data: Union[bytes, BinaryIO], size: int,
+                     out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, LetterboxInfo]:
+    """Decode image bytes at reduced scale and letterbox them to size x size."""
+    return letterbox(decode_image(image_data, min_size=size), size, out)
+
+
+if __name__ == '__main__':
+    # Benchmark: the previous PIL full decode + cv2 resize + pad pipeline vs.
+    # the fused reduced-scale decode + in-place letterbox
+    import time
+
+    resolutions = {
+        '720p': (1280, 720),
+        '1080p': (1920, 1080),
+        '12MP 4:3': (4032, 3024),
+        '12MP portrait': (3024, 4032)
+    }
+    repeat = 20
+    rng = np.random.default_rng(0)
+
+    def previous_pipeline(image_data, input_size=256):
+        image_np = np.array(Image.open(BytesIO(image_data)).convert('RGB'))
+        height, width = image_np.shape[:2]
+        if height > width:
+            new_height, new_width = input_size, int(width * (input_size / height))
+        else:
+            new_width, new_height = input_size, int(height * (input_size / width))
+        image_np = cv2.resize(image_np, (new_width, new_height))
+        square = np.zeros((input_size, input_size, 3), dtype=np.uint8)
+        offset_x, offset_y = (input_size - new_width) // 2, (input_size - new_height) // 2
+        square[offset_y:offset_y + new_height, offset_x:offset_x + new_width] = image_np
+        return square
+
+    for label, (width, height) in resolutions.items():
+        # Smooth gradient plus noise so the JPEG has realistic entropy
+        base = np.linspace(0, 255, width * height * 3).reshape(height, width, 3)
+        pixels = np.clip(base + rng.normal(0, 3, base.shape), 0, 255).astype(np.uint8)
+        buffer = BytesIO()
+        Image.fromarray(pixels).save(buffer, 'JPEG', quality=90)
+        image_data = buffer.getvalue()
+
+        timings = {}
+        for name, fn in [('previous', previous_pipeline),
+                         ('fused', lambda data: load_letterboxed(data, 256)[0])]:
+            fn(image_data)
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn(image_data)
+            timings[name] = (time.perf_counter() - start) / repeat * 1000
+
+        print(f"{label:>14} {width}x{height}: previous {timings['previous']:7.2f} ms, "
+              f"fused {timings['fused']:6.2f} ms ({timings['previous'] / timings['fused']:.1f}x)")
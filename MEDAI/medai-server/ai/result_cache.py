@@ -0,0 +1,373 @@
+"""
+result_cache.py - Content-addressed cache for vision identification results
+
+Users often scan the same medicine box or food item several times in a row.
+Results are cached under a hash of the normalized image, namespaced by task
+and prompt version, so a re-scan returns the previous answer without calling
+the vision model.
+
+Food results are keyed by a 64-bit difference hash (dHash). Photos of the
+same dish never hash identically, so a lookup also accepts the closest
+cached image within VISION_CACHE_MAX_DISTANCE differing bits. All other
+tasks (medicine) are keyed by a content hash and only match the exact same
+image: different drug boxes can be a few dHash bits apart, and their results
+hold per-photo fields such as the pill count and expiry date.
+
+Near-duplicate lookups do not scan the whole cache: every hash is indexed
+by its eight 8-bit bands. Two hashes at most 7 bits apart agree on at least
+one whole band, so only the images sharing a band with the query need their
+distance computed. VISION_CACHE_MAX_DISTANCE is therefore capped at 7.
+
+Three stores are available (VISION_CACHE_BACKEND):
+
+- 'memory': in-process LRU cache with idle expiry (the default)
+- 'sqlite': SQLite file at VISION_CACHE_PATH, shared by worker processes
+            and kept across restarts
+- 'off':    no caching
+
+Bump a task's prompt version whenever its prompt or output format changes,
+so results produced by the old prompt are no longer served.
+"""
+
+import os
+import json
+import hashlib
+import time
+import logging
+import sqlite3
+import threading
+from io import BytesIO
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from ai.ttl_cache import TTLCache
+from ai.vision_images import VisionImage
+
+logger = logging.getLogger(__name__)
+
+VISION_CACHE_BACKEND = os.environ.get('VISION_CACHE_BACKEND', 'memory')
+VISION_CACHE_PATH = os.environ.get(
+    'VISION_CACHE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'vision_results.sqlite3'))
+VISION_CACHE_MAX_SIZE = int(os.environ.get('VISION_CACHE_MAX_SIZE', 1024))
+VISION_CACHE_TTL = float(os.environ.get('VISION_CACHE_TTL', 24 * 3600))  # seconds without access
+VISION_CACHE_MAX_DISTANCE = int(os.environ.get('VISION_CACHE_MAX_DISTANCE', 6))  # differing hash bits
+
+DHASH_SIZE = 8  # 8x8 gradient comparisons -> 64-bit hash
+HASH_BANDS = 8  # 8-bit bands indexed for near-duplicate lookups
+MAX_INDEXED_DISTANCE = HASH_BANDS - 1  # Largest distance the band index is guaranteed to find
+
+# Tasks whose results may be served for a visually similar photo; every other
+# task only reuses results for byte-identical images
+NEAR_DUPLICATE_TASKS = {'food'}
+
+
+def image_dhash(data: bytes) -> int:
+    """
+    64-bit difference hash of an image.
+
+    Each bit says whether a pixel of a 9x8 grayscale thumbnail is brighter than
+    its right neighbour, so the hash survives re-encoding, small shifts and
+    exposure changes.
+    """
+    with Image.open(BytesIO(data)) as image:
+        # Decode JPEGs at the smallest DCT scale; only a tiny thumbnail is needed
+        image.draft('L', (DHASH_SIZE * 4, DHASH_SIZE * 4))
+        thumbnail = image.convert('L').resize((DHASH_SIZE + 1, DHASH_SIZE), Image.Resampling.BOX)
+    pixels = np.asarray(thumbnail, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_content_hash(data: bytes) -> int:
+    """64-bit hash of the exact image bytes (the first 8 bytes of their SHA-256)."""
+    return int.from_bytes(hashlib.sha256(data).digest()[:8], 'big')
+
+
+def hamming_distance(hash_a: int, hash_b: int) -> int:
+    return (hash_a ^ hash_b).bit_count()
+
+
+def hash_bands(image_hash: int) -> list:
+    """Band keys of a 64-bit hash: (band index << 8) | band value, one per band."""
+    return [(band << 8) | ((image_hash >> (8 * band)) & 0xFF) for band in range(HASH_BANDS)]
+
+
+class MemoryResultStore:
+    """In-process result store: LRU with idle expiry and a band index for near-duplicate lookups."""
+
+    name = 'memory'
+
+    def __init__(self, max_size: int = VISION_CACHE_MAX_SIZE, ttl: float = VISION_CACHE_TTL):
+        # Reentrant: evictions call _unindex while put or get hold the lock
+        self._lock = threading.RLock()
+        self._entries = TTLCache(max_size=max_size, ttl=ttl, on_evict=self._unindex)  # (namespace, hash) -> JSON
+        self._bands = {}  # (namespace, band key) -> set of hashes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _unindex(self, key: Tuple[str, int], result: str):
+        namespace, image_hash = key
+        with self._lock:
+            for band in hash_bands(image_hash):
+                hashes = self._bands.get((namespace, band))
+                if hashes is not None:
+                    hashes.discard(image_hash)
+                    if not hashes:
+                        del self._bands[(namespace, band)]
+
+    def get(self, namespace: str, image_hash: int, max_distance: int) -> Optional[Tuple[int, str]]:
+        """
+        Find the cached result for the nearest image within max_distance (at most
+        MAX_INDEXED_DISTANCE) bits.
+
+        Returns:
+            Tuple of (distance, result JSON), or None
+        """
+        with self._lock:
+            result = self._entries.get((namespace, image_hash))
+            if result is not None:
+                return 0, result
+            if max_distance <= 0:
+                return None
+
+            candidates = set()
+            for band in hash_bands(image_hash):
+                candidates.update(self._bands.get((namespace, band), ()))
+            # Nearest first; an expired candidate is dropped from the index by get
+            for distance, candidate in sorted((hamming_distance(candidate, image_hash), candidate)
+                                              for candidate in candidates):
+                if distance > max_distance:
+                    break
+                result = self._entries.get((namespace, candidate))
+                if result is not None:
+                    return distance, result
+        return None
+
+    def put(self, namespace: str, image_hash: int, result: str):
+        with self._lock:
+            for band in hash_bands(image_hash):
+                self._bands.setdefault((namespace, band), set()).add(image_hash)
+            self._entries.put((namespace, image_hash), result)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bands.clear()
+
+
+def _to_signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _sqlite_hamming(a: int, b: int) -> int:
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
+
+
+# Band numbers as a one-column (column1) table, and a column's band key as in hash_bands
+_SQLITE_BANDS = 'VALUES ' + ', '.join(f'({band})' for band in range(HASH_BANDS))
+
+
+def _sqlite_band(column: str) -> str:
+    return f"((column1 << 8) | (({column} >> (8 * column1)) & 255))"
+
+
+class SQLiteResultStore:
+    """Result store in a SQLite file, shared across processes and restarts."""
+
+    name = 'sqlite'
+
+    def __init__(self, path: str = VISION_CACHE_PATH, max_size: int = VISION_CACHE_MAX_SIZE,
+                 ttl: float = VISION_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5.0)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.create_function('hamming', 2, _sqlite_hamming, deterministic=True)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS vision_results (
+                namespace TEXT NOT NULL,
+                image_hash INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, image_hash)
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS vision_results_accessed ON vision_results (accessed_at)')
+        # Band index for near-duplicate lookups, kept in step with vision_results by triggers
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS vision_result_bands (
+                namespace TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                image_hash INTEGER NOT NULL,
+                PRIMARY KEY (namespace, band, image_hash)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS vision_results_index AFTER INSERT ON vision_results BEGIN
+                INSERT OR IGNORE INTO vision_result_bands
+                SELECT new.namespace, {_sqlite_band('new.image_hash')}, new.image_hash FROM ({_SQLITE_BANDS});
+            END
+        """)
+        self._conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS vision_results_unindex AFTER DELETE ON vision_results BEGIN
+                DELETE FROM vision_result_bands WHERE namespace = old.namespace AND image_hash = old.image_hash
+                    AND band IN (SELECT {_sqlite_band('old.image_hash')} FROM ({_SQLITE_BANDS}));
+            END
+        """)
+        # Index rows written before the band index existed
+        self._conn.execute(
+            f"INSERT OR IGNORE INTO vision_result_bands SELECT namespace, {_sqlite_band('image_hash')}, image_hash "
+            f"FROM vision_results, ({_SQLITE_BANDS})")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM vision_results').fetchone()[0]
+
+    def get(self, namespace: str, image_hash: int, max_distance: int) -> Optional[Tuple[int, str]]:
+        signed_hash = _to_signed(image_hash)
+        now = time.time()
+        with self._lock:
+            if max_distance <= 0:
+                row = self._conn.execute(
+                    'SELECT image_hash, result, 0 FROM vision_results '
+                    'WHERE namespace = ? AND image_hash = ? AND accessed_at >= ?',
+                    (namespace, signed_hash, now - self.ttl)
+                ).fetchone()
+            else:
+                # Only images sharing a band with this one can be within max_distance
+                bands = hash_bands(image_hash)
+                row = self._conn.execute(
+                    'SELECT image_hash, result, hamming(image_hash, ?) AS distance FROM vision_results '
+                    'WHERE namespace = ? AND image_hash IN (SELECT image_hash FROM vision_result_bands '
+                    f"WHERE namespace = ? AND band IN ({', '.join('?' * len(bands))})) "
+                    'AND accessed_at >= ? AND distance <= ? ORDER BY distance LIMIT 1',
+                    (signed_hash, namespace, namespace, *bands, now - self.ttl, max_distance)
+                ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE vision_results SET accessed_at = ? WHERE namespace = ? AND image_hash = ?',
+                               (now, namespace, row[0]))
+        return row[2], row[1]
+
+    def put(self, namespace: str, image_hash: int, result: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO vision_results VALUES (?, ?, ?, ?)',
+                               (namespace, _to_signed(image_hash), result, now))
+            self._conn.execute('DELETE FROM vision_results WHERE accessed_at < ?', (now - self.ttl,))
+            # Trim the least recently used entries beyond max_size
+            self._conn.execute(
+                'DELETE FROM vision_results WHERE rowid IN (SELECT rowid FROM vision_results '
+                'ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)', (self.max_size,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM vision_results')
+
+
+class CacheKey(NamedTuple):
+    namespace: str     # "<task>:v<prompt version>"
+    image_hash: int    # dHash for near-duplicate tasks, content hash otherwise
+    max_distance: int  # Largest hash distance accepted as the same image (0: exact)
+
+
+class VisionResultCache:
+    """Exact or near-duplicate image lookup of vision results, with hit/miss counters."""
+
+    def __init__(self, store=None, max_distance: int = VISION_CACHE_MAX_DISTANCE):
+        """
+        Initialize the cache.
+
+        Args:
+            store: MemoryResultStore or SQLiteResultStore (None disables caching)
+            max_distance: Largest hash distance (in bits) treated as the same image
+                          for NEAR_DUPLICATE_TASKS, at most MAX_INDEXED_DISTANCE
+        """
+        if max_distance > MAX_INDEXED_DISTANCE:
+            logger.warning(f"Vision cache max distance {max_distance} exceeds what the band index finds; "
+                           f"using {MAX_INDEXED_DISTANCE}")
+            max_distance = MAX_INDEXED_DISTANCE
+        self.store = store
+        self.max_distance = max_distance
+        self._lock = threading.Lock()
+        self._counts = {'hits': 0, 'near_hits': 0, 'misses': 0}
+
+    def key(self, task: str, prompt_version: int, image: VisionImage) -> Optional[CacheKey]:
+        """Cache key for an image, or None if caching is off or the image cannot be hashed."""
+        if self.store is None:
+            return None
+        try:
+            if task in NEAR_DUPLICATE_TASKS:
+                return CacheKey(f"{task}:v{prompt_version}", image_dhash(image.data), self.max_distance)
+            return CacheKey(f"{task}:v{prompt_version}", image_content_hash(image.data), 0)
+        except Exception as e:
+            logger.error(f"Error hashing {task} image: {str(e)}")
+            return None
+
+    def get(self, key: Optional[CacheKey]) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the cached result for this image (or a near-duplicate, if allowed)."""
+        if key is None:
+            return None
+        try:
+            found = self.store.get(key.namespace, key.image_hash, key.max_distance)
+        except Exception as e:
+            logger.error(f"Error reading vision result cache: {str(e)}")
+            found = None
+
+        with self._lock:
+            if found is None:
+                self._counts['misses'] += 1
+            elif found[0] == 0:
+                self._counts['hits'] += 1
+            else:
+                self._counts['near_hits'] += 1
+        if found is None:
+            return None
+        logger.info(f"Vision result cache hit for {key.namespace} (distance {found[0]})")
+        return json.loads(found[1])
+
+    def put(self, key: Optional[CacheKey], result: Dict[str, Any]):
+        if key is None:
+            return
+        try:
+            self.store.put(key.namespace, key.image_hash, json.dumps(result))
+        except Exception as e:
+            logger.error(f"Error writing vision result cache: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = sum(counts.values())
+        return {
+            'backend': self.store.name if self.store is not None else None,
+            'entries': len(self.store) if self.store is not None else 0,
+            'max_distance': self.max_distance,
+            **counts,
+            'hit_rate': (counts['hits'] + counts['near_hits']) / lookups if lookups else 0.0
+        }
+
+
+def create_result_store(backend: str = VISION_CACHE_BACKEND):
+    """Create the result store named by VISION_CACHE_BACKEND ('memory', 'sqlite' or 'off')."""
+    if backend == 'memory':
+        return MemoryResultStore()
+    if backend == 'sqlite':
+        try:
+            return SQLiteResultStore()
+        except sqlite3.Error as e:
+            logger.error(f"Cannot open vision result cache at {VISION_CACHE_PATH}: {str(e)}; using memory")
+            return MemoryResultStore()
+    if backend != 'off':
+        logger.warning(f"Unknown vision cache backend: {backend}; caching disabled")
+    return None
+
+
+vision_result_cache = VisionResultCache(create_result_store())
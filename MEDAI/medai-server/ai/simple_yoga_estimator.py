@@ -7,12 +7,12 @@ import time
 import json
 from typing import Dict, List, Any
 import requests
-from PIL import Image
-from io import BytesIO
 
 # Import MediaPipe
 import mediapipe as mp
 
+from ai.preprocessing import decode_image, MEDIAPIPE_MAX_EDGE
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -42,14 +42,8 @@ class SimpleYogaPoseEstimator:
     def preprocess_image(self, image_data: bytes) -> np.ndarray:
         """Preprocess the input image."""
         try:
-            # Convert to PIL Image
-            image = Image.open(BytesIO(image_data))
-            
-            # Convert to RGB format
-            image = image.convert('RGB')
-            
-            # Convert to numpy array
-            image_np = np.array(image)
+            # Decode at reduced scale; MediaPipe downsamples internally anyway
+            image_np = decode_image(image_data, max_edge=MEDIAPIPE_MAX_EDGE)
             
             return image_np
         
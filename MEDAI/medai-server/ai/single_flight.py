@@ -0,0 +1,263 @@
+"""
+single_flight.py - Coalescing of identical concurrent calls
+
+When several callers ask for the same thing at the same time, only the first
+one (the leader) does the work; the others wait for it and receive the same
+result or exception. Nothing is cached: once the call finishes, the next
+caller starts a new one.
+
+StreamBroadcast does the same for iterators: one producer consumes the
+upstream stream and every subscriber receives all of its items, including
+the ones produced before it joined.
+
+AsyncSingleFlight and AsyncStreamBroadcast are the asyncio counterparts, for
+coroutines and async iterators running on one event loop.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import (Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable,
+                    Iterator, List, Optional)
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._counts = {'leaders': 0, 'coalesced': 0}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Call fn, or wait for the identical call already in flight.
+
+        Args:
+            key: Identifies identical calls
+            fn: The call to make
+
+        Returns:
+            fn's result (shared by all callers of the same flight)
+
+        Raises:
+            Whatever fn raised, in every caller of the flight
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counts['leaders'] += 1
+            else:
+                self._counts['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'in_flight': len(self._calls), **self._counts}
+
+
+class StreamBroadcast:
+    """Fans the items of one upstream iterator out to any number of subscribers."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._items: List[Any] = []
+        self._finished = False
+        self._closed = False  # No new subscribers: finished, or stopping for lack of readers
+        self._error: Optional[BaseException] = None
+        self.subscribers = 0
+
+    def run(self, upstream: Iterable[Any]):
+        """Consume the upstream iterator; stops early once every subscriber has left."""
+        error = None
+        try:
+            for item in upstream:
+                with self._cond:
+                    if self.subscribers == 0:
+                        self._closed = True
+                        break
+                    self._items.append(item)
+                    self._cond.notify_all()
+        except BaseException as e:
+            error = e
+        finally:
+            close = getattr(upstream, 'close', None)
+            if close is not None:
+                close()
+            with self._cond:
+                self._error = error
+                self._finished = self._closed = True
+                self._cond.notify_all()
+
+    def subscribe(self) -> Optional[Iterator[Any]]:
+        """
+        Register a subscriber and return its iterator, or None if the broadcast
+        no longer accepts subscribers.
+
+        The subscriber is counted as soon as this returns, so the producer does
+        not stop before the first item is read.
+        """
+        with self._cond:
+            if self._closed:
+                return None
+            self.subscribers += 1
+        return self._iterate()
+
+    def _iterate(self) -> Iterator[Any]:
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._items) and not self._finished:
+                        self._cond.wait()
+                    if index < len(self._items):
+                        item = self._items[index]
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                index += 1
+                yield item
+        finally:
+            with self._cond:
+                self.subscribers -= 1
+
+
+class AsyncSingleFlight:
+    """Runs at most one coroutine per key at a time; concurrent callers share its outcome."""
+
+    def __init__(self):
+        # Only used from the event loop thread, so no lock
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._counts = {'leaders': 0, 'coalesced': 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn(), or the identical call already in flight.
+
+        The call runs as its own task, so a caller that is cancelled (e.g. its
+        client disconnected) does not cancel it for the others.
+
+        Args:
+            key: Identifies identical calls
+            fn: Returns the awaitable to run
+
+        Returns:
+            fn's result (shared by all callers of the same flight)
+
+        Raises:
+            Whatever fn raised, in every caller of the flight
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(fn())
+            self._counts['leaders'] += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self._counts['coalesced'] += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved even if every caller was cancelled
+
+    def stats(self) -> Dict[str, int]:
+        return {'in_flight': len(self._calls), **self._counts}
+
+
+class AsyncStreamBroadcast:
+    """Fans the items of one upstream async iterator out to any number of subscribers."""
+
+    def __init__(self):
+        self._cond = asyncio.Condition()
+        self._items: List[Any] = []
+        self._finished = False
+        self._closed = False  # No new subscribers: finished, or stopping for lack of readers
+        self._error: Optional[BaseException] = None
+        self.subscribers = 0
+
+    async def run(self, upstream: AsyncIterable[Any]):
+        """Consume the upstream iterator; stops early once every subscriber has left."""
+        error = None
+        try:
+            async for item in upstream:
+                if self.subscribers == 0:
+                    self._closed = True
+                    break
+                self._items.append(item)
+                async with self._cond:
+                    self._cond.notify_all()
+        except BaseException as e:
+            error = e
+        finally:
+            aclose = getattr(upstream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+            self._error = error
+            self._finished = self._closed = True
+            async with self._cond:
+                self._cond.notify_all()
+        if isinstance(error, asyncio.CancelledError):
+            raise error
+
+    def subscribe(self) -> Optional[AsyncIterator[Any]]:
+        """
+        Register a subscriber and return its iterator, or None if the broadcast
+        no longer accepts subscribers.
+
+        The subscriber is counted as soon as this returns, so the producer does
+        not stop before the first item is read. Close the iterator (aclose)
+        when abandoning it early.
+        """
+        if self._closed:
+            return None
+        self.subscribers += 1
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[Any]:
+        index = 0
+        try:
+            while True:
+                if index >= len(self._items) and not self._finished:
+                    async with self._cond:
+                        await self._cond.wait_for(lambda: index < len(self._items) or self._finished)
+                if index < len(self._items):
+                    item = self._items[index]
+                elif self._error is not None:
+                    raise self._error
+                else:
+                    return
+                index += 1
+                yield item
+        finally:
+            self.subscribers -= 1
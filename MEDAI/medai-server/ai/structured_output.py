@@ -0,0 +1,450 @@
+"""
+structured_output.py - JSON output from the LLM, validated while it streams
+
+Endpoints that expect JSON from the LLM declare a schema (a small subset of
+JSON Schema: type, properties, required, additionalProperties, items and
+minItems) and call structured_completion() instead of parsing free text.
+
+By default the completion is streamed (STRUCTURED_OUTPUT_STREAM=1) and fed to
+IncrementalJSONParser chunk by chunk. Prose instead of JSON, a syntax error,
+a value of the wrong type or a missing required key is detected as soon as
+the offending character arrives; the stream is then closed, so the rest of
+the generation is not paid for, and the call is retried up to
+STRUCTURED_OUTPUT_RETRIES times. The stream is also closed as soon as the
+JSON value is complete, which drops any trailing explanation.
+
+stream_structured_items() goes one step further for endpoints that stream
+results to the client: each element of an array in the root object (a meal,
+a recipe) is yielded as soon as its closing bracket arrives.
+
+With STRUCTURED_OUTPUT_STREAM=0 the completion is requested in one piece,
+using the provider's JSON mode (response_format json_object) for schemas
+whose root is an object (LLM_JSON_MODE=0 turns that off), and then
+validated with the same parser.
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import groq
+
+from ai.llm_gateway import llm_gateway
+
+logger = logging.getLogger(__name__)
+
+STRUCTURED_OUTPUT_STREAM = os.environ.get('STRUCTURED_OUTPUT_STREAM', '1') != '0'
+STRUCTURED_OUTPUT_RETRIES = int(os.environ.get('STRUCTURED_OUTPUT_RETRIES', 1))
+STRUCTURED_OUTPUT_MAX_PREAMBLE = int(os.environ.get('STRUCTURED_OUTPUT_MAX_PREAMBLE', 200))  # chars before the JSON
+LLM_JSON_MODE_ENABLED = os.environ.get('LLM_JSON_MODE', '1') != '0'
+
+NUMBER_PATTERN = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+LITERALS = {'true', 'false', 'null'}
+WHITESPACE = ' \t\n\r'
+
+
+class StructuredOutputError(ValueError):
+    """Raised when LLM output is not valid JSON matching the expected schema."""
+
+
+class _Container:
+    """An object or array being parsed."""
+    __slots__ = ('kind', 'schema', 'expect', 'key', 'keys', 'count', 'start')
+
+    def __init__(self, kind: str, schema: Dict[str, Any], start: int):
+        self.kind = kind
+        self.schema = schema
+        self.start = start  # Index of the opening bracket in the parsed text
+        # object: 'key_or_end', 'key', 'colon', 'value', 'comma_or_end'
+        # array:  'value_or_end', 'value', 'comma_or_end'
+        self.expect = 'key_or_end' if kind == 'object' else 'value_or_end'
+        self.key = None
+        self.keys = set()
+        self.count = 0
+
+
+class IncrementalJSONParser:
+    """Checks LLM output against a schema character by character as it arrives."""
+
+    def __init__(self, schema: Optional[Dict[str, Any]] = None,
+                 max_preamble: int = STRUCTURED_OUTPUT_MAX_PREAMBLE, emit_items: bool = False):
+        """
+        Initialize the parser.
+
+        Args:
+            schema: Expected structure (JSON Schema subset; None accepts any JSON)
+            max_preamble: Characters allowed before the JSON starts (e.g. a ```json fence)
+            emit_items: Collect each object or array inside an array of the root
+                        object as soon as it closes (see take_items)
+        """
+        self.schema = schema or {}
+        self.max_preamble = max_preamble
+        self.emit_items = emit_items
+        self.complete = False
+        self._items: List[Tuple[str, Any]] = []
+        self._text: List[str] = []   # Characters of the JSON value
+        self._stack: List[_Container] = []
+        self._preamble = 0
+        self._started = False
+        self._string = None          # None, 'key' or 'value' while inside a string
+        self._escape = False
+        self._key_chars: List[str] = []
+        self._token: List[str] = []  # Number or literal being read
+        self._position = 0
+
+    def feed(self, text: str) -> bool:
+        """
+        Parse the next piece of output.
+
+        Returns:
+            True once the JSON value is complete (later text is ignored)
+
+        Raises:
+            StructuredOutputError: As soon as the output cannot match the schema
+        """
+        for char in text:
+            if self.complete:
+                break
+            self._position += 1
+            if not self._started:
+                self._read_preamble(char)
+            elif self._string is not None:
+                self._text.append(char)
+                self._read_string(char)
+            else:
+                if self._token:
+                    if char.isalnum() or char in '+-.':
+                        self._token.append(char)
+                        self._text.append(char)
+                        continue
+                    self._end_token()
+                self._text.append(char)
+                self._read_structure(char)
+        return self.complete
+
+    def take_items(self) -> List[Tuple[str, Any]]:
+        """
+        Return the items completed since the last call.
+
+        Returns:
+            List of (root object key, parsed item), in the order they closed
+        """
+        items, self._items = self._items, []
+        return items
+
+    def result(self) -> Any:
+        """
+        Return the parsed value.
+
+        Raises:
+            StructuredOutputError: If the output ended before the JSON was complete
+        """
+        if not self.complete:
+            self._fail('output ended before the JSON was complete')
+        try:
+            return json.loads(''.join(self._text))
+        except ValueError as e:
+            self._fail(str(e))
+
+    def _fail(self, message: str):
+        raise StructuredOutputError(f"{message} (at character {self._position})")
+
+    def _read_preamble(self, char: str):
+        if char in '{[':
+            self._started = True
+            self._text.append(char)
+            self._start_value(char, self.schema)
+            return
+        self._preamble += 1
+        if self._preamble > self.max_preamble:
+            self._fail(f"no JSON {self._root_type()} in the first {self.max_preamble} characters")
+
+    def _root_type(self) -> str:
+        types = self.schema.get('type', 'value')
+        return types if isinstance(types, str) else '/'.join(types)
+
+    def _read_string(self, char: str):
+        if self._escape:
+            self._escape = False
+        elif char == '\\':
+            self._escape = True
+        elif char == '"':
+            kind, self._string = self._string, None
+            if kind == 'key':
+                self._end_key()
+            else:
+                self._end_value()
+            return
+        elif char < ' ':
+            self._fail('unescaped control character in string')
+        if self._string == 'key':
+            self._key_chars.append(char)
+
+    def _read_structure(self, char: str):
+        if char in WHITESPACE:
+            return
+        container = self._stack[-1]
+        expect = container.expect
+
+        if expect in ('key_or_end', 'key'):
+            if char == '"':
+                self._string = 'key'
+                self._key_chars = []
+            elif char == '}' and expect == 'key_or_end':
+                self._close(container)
+            else:
+                self._fail(f"expected an object key, got {char!r}")
+        elif expect == 'colon':
+            if char != ':':
+                self._fail(f"expected ':', got {char!r}")
+            container.expect = 'value'
+        elif expect in ('value', 'value_or_end'):
+            if char == ']' and expect == 'value_or_end':
+                self._close(container)
+            else:
+                self._start_value(char, self._child_schema(container))
+        elif expect == 'comma_or_end':
+            if char == ',':
+                container.expect = 'key' if container.kind == 'object' else 'value'
+            elif char == ('}' if container.kind == 'object' else ']'):
+                self._close(container)
+            else:
+                self._fail(f"expected ',' or end of {container.kind}, got {char!r}")
+
+    def _child_schema(self, container: _Container) -> Dict[str, Any]:
+        if container.kind == 'array':
+            return container.schema.get('items', {})
+        return container.schema.get('properties', {}).get(container.key, {})
+
+    def _start_value(self, char: str, schema: Dict[str, Any]):
+        if char == '{':
+            self._check_type('object', schema)
+            self._stack.append(_Container('object', schema, len(self._text) - 1))
+        elif char == '[':
+            self._check_type('array', schema)
+            self._stack.append(_Container('array', schema, len(self._text) - 1))
+        elif char == '"':
+            self._check_type('string', schema)
+            self._string = 'value'
+        elif char == '-' or char.isdigit():
+            self._check_type('number', schema)
+            self._token = [char]
+        elif char in 'tfn':
+            self._check_type('null' if char == 'n' else 'boolean', schema)
+            self._token = [char]
+        else:
+            self._fail(f"unexpected character {char!r}")
+
+    def _check_type(self, json_type: str, schema: Dict[str, Any]):
+        allowed = schema.get('type')
+        if allowed is None:
+            return
+        allowed = [allowed] if isinstance(allowed, str) else allowed
+        if json_type in allowed or (json_type == 'number' and 'integer' in allowed):
+            return
+        where = f" for '{self._stack[-1].key}'" if self._stack and self._stack[-1].kind == 'object' else ''
+        self._fail(f"expected {' or '.join(allowed)}{where}, got {json_type}")
+
+    def _end_token(self):
+        token = ''.join(self._token)
+        self._token = []
+        if token not in LITERALS and not NUMBER_PATTERN.fullmatch(token):
+            self._fail(f"invalid literal {token!r}")
+        self._end_value()
+
+    def _end_key(self):
+        container = self._stack[-1]
+        try:
+            key = json.loads('"' + ''.join(self._key_chars) + '"')
+        except ValueError:
+            self._fail('invalid object key')
+        schema = container.schema
+        if schema.get('additionalProperties') is False and key not in schema.get('properties', {}):
+            self._fail(f"unexpected key '{key}'")
+        container.key = key
+        container.keys.add(key)
+        container.expect = 'colon'
+
+    def _end_value(self):
+        if not self._stack:
+            self.complete = True
+            return
+        container = self._stack[-1]
+        container.count += 1
+        container.expect = 'comma_or_end'
+
+    def _close(self, container: _Container):
+        if container.kind == 'object':
+            missing = [key for key in container.schema.get('required', []) if key not in container.keys]
+            if missing:
+                self._fail(f"missing required key(s) {', '.join(missing)}")
+        elif container.count < container.schema.get('minItems', 0):
+            self._fail(f"expected at least {container.schema['minItems']} items, got {container.count}")
+        self._stack.pop()
+        if (self.emit_items and len(self._stack) == 2 and
+                self._stack[0].kind == 'object' and self._stack[1].kind == 'array'):
+            self._emit(self._stack[0].key, container)
+        self._end_value()
+
+    def _emit(self, key: str, container: _Container):
+        try:
+            self._items.append((key, json.loads(''.join(self._text[container.start:]))))
+        except ValueError as e:
+            self._fail(str(e))
+
+
+def parse_structured(text: str, schema: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Parse complete LLM output as JSON matching a schema.
+
+    Raises:
+        StructuredOutputError: If the output is not valid JSON matching the schema
+    """
+    parser = IncrementalJSONParser(schema)
+    parser.feed(text)
+    return parser.result()
+
+
+class StructuredOutputStats:
+    """Counters of structured LLM completions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {'completions': 0, 'malformed': 0, 'aborted_early': 0, 'failed': 0}
+
+    def count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'stream': STRUCTURED_OUTPUT_STREAM, 'json_mode': LLM_JSON_MODE_ENABLED, **self._counts}
+
+
+structured_output_stats = StructuredOutputStats()
+
+
+def _streamed(schema: Dict[str, Any], kwargs: Dict[str, Any], coalesce: Optional[bool] = None) -> Any:
+    parser = IncrementalJSONParser(schema)
+    chunks = llm_gateway.stream_chat_completion(coalesce=coalesce, **kwargs)
+    try:
+        for chunk in chunks:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text and parser.feed(text):
+                break  # Ignore anything the model adds after the JSON
+    except StructuredOutputError:
+        structured_output_stats.count('aborted_early')
+        raise
+    finally:
+        chunks.close()
+    return parser.result()
+
+
+def _complete(schema: Dict[str, Any], kwargs: Dict[str, Any], coalesce: Optional[bool] = None) -> Any:
+    if LLM_JSON_MODE_ENABLED and schema.get('type') == 'object':
+        # JSON mode only guarantees a top-level object
+        kwargs = dict(kwargs, response_format={'type': 'json_object'})
+    try:
+        text = llm_gateway.chat_text(coalesce=coalesce, **kwargs)
+    except groq.BadRequestError as e:
+        # JSON mode rejects generations that are not valid JSON
+        if 'json_validate_failed' in str(e):
+            raise StructuredOutputError(f"model output failed JSON validation: {str(e)}")
+        raise
+    return parse_structured(text, schema)
+
+
+def structured_completion(schema: Dict[str, Any], label: str = 'LLM',
+                          retries: int = STRUCTURED_OUTPUT_RETRIES,
+                          stream: bool = STRUCTURED_OUTPUT_STREAM, **kwargs) -> Any:
+    """
+    Create a chat completion whose output must be JSON matching a schema.
+
+    Args:
+        schema: Expected structure (JSON Schema subset)
+        label: Name of the output, for logs
+        retries: Extra attempts after malformed output
+        stream: Validate while streaming (abort early) instead of after the full completion
+        **kwargs: Arguments for the chat completion (model, messages, ...)
+
+    Returns:
+        The parsed JSON value
+
+    Raises:
+        StructuredOutputError: If every attempt produced malformed output
+        LLMUnavailableError, groq.APIError: If the LLM call itself fails
+    """
+    for attempt in range(retries + 1):
+        # A retry must not join a concurrent identical call: it would get the
+        # same malformed output again
+        coalesce = False if attempt else None
+        try:
+            result = _streamed(schema, kwargs, coalesce) if stream else _complete(schema, kwargs, coalesce)
+            structured_output_stats.count('completions')
+            return result
+        except StructuredOutputError as e:
+            structured_output_stats.count('malformed')
+            logger.warning(f"Malformed {label} output (attempt {attempt + 1} of {retries + 1}): {str(e)}")
+            if attempt == retries:
+                structured_output_stats.count('failed')
+                raise
+
+
+def stream_structured_items(schema: Dict[str, Any], label: str = 'LLM',
+                            retries: int = STRUCTURED_OUTPUT_RETRIES, **kwargs) -> Iterator[Tuple[str, Any]]:
+    """
+    Stream a chat completion and yield the items of its JSON output as they complete.
+
+    The output must be a JSON object matching the schema; every object or
+    array inside one of its arrays (e.g. each recipe of {"recipes": [...]})
+    is yielded as soon as its closing bracket arrives. Malformed output is
+    retried only while nothing has been yielded yet.
+
+    Args:
+        schema: Expected structure (JSON Schema subset, object root)
+        label: Name of the output, for logs
+        retries: Extra attempts after malformed output
+        **kwargs: Arguments for the chat completion (model, messages, ...)
+
+    Yields:
+        Tuples of (root object key, item)
+
+    Raises:
+        StructuredOutputError: If the output is malformed after items were
+            yielded, or on every attempt
+        LLMUnavailableError, groq.APIError: If the LLM call itself fails
+    """
+    for attempt in range(retries + 1):
+        parser = IncrementalJSONParser(schema, emit_items=True)
+        emitted = False
+        chunks = llm_gateway.stream_chat_completion(coalesce=False if attempt else None, **kwargs)
+        try:
+            for chunk in chunks:
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if not text:
+                    continue
+                try:
+                    complete = parser.feed(text)
+                except StructuredOutputError:
+                    structured_output_stats.count('aborted_early')
+                    raise
+                for item in parser.take_items():
+                    emitted = True
+                    yield item
+                if complete:
+                    break
+            parser.result()
+        except StructuredOutputError as e:
+            structured_output_stats.count('malformed')
+            logger.warning(f"Malformed {label} output (attempt {attempt + 1} of {retries + 1}): {str(e)}")
+            if emitted or attempt == retries:
+                structured_output_stats.count('failed')
+                raise
+            continue
+        finally:
+            chunks.close()
+        structured_output_stats.count('completions')
+        return
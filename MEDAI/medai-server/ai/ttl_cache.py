@@ -0,0 +1,137 @@
+"""
+ttl_cache.py - Thread-safe LRU cache with time-based expiry
+
+Used for per-session and per-device state that must stay bounded in memory
+when many clients are connected at once.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """LRU cache whose entries also expire after a period without access."""
+
+    def __init__(self, max_size: int = 1024, ttl: Optional[float] = 3600.0,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size: Maximum number of entries before the least recently used is evicted
+            ttl: Seconds an entry may stay idle before it expires (None disables expiry)
+            on_evict: Optional callback invoked with (key, value) for every evicted entry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._entries = OrderedDict()  # key -> (value, last_access)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return self.ttl is not None and now - last_access > self.ttl
+
+    def _purge_expired(self, now: float) -> list:
+        """Drop expired entries; the least recently used ones sit at the front."""
+        evicted = []
+        while self._entries:
+            key, (value, last_access) = next(iter(self._entries.items()))
+            if not self._is_expired(last_access, now):
+                break
+            self._entries.popitem(last=False)
+            evicted.append((key, value))
+        return evicted
+
+    def _notify(self, evicted: list):
+        if self._on_evict:
+            for key, value in evicted:
+                self._on_evict(key, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for key and mark it as recently used."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                result = default
+            elif self._is_expired(entry[1], now):
+                del self._entries[key]
+                evicted.append((key, entry[0]))
+                result = default
+            else:
+                self._entries[key] = (entry[0], now)
+                self._entries.move_to_end(key)
+                result = entry[0]
+        self._notify(evicted)
+        return result
+
+    def put(self, key: Hashable, value: Any):
+        """Insert or replace a value, evicting expired and excess entries."""
+        now = time.monotonic()
+        with self._lock:
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            evicted = self._purge_expired(now)
+            while len(self._entries) > self.max_size:
+                old_key, (old_value, _) = self._entries.popitem(last=False)
+                evicted.append((old_key, old_value))
+        self._notify(evicted)
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the value for key, creating it with factory() if absent."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_expired(entry[1], now):
+                self._entries[key] = (entry[0], now)
+                self._entries.move_to_end(key)
+                return entry[0]
+            if entry is not None:
+                evicted.append((key, entry[0]))
+            value = factory()
+            self._entries[key] = (value, now)
+            self._entries.move_to_end(key)
+            evicted.extend(self._purge_expired(now))
+            while len(self._entries) > self.max_size:
+                old_key, (old_value, _) = self._entries.popitem(last=False)
+                evicted.append((old_key, old_value))
+        self._notify(evicted)
+        return value
+
+    def keys(self) -> list:
+        """Snapshot of the keys of unexpired entries, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [key for key, (_, last_access) in self._entries.items()
+                    if not self._is_expired(last_access, now)]
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove key and return its value (without calling on_evict)."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def purge_expired(self) -> int:
+        """Evict all expired entries now. Returns the number evicted."""
+        with self._lock:
+            evicted = self._purge_expired(time.monotonic())
+        self._notify(evicted)
+        return len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_MISSING = object()
@@ -0,0 +1,240 @@
+"""
+vision_images.py - In-memory image handoff for the Groq vision endpoints
+
+Images arrive as base64 strings (optionally data URIs). They are decoded and
+validated in memory, so nothing is written to disk.
+
+Phone photos are far larger than the vision model needs, so each image is
+then normalized for its task: EXIF orientation is applied, the long edge is
+limited (text on prescriptions needs more pixels than a photo of food) and
+the result is re-encoded as JPEG. Images that are already small enough are
+forwarded unchanged. Limits per task can be tuned with VISION_<TASK>_MAX_EDGE
+and VISION_<TASK>_JPEG_QUALITY (e.g. VISION_FOOD_MAX_EDGE), or normalization
+turned off with VISION_NORMALIZE=0. Before/after sizes are logged and
+collected in vision_image_stats.
+
+For debugging, set VISION_DEBUG_CAPTURE_DIR to keep a copy of every image
+sent to the vision model in that directory.
+"""
+
+import os
+import time
+import base64
+import binascii
+import logging
+import threading
+import uuid
+from io import BytesIO
+from typing import Any, Dict, NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VISION_DEBUG_CAPTURE_DIR = os.environ.get('VISION_DEBUG_CAPTURE_DIR')
+VISION_NORMALIZE_ENABLED = os.environ.get('VISION_NORMALIZE', '1') != '0'
+EXIF_ORIENTATION_TAG = 0x0112
+
+# Image formats the vision model accepts, by PIL format name
+SUPPORTED_FORMATS = {
+    'JPEG': ('image/jpeg', 'jpg'),
+    'PNG': ('image/png', 'png'),
+    'WEBP': ('image/webp', 'webp')
+}
+
+
+class VisionProfile(NamedTuple):
+    """How images for one vision task are normalized."""
+    max_edge: int      # Longest side in pixels
+    jpeg_quality: int  # JPEG quality of re-encoded images
+
+
+def _profile(task: str, max_edge: int, jpeg_quality: int) -> VisionProfile:
+    prefix = f"VISION_{task.upper()}"
+    return VisionProfile(int(os.environ.get(f"{prefix}_MAX_EDGE", max_edge)),
+                         int(os.environ.get(f"{prefix}_JPEG_QUALITY", jpeg_quality)))
+
+
+VISION_PROFILES = {
+    'food': _profile('food', 768, 80),
+    'medicine': _profile('medicine', 1024, 85),
+    'prescription': _profile('prescription', 1600, 90)  # Small handwriting and print
+}
+
+
+class InvalidImageError(ValueError):
+    """Raised when an uploaded image cannot be decoded or is not a supported format."""
+
+
+class VisionImage(NamedTuple):
+    """A validated image ready to send to a vision model."""
+    base64: str     # Base64 payload, without a data URI prefix
+    data: bytes     # Decoded image bytes
+    format: str     # PIL format name (JPEG, PNG, WEBP)
+    width: int
+    height: int
+
+    @property
+    def mime_type(self) -> str:
+        return SUPPORTED_FORMATS[self.format][0]
+
+    @property
+    def data_uri(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+class VisionImageStats:
+    """Per-task counters of image sizes before and after normalization."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, float]] = {}
+
+    def record(self, task: str, bytes_in: int, bytes_out: int, seconds: float, normalized: bool):
+        with self._lock:
+            counts = self._tasks.setdefault(task, {
+                'images': 0, 'normalized': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0
+            })
+            counts['images'] += 1
+            counts['normalized'] += int(normalized)
+            counts['bytes_in'] += bytes_in
+            counts['bytes_out'] += bytes_out
+            counts['seconds'] += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = {task: dict(counts) for task, counts in self._tasks.items()}
+        return {
+            task: {
+                'images': counts['images'],
+                'normalized': counts['normalized'],
+                'bytes_in': counts['bytes_in'],
+                'bytes_out': counts['bytes_out'],
+                'size_ratio': counts['bytes_out'] / counts['bytes_in'] if counts['bytes_in'] else 1.0,
+                'mean_normalize_ms': counts['seconds'] / counts['images'] * 1000,
+                **({'max_edge': VISION_PROFILES[task].max_edge,
+                    'jpeg_quality': VISION_PROFILES[task].jpeg_quality} if task in VISION_PROFILES else {})
+            }
+            for task, counts in tasks.items()
+        }
+
+
+vision_image_stats = VisionImageStats()
+
+
+def load_vision_image(image_base64: str, label: str = 'image') -> VisionImage:
+    """
+    Decode, validate and normalize a base64 image upload in memory.
+
+    Args:
+        image_base64: Base64 image data, optionally as a data URI
+        label: Vision task ('food', 'medicine', 'prescription'); selects the
+               normalization profile and names logs and debug captures
+
+    Returns:
+        The image to send to the vision model
+
+    Raises:
+        InvalidImageError: If the data is not valid base64 or not a supported image
+    """
+    if not isinstance(image_base64, str) or not image_base64:
+        raise InvalidImageError('No image data provided')
+
+    # Remove the base64 prefix if present (e.g., "data:image/jpeg;base64,")
+    if 'base64,' in image_base64:
+        image_base64 = image_base64.split('base64,', 1)[1]
+
+    try:
+        data = base64.b64decode(image_base64)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidImageError(f"Invalid base64 image data: {str(e)}")
+
+    try:
+        # Only parses the header; the pixels are decoded upstream
+        with Image.open(BytesIO(data)) as image:
+            image_format, (width, height) = image.format, image.size
+    except Exception:
+        raise InvalidImageError('Uploaded data is not a readable image')
+
+    if image_format not in SUPPORTED_FORMATS:
+        raise InvalidImageError(f"Unsupported image format: {image_format}")
+
+    vision_image = normalize_vision_image(
+        VisionImage(image_base64, data, image_format, width, height), label)
+    if VISION_DEBUG_CAPTURE_DIR:
+        capture_debug_image(vision_image, label)
+    return vision_image
+
+
+def normalize_vision_image(image: VisionImage, task: str,
+                           profile: Optional[VisionProfile] = None) -> VisionImage:
+    """
+    Orient, downscale and re-encode an image for a vision task.
+
+    Args:
+        image: Validated image
+        task: Vision task name (for logs and stats)
+        profile: Limits to apply (defaults to the task's entry in VISION_PROFILES)
+
+    Returns:
+        The normalized image, or the original if it needs no changes
+    """
+    profile = profile or VISION_PROFILES.get(task)
+    if profile is None or not VISION_NORMALIZE_ENABLED:
+        return image
+
+    start_time = time.perf_counter()
+    with Image.open(BytesIO(image.data)) as source:
+        orientation = source.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if (image.format == 'JPEG' and orientation == 1 and
+                max(image.width, image.height) <= profile.max_edge):
+            # Already upright and small enough; forward the original payload
+            vision_image_stats.record(task, len(image.data), len(image.data),
+                                      time.perf_counter() - start_time, normalized=False)
+            return image
+
+        if source.format == 'JPEG':
+            # Decode at reduced DCT scale, as close to max_edge as possible; draft()
+            # keeps both sides >= the requested box, so keep the image's aspect ratio
+            ratio = min(1.0, profile.max_edge / max(image.width, image.height))
+            source.draft('RGB', (max(1, int(image.width * ratio)), max(1, int(image.height * ratio))))
+        normalized = ImageOps.exif_transpose(source)
+        if normalized.mode != 'RGB':
+            normalized = normalized.convert('RGB')
+        normalized.thumbnail((profile.max_edge, profile.max_edge), Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        normalized.save(buffer, 'JPEG', quality=profile.jpeg_quality)
+        data = buffer.getvalue()
+        width, height = normalized.size
+
+    elapsed = time.perf_counter() - start_time
+    if len(data) >= len(image.data) and orientation == 1 and max(image.width, image.height) <= profile.max_edge:
+        # Re-encoding a small PNG/WebP did not help
+        vision_image_stats.record(task, len(image.data), len(image.data), elapsed, normalized=False)
+        return image
+
+    logger.info(f"Normalized {task} image {image.width}x{image.height} ({len(image.data)} bytes) -> "
+                f"{width}x{height} ({len(data)} bytes) in {elapsed * 1000:.1f} ms")
+    vision_image_stats.record(task, len(image.data), len(data), elapsed, normalized=True)
+    return VisionImage(base64.b64encode(data).decode('ascii'), data, 'JPEG', width, height)
+
+
+def capture_debug_image(image: VisionImage, label: str = 'image') -> str:
+    """
+    Write an image to VISION_DEBUG_CAPTURE_DIR for later inspection.
+
+    Returns:
+        Path of the written file (empty if the capture failed)
+    """
+    try:
+        os.makedirs(VISION_DEBUG_CAPTURE_DIR, exist_ok=True)
+        filename = f"{label}_{uuid.uuid4().hex}.{SUPPORTED_FORMATS[image.format][1]}"
+        filepath = os.path.join(VISION_DEBUG_CAPTURE_DIR, filename)
+        with open(filepath, 'wb') as f:
+            f.write(image.data)
+        logger.info(f"Captured {label} image ({image.width}x{image.height}, {len(image.data)} bytes) to {filepath}")
+        return filepath
+    except Exception as e:
+        logger.error(f"Error capturing debug image: {str(e)}")
+        return ''
@@ -8,11 +8,10 @@ import json
 import logging
 import re
 from typing import Dict, List, Tuple, Any, Optional
-import requests
-from PIL import Image
-from io import BytesIO
 import tensorflow as tf
-import tensorflow_hub as hub
+from ai.llm_gateway import llm_gateway
+from ai.model_registry import load_movenet, mediapipe_pose_complexity
+from ai.preprocessing import decode_image, letterbox, MEDIAPIPE_MAX_EDGE
 
 # Keep MediaPipe as an optional fallback
 import mediapipe as mp
@@ -21,10 +20,6 @@ import mediapipe as mp
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "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")
-GROQ_API_ENDPOINT = "https://api.groq.com/openai/v1/chat/completions"
-
 class YogaPoseEstimator:
     """YogaPoseEstimator model for analyzing and providing feedback on yoga poses."""
     
@@ -37,18 +32,18 @@ class YogaPoseEstimator:
         self.mp_pose = mp.solutions.pose
         self.pose = self.mp_pose.Pose(
             static_image_mode=True,
-            model_complexity=2,  # Use the most accurate model
+            model_complexity=mediapipe_pose_complexity(2),  # Use the most accurate model available offline
             enable_segmentation=False,
             min_detection_confidence=0.5
         )
         
         # Load TensorFlow model
         try:
-            # MoveNet model from TensorFlow Hub
+            # MoveNet model from the local registry (downloaded only if allowed)
             model_name = "movenet_thunder"  # More accurate than lightning
-            self.pose_model = hub.load(f"https://tfhub.dev/google/movenet/singlepose/thunder/4")
+            self.pose_model = load_movenet('thunder')
             self.movenet = self.pose_model.signatures['serving_default']
-            logger.info("Loaded MoveNet Thunder model from TensorFlow Hub")
+            logger.info("Loaded MoveNet Thunder model")
             self.tf_model_loaded = True
         except Exception as e:
             logger.error(f"Failed to load TensorFlow model: {e}")
@@ -83,14 +78,8 @@ class YogaPoseEstimator:
             Preprocessed image as numpy array
         """
         try:
-            # Convert to PIL Image
-            image = Image.open(BytesIO(image_data))
-            
-            # Convert to RGB format (for consistency)
-            image = image.convert('RGB')
-            
-            # Convert to numpy array
-            image_np = np.array(image)
+            # Decode at reduced scale; MediaPipe downsamples internally anyway
+            image_np = decode_image(image_data, max_edge=MEDIAPIPE_MAX_EDGE)
             
             return image_np
         
@@ -110,30 +99,12 @@ class YogaPoseEstimator:
             List of keypoint dictionaries
         """
         try:
-            # Resize and pad the image to the model's expected input dimensions
+            # Letterbox the image to the model's expected input dimensions
             input_size = 256  # MoveNet input size
-            height, width, _ = image.shape
-            
-            # Calculate scale and padding
-            scale = min(input_size / height, input_size / width)
-            scaled_height = int(height * scale)
-            scaled_width = int(width * scale)
-            
-            # Resize image
-            resized_image = cv2.resize(image, (scaled_width, scaled_height))
-            
-            # Create empty image with desired dimensions
-            input_image = np.zeros((input_size, input_size, 3), dtype=np.uint8)
-            
-            # Place the resized image in the center
-            y_offset = (input_size - scaled_height) // 2
-            x_offset = (input_size - scaled_width) // 2
-            input_image[y_offset:y_offset+scaled_height, x_offset:x_offset+scaled_width, :] = resized_image
+            input_image, _ = letterbox(image, input_size)
             
             # Convert to tensor
-            input_tensor = tf.convert_to_tensor(input_image)
-            input_tensor = tf.expand_dims(input_tensor, axis=0)
-            input_tensor = tf.cast(input_tensor, dtype=tf.int32)
+            input_tensor = tf.constant(input_image[np.newaxis], dtype=tf.int32)
             
             # Run inference
             results = self.movenet(input_tensor)
@@ -818,15 +789,10 @@ class YogaPoseEstimator:
             """
             
             # Call Groq API
-            response = requests.post(
-                GROQ_API_ENDPOINT,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {GROQ_API_KEY}"
-                },
-                json={
-                    "model": "meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq model
-                    "messages": [
+            try:
+                return llm_gateway.chat_text(
+                    model="meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq model
+                    messages=[
                         {
                             "role": "user",
                             "content": [
@@ -835,19 +801,11 @@ class YogaPoseEstimator:
                             ]
                         }
                     ],
-                    "temperature": 0.2,
-                    "max_tokens": 1024
-                }
-            )
-            
-            # Parse the response
-            if response.status_code == 200:
-                result = response.json()
-                # Extract content from Groq's response structure
-                content = result['choices'][0]['message']['content']
-                return content
-            else:
-                logger.error(f"Groq API Error: {response.status_code} - {response.text}")
+                    temperature=0.2,
+                    max_tokens=1024
+                )
+            except Exception as e:
+                logger.error(f"Groq API Error: {str(e)}")
                 return self._generate_fallback_feedback(accuracy, detected_issues, pose_name, is_final)
                 
         except Exception as e:
@@ -7,16 +7,27 @@ import base64
 import logging
 import re  # Added for JSON extraction from LLM responses
 from werkzeug.utils import secure_filename
+import copy
 import json
 import time
 from dotenv import load_dotenv
-from groq import Groq
 
 # Import AI modules
 from ai.ocr import process_prescription_image, identify_medication
 from ai.chatbot import get_pregnancy_response
-from ai.fall_detection import analyze_accelerometer_data
+from ai.fall_detection import (DETECTION_RATE, FALL_BATCH_MAX_DEVICES, analyze_accelerometer_data, analyze_batch,
+                               normalize_sample_rate, resample, sample_timestamps, to_sample_array)
+from ai.fall_monitor import fall_detectors
+from ai.accelerometer_packets import (BATCH_MIMETYPE, InvalidPacketError, PACKET_MIMETYPE, decode_packet,
+                                      decode_packets)
 from ai.grok_vision import GroqVision
+from ai.vision_images import InvalidImageError, VisionImage, load_vision_image, vision_image_stats
+from ai.result_cache import vision_result_cache
+from ai.llm_gateway import llm_gateway
+from ai.structured_output import (StructuredOutputError, stream_structured_items, structured_completion,
+                                  structured_output_stats)
+from ai.nutrition_tips import nutrition_tips_cache, NUTRITION_TIPS_WARM_ON_START
+from ai.meal_plans import meal_plan_cache
 import requests
 # from ai.yoga_pose_estimation import yoga_pose_estimator
 import base64
@@ -27,8 +38,19 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable Cross-Origin Resource Sharing
 
-# Initialize Groq client
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY", "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"))
+# WebSocket support is optional (flask-sock); streaming routes are skipped without it
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+    sock = Sock(app)
+except ImportError:
+    sock = None
+
+# All Groq calls go through the shared, pooled gateway (ai/llm_gateway.py)
+
+# Pre-generate nutrition tips for every pregnancy week (opt-in, NUTRITION_TIPS_WARM=1)
+if NUTRITION_TIPS_WARM_ON_START:
+    nutrition_tips_cache.warm_in_background()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -72,24 +94,14 @@ medications_data = {
     }
 }
 
-# Helper function to save uploaded images
-def save_base64_image(base64_string, filename_prefix="image"):
+# Helper function to decode and validate uploaded images in memory
+def get_vision_image(label):
+    """Load the request's base64 'image' for a vision call, or return a 400 error response."""
     try:
-        # Remove the base64 prefix if present (e.g., "data:image/jpeg;base64,")
-        if "base64," in base64_string:
-            base64_string = base64_string.split("base64,")[1]
-            
-        image_data = base64.b64decode(base64_string)
-        filename = f"{filename_prefix}_{uuid.uuid4().hex}.jpg"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        
-        with open(filepath, "wb") as f:
-            f.write(image_data)
-            
-        return filepath
-    except Exception as e:
-        logger.error(f"Error saving base64 image: {str(e)}")
-        return None
+        return load_vision_image(request.json['image'], label), None
+    except InvalidImageError as e:
+        logger.error(f"Invalid {label} image: {str(e)}")
+        return None, (jsonify({'error': str(e)}), 400)
 
 # API Endpoints
 
@@ -108,20 +120,12 @@ def ocr_prescription():
         if 'image' not in request.json:
             return jsonify({'error': 'No image provided'}), 400
             
-        image_base64 = request.json['image']
-        image_path = save_base64_image(image_base64, "prescription")
-        
-        if not image_path:
-            return jsonify({'error': 'Failed to save image'}), 500
+        image, error_response = get_vision_image("prescription")
+        if error_response:
+            return error_response
             
         # Process prescription with Grok Vision
-        prescription_data = GroqVision.analyze_prescription(image_path)
-        
-        # Clean up the image file
-        try:
-            os.remove(image_path)
-        except:
-            pass
+        prescription_data = GroqVision.analyze_prescription(image)
         
         # Generate a unique ID for the prescription
         prescription_id = str(uuid.uuid4())[:8]
@@ -147,14 +151,12 @@ def scan_medicine():
         if 'image' not in request.json:
             return jsonify({'error': 'No image provided'}), 400
             
-        image_base64 = request.json['image']
-        image_path = save_base64_image(image_base64, "medicine")
-        
-        if not image_path:
-            return jsonify({'error': 'Failed to save image'}), 500
+        image, error_response = get_vision_image("medicine")
+        if error_response:
+            return error_response
             
         # Identify the medication in the image using Grok Vision
-        medication_info = GroqVision.identify_medication(image_path)
+        medication_info = GroqVision.identify_medication(image)
         
         # Check for prescription match if prescriptionId is provided
         if 'prescriptionData' in request.json:
@@ -171,12 +173,6 @@ def scan_medicine():
         else:
             medication_info['matchesPrescription'] = True  # Default if no prescription provided
         
-        # Clean up the image file
-        try:
-            os.remove(image_path)
-        except:
-            pass
-        
         return jsonify({
             'success': True,
             'data': medication_info
@@ -212,51 +208,56 @@ def pregnancy_chatbot():
         logger.exception("Error getting chatbot response")
         return jsonify({'error': str(e)}), 500
 
+def build_pregnancy_messages(user_message, pregnancy_week=None, chat_history=None):
+    """Format the pregnancy assistant prompt and recent chat history for the Groq API."""
+    # Format history for Groq API
+    formatted_history = []
+    
+    # Add system message
+    formatted_history.append({
+        "role": "system",
+        "content": "You are a helpful pregnancy assistant providing accurate medical information to expectant mothers. "
+                  "Always advise users to consult healthcare providers for personalized medical advice. "
+                  "Be empathetic, clear, and concise."
+    })
+    
+    # Add chat history if available
+    if chat_history and isinstance(chat_history, list):
+        for msg in chat_history[-10:]:  # Use last 10 messages for context
+            role = "user" if msg.get('sender') == 'user' else "assistant"
+            formatted_history.append({
+                "role": role,
+                "content": msg.get('text', '')
+            })
+    
+    # Add pregnancy week context if available
+    context = ""
+    if pregnancy_week:
+        context = f"The user is currently in week {pregnancy_week} of pregnancy. "
+    
+    # Add the current user message
+    formatted_history.append({
+        "role": "user",
+        "content": f"{context}{user_message}"
+    })
+    
+    return formatted_history
+
 def stream_pregnancy_response(user_message, pregnancy_week=None, chat_history=None):
     """Stream responses from the pregnancy assistant using Groq's Llama model."""
     try:
-        # Format history for Groq API
-        formatted_history = []
-        
-        # Add system message
-        formatted_history.append({
-            "role": "system",
-            "content": "You are a helpful pregnancy assistant providing accurate medical information to expectant mothers. "
-                      "Always advise users to consult healthcare providers for personalized medical advice. "
-                      "Be empathetic, clear, and concise."
-        })
-        
-        # Add chat history if available
-        if chat_history and isinstance(chat_history, list):
-            for msg in chat_history[-10:]:  # Use last 10 messages for context
-                role = "user" if msg.get('sender') == 'user' else "assistant"
-                formatted_history.append({
-                    "role": role,
-                    "content": msg.get('text', '')
-                })
-        
-        # Add pregnancy week context if available
-        context = ""
-        if pregnancy_week:
-            context = f"The user is currently in week {pregnancy_week} of pregnancy. "
+        formatted_history = build_pregnancy_messages(user_message, pregnancy_week, chat_history)
         
-        # Add the current user message
-        formatted_history.append({
-            "role": "user",
-            "content": f"{context}{user_message}"
-        })
-
         def generate():
             
             try:
                 print(formatted_history)
                 # Create streaming completion with Groq
-                stream = groq_client.chat.completions.create(
+                stream = llm_gateway.stream_chat_completion(
                     messages=formatted_history,
                     model="llama-3.3-70b-versatile",
                     temperature=0.7,
-                    max_completion_tokens=1024,
-                    stream=True
+                    max_completion_tokens=1024
                 )
                 
                 # Process the stream
@@ -311,12 +312,11 @@ def chat():
                 """Generator function for streaming the response"""
                 try:
                     # Create streaming completion with Groq
-                    stream = groq_client.chat.completions.create(
+                    stream = llm_gateway.stream_chat_completion(
                         messages=messages,
                         model=model,
                         temperature=temperature,
-                        max_completion_tokens=max_completion_tokens,
-                        stream=True  # Enable streaming
+                        max_completion_tokens=max_completion_tokens
                     )
                     
                     # Process the stream
@@ -348,12 +348,11 @@ def chat():
         # Handle non-streaming request
         else:
             # Make non-streaming request to Groq
-            completion = groq_client.chat.completions.create(
+            completion = llm_gateway.chat_completion(
                 messages=messages,
                 model=model,
                 temperature=temperature,
-                max_completion_tokens=max_completion_tokens,
-                stream=False  # Explicitly disable streaming
+                max_completion_tokens=max_completion_tokens
             )
             
             # Return the complete response
@@ -364,18 +363,43 @@ def chat():
         logger.exception("Error in chat response")
         return jsonify({"error": str(e)}), 500
     
+def get_accelerometer_upload():
+    """
+    Get the samples of a fall detection request.
+
+    Devices send either JSON ({deviceId, sampleRate, accelerometerData}) or a
+    binary accelerometer packet (Content-Type application/x-accelerometer, see
+    ai/accelerometer_packets.py), which is much cheaper to decode.
+
+    Returns:
+        Tuple of (device ID or None, samples or None, sample rate in Hz or None,
+        request options). Samples are the JSON 'accelerometerData' or an (N, 3)
+        array; the options are the JSON body, or the query parameters for a
+        binary packet.
+
+    Raises:
+        ValueError: If the binary packet is malformed or the sample rate invalid
+    """
+    if request.mimetype == PACKET_MIMETYPE:
+        packet = decode_packet(request.get_data(cache=False))
+        device_id = packet.device_id or request.args.get('deviceId') or request.headers.get('X-Device-Id')
+        sample_rate = normalize_sample_rate(packet.sample_rate or request.args.get('sampleRate'))
+        return device_id, packet.samples, sample_rate, request.args
+
+    data = request.json
+    device_id = data.get('deviceId') or request.headers.get('X-Device-Id')
+    return device_id, data.get('accelerometerData'), normalize_sample_rate(data.get('sampleRate')), data
+
 @app.route('/api/fall-detection/analyze', methods=['POST'])
 def detect_fall():
     """Analyze accelerometer data to detect falls."""
     try:
-        data = request.json
-        if 'accelerometerData' not in data:
+        _, accelerometer_data, sample_rate, _ = get_accelerometer_upload()
+        if accelerometer_data is None:
             return jsonify({'error': 'No accelerometer data provided'}), 400
-            
-        accelerometer_data = data['accelerometerData']
         
         # Analyze the accelerometer data for fall detection
-        fall_detected, confidence, fall_type = analyze_accelerometer_data(accelerometer_data)
+        fall_detected, confidence, fall_type = analyze_accelerometer_data(accelerometer_data, sample_rate)
         
         return jsonify({
             'success': True,
@@ -383,10 +407,118 @@ def detect_fall():
             'confidence': confidence,
             'fallType': fall_type if fall_detected else None
         })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception("Error analyzing fall detection data")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/fall-detection/stream', methods=['POST'])
+def stream_fall_detection():
+    """
+    Feed a device's newly recorded accelerometer samples to its fall detector.
+
+    Unlike /api/fall-detection/analyze, the client sends each sample only once:
+    the server keeps the recent samples of every device (deviceId, or the
+    X-Device-Id header), so falls that straddle two uploads are detected too.
+    Like /api/fall-detection/analyze, the sample rate is measured from the
+    samples' timestamps when they have one, else taken from sampleRate (or the
+    binary packet); 10 Hz is assumed otherwise.
+    """
+    try:
+        device_id, accelerometer_data, sample_rate, options = get_accelerometer_upload()
+        if not device_id:
+            return jsonify({'error': 'No device ID provided'}), 400
+        if accelerometer_data is None:
+            return jsonify({'error': 'No accelerometer data provided'}), 400
+
+        # Start over, e.g. after the device was reconnected and samples were lost
+        if str(options.get('reset', '')).lower() in ('1', 'true', 'yes'):
+            fall_detectors.discard(device_id)
+
+        result = fall_detectors.update(device_id, accelerometer_data, sample_rate,
+                                       sample_timestamps(accelerometer_data))
+        falls = result['falls']
+        return jsonify({
+            'success': True,
+            'deviceId': device_id,
+            'fallDetected': bool(falls),
+            'confidence': max((fall['confidence'] for fall in falls), default=0),
+            'fallType': falls[-1]['fallType'] if falls else None,
+            'falls': falls,
+            'state': result['state'],
+            'samplesProcessed': result['samplesProcessed']
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error in streaming fall detection")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fall-detection/analyze-batch', methods=['POST'])
+def detect_falls_batch():
+    """
+    Analyze the accelerometer windows of many devices in one request.
+
+    The body is JSON ({devices: [{deviceId, sampleRate, accelerometerData}, ...]})
+    or a batch of binary packets (Content-Type application/x-accelerometer-batch).
+    All windows are evaluated together; results are returned per device, in
+    request order.
+    """
+    try:
+        if request.mimetype == BATCH_MIMETYPE:
+            devices = [(packet.device_id, packet.samples, packet.sample_rate)
+                       for packet in decode_packets(request.get_data(cache=False))]
+        else:
+            data = request.json
+            devices = data.get('devices') if isinstance(data, dict) else None
+            if not isinstance(devices, list):
+                return jsonify({'error': 'No devices provided'}), 400
+            if not all(isinstance(device, dict) for device in devices):
+                return jsonify({'error': 'Each device must be an object'}), 400
+            devices = [(device.get('deviceId'), device.get('accelerometerData'), device.get('sampleRate'))
+                       for device in devices]
+        if len(devices) > FALL_BATCH_MAX_DEVICES:
+            return jsonify({'error': f'At most {FALL_BATCH_MAX_DEVICES} devices per request'}), 400
+
+        # Malformed windows fail alone, like a single /api/fall-detection/analyze request
+        windows, sample_rates, errors = [], [], {}
+        for index, (device_id, accelerometer_data, sample_rate) in enumerate(devices):
+            try:
+                window, sample_rate = resample(to_sample_array(accelerometer_data),
+                                               normalize_sample_rate(sample_rate),
+                                               sample_timestamps(accelerometer_data))
+            except Exception as e:
+                logger.error(f"Invalid accelerometer data for device {device_id}: {str(e)}")
+                errors[index] = str(e)
+                window, sample_rate = to_sample_array([]), DETECTION_RATE
+            windows.append(window)
+            sample_rates.append(sample_rate)
+
+        results = []
+        for index, ((device_id, _, _), (fall_detected, confidence, fall_type)) in enumerate(
+                zip(devices, analyze_batch(windows, sample_rates))):
+            result = {
+                'deviceId': device_id,
+                'fallDetected': fall_detected,
+                'confidence': confidence,
+                'fallType': fall_type if fall_detected else None
+            }
+            if index in errors:
+                result['error'] = errors[index]
+            results.append(result)
+
+        return jsonify({
+            'success': True,
+            'results': results,
+            'fallsDetected': sum(result['fallDetected'] for result in results)
+        })
+    except InvalidPacketError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.exception("Error analyzing fall detection batch")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/medication/info', methods=['GET'])
 def medication_info():
     """Get detailed information about a medication."""
@@ -421,9 +553,51 @@ def medication_info():
 
 # New Diet Endpoints
 
+def event_stream_response(events, label):
+    """
+    Send events (JSON-serializable dicts) to the client as server-sent events.
+    
+    Args:
+        events: Iterator of events
+        label: What is being streamed, for logs
+        
+    Returns:
+        text/event-stream Response ending with "data: [DONE]"
+    """
+    def generate():
+        try:
+            for event in events:
+                yield f"data: {json.dumps(event)}\n\n"
+            
+            # Signal the end of the stream
+            yield "data: [DONE]\n\n"
+            
+        except Exception as e:
+            # Handle errors during streaming
+            error_data = json.dumps({"error": str(e)})
+            yield f"data: {error_data}\n\n"
+            logger.exception(f"Error streaming {label}")
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'  # Disable nginx buffering if using nginx
+        }
+    )
+
+
 @app.route('/api/diet/meal-plan', methods=['POST'])
 def generate_meal_plan():
-    """Generate personalized meal plan for pregnant women using Grok."""
+    """
+    Generate personalized meal plan for pregnant women using Grok.
+    
+    With "stream": true the plan is sent as server-sent events: one
+    {"type": "meal", "section", "meal"} event per meal as soon as it is
+    generated, then {"type": "complete", "data": plan}.
+    """
     try:
         data = request.json
         if not data:
@@ -433,256 +607,11 @@ def generate_meal_plan():
         preferences = data.get('preferences', {})
         pregnancy_week = data.get('pregnancyWeek')
         
-        # Format user preferences for the LLM
-        dietary_restrictions = []
-        if preferences.get('isVegetarian'):
-            dietary_restrictions.append('Vegetarian')
-        if preferences.get('isVegan'):
-            dietary_restrictions.append('Vegan')
-        if preferences.get('isGlutenFree'):
-            dietary_restrictions.append('Gluten-Free')
-        if preferences.get('isDairyFree'):
-            dietary_restrictions.append('Dairy-Free')
-            
-        user_prefs_text = f"""
-            Pregnancy Week: {pregnancy_week or 'Unknown'}
-            Preferred Cuisines: {', '.join(preferences.get('cuisines', [])) or 'No specific preferences'}
-            Allergies: {', '.join(preferences.get('allergies', [])) or 'None'}
-            Health Conditions: {', '.join(preferences.get('healthConditions', [])) or 'None'}
-            Dietary Restrictions: {', '.join(dietary_restrictions) or 'None'}
-            Daily Calorie Goal: {preferences.get('calorieGoal', '2000')} calories
-            Daily Protein Goal: {preferences.get('proteinGoal', '70')} grams
-        """
-
-        # Provide exact JSON structure format in the prompt
-        json_example = """
-        {
-          "breakfast": [
-            {
-              "name": "Recipe Name",
-              "ingredients": ["ingredient 1", "ingredient 2"],
-              "instructions": "Step by step instructions",
-              "calories": 320,
-              "protein": "15g",
-              "carbs": "40g",
-              "fat": "10g",
-              "nutrients": ["nutrient 1", "nutrient 2"],
-              "pregnancyBenefits": "Benefits description"
-            }
-          ],
-          "lunch": [
-            {
-              "name": "Recipe Name",
-              "ingredients": ["ingredient 1", "ingredient 2"],
-              "instructions": "Step by step instructions",
-              "calories": 380,
-              "protein": "22g",
-              "carbs": "45g",
-              "fat": "12g",
-              "nutrients": ["nutrient 1", "nutrient 2"],
-              "pregnancyBenefits": "Benefits description"
-            }
-          ],
-          "dinner": [
-            {
-              "name": "Recipe Name",
-              "ingredients": ["ingredient 1", "ingredient 2"],
-              "instructions": "Step by step instructions",
-              "calories": 450,
-              "protein": "30g",
-              "carbs": "50g",
-              "fat": "15g",
-              "nutrients": ["nutrient 1", "nutrient 2"],
-              "pregnancyBenefits": "Benefits description"
-            }
-          ],
-          "snacks": [
-            {
-              "name": "Recipe Name",
-              "ingredients": ["ingredient 1", "ingredient 2"],
-              "instructions": "Step by step instructions",
-              "calories": 150,
-              "protein": "5g",
-              "carbs": "20g",
-              "fat": "5g",
-              "nutrients": ["nutrient 1", "nutrient 2"],
-              "pregnancyBenefits": "Benefits description"
-            }
-          ]
-        }
-        """
-
-        # Create the prompt for the LLM
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a knowledgeable nutrition expert specializing in prenatal diet. Your task is to create a personalized meal plan that is safe and nutritious for pregnant women, accounting for their specific week of pregnancy, food preferences, allergies, and health conditions. Provide detailed recipes with nutritional information.
-                
-                Your response MUST be valid JSON following the exact structure of the example provided by the user, with no extra text before or after the JSON. Include only one meal for each category (breakfast, lunch, dinner, and two items in snacks)."""
-            },
-            {
-                "role": "user",
-                "content": f"""Please create a one-day meal plan based on these preferences:
-                
-                {user_prefs_text}
-                
-                Return your response as JSON with exactly this structure:
-                
-                {json_example}
-                
-                Follow this structure precisely and include only ONE item in each of the breakfast, lunch, and dinner arrays, and TWO items in the snacks array. Make sure all string values use double quotes, not single quotes, to ensure valid JSON.
-                
-                Make sure to include the "ingredients" as an array of strings, and make each meal nutritious and appropriate for pregnancy.
-                """
-            }
-        ]
-
-        # Make request to Groq
-        completion = groq_client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            max_completion_tokens=1500
-        )
-        
-        # Get the response text
-        llm_response = completion.choices[0].message.content
+        if data.get('stream', False):
+            return event_stream_response(meal_plan_cache.stream(preferences, pregnancy_week), 'meal plan')
         
-        # Try to extract JSON from the response
-        try:
-            # First try to find JSON between code blocks
-            json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', llm_response)
-            if json_match:
-                json_str = json_match.group(1).strip()
-                meal_plan_data = json.loads(json_str)
-            else:
-                # If that fails, try to extract any JSON object
-                json_match = re.search(r'({[\s\S]*})', llm_response)
-                if json_match:
-                    json_str = json_match.group(1).strip()
-                    meal_plan_data = json.loads(json_str)
-                else:
-                    # If all else fails, just try to parse the whole response
-                    meal_plan_data = json.loads(llm_response.strip())
-            
-            # Validate the structure has the expected keys
-            expected_keys = ['breakfast', 'lunch', 'dinner', 'snacks']
-            for key in expected_keys:
-                if key not in meal_plan_data:
-                    meal_plan_data[key] = []
-            
-            # Ensure each section has at least one item with required fields
-            for key in expected_keys:
-                if not meal_plan_data[key] or not isinstance(meal_plan_data[key], list):
-                    meal_plan_data[key] = []
-                
-                # Ensure all meals have the required fields
-                for i, meal in enumerate(meal_plan_data[key]):
-                    if not isinstance(meal, dict):
-                        meal_plan_data[key][i] = {
-                            "name": "Invalid meal",
-                            "ingredients": ["Please try again"],
-                            "instructions": "There was an error generating this meal.",
-                            "calories": 0,
-                            "protein": "0g",
-                            "carbs": "0g",
-                            "fat": "0g",
-                            "nutrients": []
-                        }
-                        continue
-                    
-                    # Ensure required fields exist
-                    required_fields = {
-                        "name": "Recipe",
-                        "ingredients": [],
-                        "instructions": "Instructions not provided",
-                        "calories": 0,
-                        "protein": "0g",
-                        "carbs": "0g",
-                        "fat": "0g",
-                        "nutrients": []
-                    }
-                    
-                    for field, default in required_fields.items():
-                        if field not in meal or meal[field] is None:
-                            meal[field] = default
-                    
-                    # Ensure ingredients is an array
-                    if not isinstance(meal["ingredients"], list):
-                        if isinstance(meal["ingredients"], str):
-                            meal["ingredients"] = [meal["ingredients"]]
-                        else:
-                            meal["ingredients"] = []
-                    
-                    # Ensure nutrients is an array
-                    if not isinstance(meal["nutrients"], list):
-                        if isinstance(meal["nutrients"], str):
-                            meal["nutrients"] = [meal["nutrients"]]
-                        else:
-                            meal["nutrients"] = []
-            
-        except Exception as e:
-            logger.error(f"Error parsing meal plan JSON: {str(e)}\nResponse was: {llm_response}")
-            # Create a default meal plan structure if parsing fails
-            meal_plan_data = {
-                "breakfast": [{
-                    "name": "Simple Oatmeal with Berries",
-                    "ingredients": ["Rolled oats", "Milk", "Mixed berries", "Honey"],
-                    "instructions": "Cook oats with milk, top with berries and honey.",
-                    "calories": 300,
-                    "protein": "10g",
-                    "carbs": "45g",
-                    "fat": "5g",
-                    "nutrients": ["Fiber", "Iron", "B Vitamins"],
-                    "pregnancyBenefits": "Provides steady energy and essential nutrients for pregnancy."
-                }],
-                "lunch": [{
-                    "name": "Spinach and Chickpea Salad",
-                    "ingredients": ["Fresh spinach", "Chickpeas", "Cherry tomatoes", "Olive oil", "Lemon juice"],
-                    "instructions": "Combine ingredients in a bowl and toss with olive oil and lemon juice.",
-                    "calories": 350,
-                    "protein": "15g",
-                    "carbs": "40g",
-                    "fat": "12g",
-                    "nutrients": ["Folate", "Iron", "Protein"],
-                    "pregnancyBenefits": "Rich in folate for neural tube development."
-                }],
-                "dinner": [{
-                    "name": "Baked Salmon with Sweet Potato",
-                    "ingredients": ["Salmon fillet", "Sweet potato", "Broccoli", "Olive oil", "Lemon"],
-                    "instructions": "Bake salmon and sweet potato. Steam broccoli as a side.",
-                    "calories": 420,
-                    "protein": "28g",
-                    "carbs": "35g",
-                    "fat": "18g",
-                    "nutrients": ["Omega-3", "Vitamin A", "Protein"],
-                    "pregnancyBenefits": "Omega-3 fatty acids support brain development."
-                }],
-                "snacks": [
-                    {
-                        "name": "Greek Yogurt with Honey",
-                        "ingredients": ["Greek yogurt", "Honey", "Almonds"],
-                        "instructions": "Top yogurt with honey and chopped almonds.",
-                        "calories": 180,
-                        "protein": "15g",
-                        "carbs": "15g",
-                        "fat": "8g",
-                        "nutrients": ["Calcium", "Protein", "Probiotics"],
-                        "pregnancyBenefits": "Calcium supports bone development."
-                    },
-                    {
-                        "name": "Apple with Nut Butter",
-                        "ingredients": ["Apple", "Almond butter"],
-                        "instructions": "Slice apple and serve with almond butter for dipping.",
-                        "calories": 200,
-                        "protein": "5g",
-                        "carbs": "25g",
-                        "fat": "10g",
-                        "nutrients": ["Fiber", "Vitamin C", "Healthy fats"],
-                        "pregnancyBenefits": "Provides steady energy between meals."
-                    }
-                ]
-            }
+        # Plans are cached per canonicalized preference set (see ai/meal_plans.py)
+        meal_plan_data = meal_plan_cache.get(preferences, pregnancy_week)
         
         # Return the meal plan
         return jsonify({
@@ -699,140 +628,8 @@ def generate_meal_plan():
 def get_nutrition_tips():
     """Get pregnancy-specific nutrition tips based on pregnancy week."""
     try:
-        pregnancy_week = request.args.get('week')
-        
-        # Define expected JSON structure in the prompt
-        json_example = """
-        [
-            {
-                "title": "Tip Title",
-                "content": "Detailed content about the nutrition tip with practical advice."
-            },
-            {
-                "title": "Another Tip Title",
-                "content": "More detailed content about another nutrition aspect."
-            },
-            {
-                "title": "Third Tip Title",
-                "content": "Further detailed content about another important nutrition aspect."
-            }
-        ]
-        """
-        
-        # Create the prompt for the LLM
-        messages = [
-            {
-                "role": "system",
-                "content": """You are a prenatal nutrition expert. Provide concise, evidence-based nutrition tips specifically tailored for pregnant women.
-                
-                Your response MUST be valid JSON following the exact structure of the example provided by the user, with no extra text before or after the JSON. Include exactly three nutrition tips."""
-            },
-            {
-                "role": "user",
-                "content": f"""Provide 3 important nutrition tips for a woman in week {pregnancy_week or 'unknown'} of pregnancy. 
-
-Each tip should:
-1. Have a clear, concise title highlighting the nutrient or concept
-2. Include detailed content (30-80 words) with practical advice
-3. Be evidence-based and specifically relevant to week {pregnancy_week or 'unknown'} of pregnancy
-
-Return your response as JSON with exactly this structure:
-
-{json_example}
-
-Follow this structure precisely. Make sure all string values use double quotes, not single quotes, to ensure valid JSON.
-"""
-            }
-        ]
-
-        # Make request to Groq
-        completion = groq_client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            max_completion_tokens=800
-        )
-        
-        # Get the response text
-        llm_response = completion.choices[0].message.content
-        
-        # Try to extract JSON from the response
-        try:
-            # First try to find JSON between code blocks
-            json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', llm_response)
-            if json_match:
-                json_str = json_match.group(1).strip()
-                tips_data = json.loads(json_str)
-            else:
-                # If that fails, try to extract any JSON array
-                json_match = re.search(r'(\[[\s\S]*?\])', llm_response)
-                if json_match:
-                    json_str = json_match.group(1).strip()
-                    tips_data = json.loads(json_str)
-                else:
-                    # If all else fails, just try to parse the whole response
-                    tips_data = json.loads(llm_response.strip())
-            
-            # Validate that we have an array
-            if not isinstance(tips_data, list):
-                raise ValueError("Response is not a list")
-                
-            # Ensure we have exactly 3 tips
-            while len(tips_data) < 3:
-                # Add default tips if we have fewer than 3
-                default_tips = [
-                    {
-                        "title": "Folate for Brain Development",
-                        "content": "Consuming adequate folate helps prevent neural tube defects. Include leafy greens, fortified cereals, and beans in your diet."
-                    },
-                    {
-                        "title": "Hydration is Key",
-                        "content": "Staying well-hydrated supports amniotic fluid levels and helps prevent common issues like constipation and urinary tract infections."
-                    },
-                    {
-                        "title": "Iron for Oxygen Transport",
-                        "content": "Iron needs increase during pregnancy to support additional blood volume and oxygen transport to your baby."
-                    }
-                ]
-                
-                tips_data.append(default_tips[len(tips_data) % 3])
-                
-            # Trim to exactly 3 tips
-            tips_data = tips_data[:3]
-            
-            # Validate each tip has required fields
-            for i, tip in enumerate(tips_data):
-                if not isinstance(tip, dict) or 'title' not in tip or 'content' not in tip:
-                    # Replace invalid tip with a default one
-                    tips_data[i] = {
-                        "title": f"Nutrition Tip {i+1}",
-                        "content": "Important nutrients during pregnancy include folate, iron, calcium, and omega-3 fatty acids."
-                    }
-                    
-                # Ensure the fields are strings
-                if not isinstance(tip.get('title'), str):
-                    tip['title'] = str(tip.get('title', f"Nutrition Tip {i+1}"))
-                    
-                if not isinstance(tip.get('content'), str):
-                    tip['content'] = str(tip.get('content', "Important nutrients during pregnancy include folate, iron, calcium, and omega-3 fatty acids."))
-                
-        except Exception as e:
-            logger.error(f"Error parsing nutrition tips JSON: {str(e)}\nResponse was: {llm_response}")
-            # Default tips if parsing fails
-            tips_data = [
-                {
-                    "title": "Folate for Brain Development",
-                    "content": "Consuming adequate folate helps prevent neural tube defects. Include leafy greens, fortified cereals, and beans in your diet."
-                },
-                {
-                    "title": "Hydration is Key",
-                    "content": "Staying well-hydrated supports amniotic fluid levels and helps prevent common issues like constipation and urinary tract infections."
-                },
-                {
-                    "title": "Iron for Oxygen Transport",
-                    "content": "Iron needs increase during pregnancy to support additional blood volume and oxygen transport to your baby."
-                }
-            ]
+        # Tips are generated once per week and cached (see ai/nutrition_tips.py)
+        tips_data = nutrition_tips_cache.get(request.args.get('week'))
         
         # Return the tips
         return jsonify({
@@ -852,15 +649,13 @@ def identify_food():
         if 'image' not in request.json:
             return jsonify({'error': 'No image provided'}), 400
             
-        image_base64 = request.json['image']
-        image_path = save_base64_image(image_base64, "food")
-        
-        if not image_path:
-            return jsonify({'error': 'Failed to save image'}), 500
+        image, error_response = get_vision_image("food")
+        if error_response:
+            return error_response
         
         # Use GroqVision class to identify the food
         try:
-            food_data = identify_food_with_vision(image_path)
+            food_data = identify_food_with_vision(image)
         except Exception as e:
             logger.error(f"Error with vision API: {str(e)}")
             # Fallback response
@@ -871,12 +666,6 @@ def identify_food():
                 "nutritionalHighlights": [],
                 "pregnancyBenefits": ""
             }
-            
-        # Clean up the image file
-        try:
-            os.remove(image_path)
-        except:
-            pass
         
         return jsonify({
             'success': True,
@@ -886,20 +675,34 @@ def identify_food():
         logger.exception("Error identifying food item")
         return jsonify({'error': str(e)}), 500
 
-def identify_food_with_vision(image_path: str) -> dict:
+# Bump when the food prompt or output format changes (invalidates cached results)
+FOOD_PROMPT_VERSION = 1
+
+# Structure of food identification results, validated while the LLM response streams
+FOOD_SCHEMA = {
+    'type': 'object',
+    'required': ['name'],
+    'properties': {
+        'nutritionalHighlights': {'type': ['array', 'string']}
+    }
+}
+
+def identify_food_with_vision(image: VisionImage) -> dict:
     """
     Identify food from an image using Groq Vision
     
     Args:
-        image_path: Path to the food image
+        image: Validated food image (see ai.vision_images)
         
     Returns:
         Dict containing identified food information
     """
     try:
-        # Convert image to base64
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        # Re-scans of the same item are answered from the result cache
+        cache_key = vision_result_cache.key('food', FOOD_PROMPT_VERSION, image)
+        cached = vision_result_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
         # Create a structured prompt for food identification
         combined_prompt = """
@@ -923,90 +726,60 @@ def identify_food_with_vision(image_path: str) -> dict:
         Do not include any explanations, descriptions, or analysis outside the JSON structure.
         """
         
-        # Call Groq Vision API
-        response = requests.post(
-            "https://api.groq.com/openai/v1/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {os.getenv('GROQ_API_KEY', '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')}"
-            },
-            json={
-                "model": "meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq vision model
-                "messages": [
+        # Call Groq Vision API; malformed JSON is caught while it streams
+        parsed = True
+        try:
+            content = structured_completion(
+                FOOD_SCHEMA,
+                label='food identification',
+                model="meta-llama/llama-4-scout-17b-16e-instruct",  # Current supported Groq vision model
+                messages=[
                     {
                         "role": "user",
                         "content": [
                             {"type": "text", "text": combined_prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                            {"type": "image_url", "image_url": {"url": image.data_uri}}
                         ]
                     }
                 ],
-                "temperature": 0.2,
-                "max_tokens": 1024
+                temperature=0.2,
+                max_tokens=1024
+            )
+            logger.info(f"Groq vision response: {json.dumps(content)}")
+        except StructuredOutputError as e:
+            logger.error(f"Error parsing food identification JSON: {str(e)}")
+            # Fallback to default structure
+            parsed = False
+            content = {
+                "name": "Apple",
+                "category": "fruit",
+                "shelfLife": "1-2 weeks in refrigerator",
+                "nutritionalHighlights": ["Rich in fiber", "Contains vitamin C", "Good source of antioxidants"],
+                "pregnancyBenefits": "Supports digestion and provides essential vitamins with low glycemic impact"
             }
-        )
         
-        # Parse the response
-        if response.status_code == 200:
-            result = response.json()
-            # Extract content from Groq's response structure
-            content_text = result['choices'][0]['message']['content']
-            
-            logger.info(f"Groq vision response: {content_text}")
-            
-            # Try to extract JSON from the response
-            # First, check if the entire response is valid JSON
-            try:
-                content = json.loads(content_text)
-            except json.JSONDecodeError:
-                # If not, try to extract JSON from the text (in case there's extra text)
-                try:
-                    # Look for JSON pattern
-                    import re
-                    json_pattern = r'({[\s\S]*})'
-                    match = re.search(json_pattern, content_text)
-                    if match:
-                        json_str = match.group(1)
-                        content = json.loads(json_str)
-                    else:
-                        # Fallback to default structure
-                        content = {
-                            "name": "Apple",
-                            "category": "fruit",
-                            "shelfLife": "1-2 weeks in refrigerator",
-                            "nutritionalHighlights": ["Rich in fiber", "Contains vitamin C", "Good source of antioxidants"],
-                            "pregnancyBenefits": "Supports digestion and provides essential vitamins with low glycemic impact"
-                        }
-                except Exception:
-                    content = {
-                        "name": "Apple",
-                        "category": "fruit",
-                        "shelfLife": "1-2 weeks in refrigerator",
-                        "nutritionalHighlights": ["Rich in fiber", "Contains vitamin C", "Good source of antioxidants"],
-                        "pregnancyBenefits": "Supports digestion and provides essential vitamins with low glycemic impact"
-                    }
-            
-            # Ensure proper structure
-            required_fields = ['name', 'category', 'shelfLife', 'nutritionalHighlights', 'pregnancyBenefits']
-            for field in required_fields:
-                if field not in content:
-                    if field == 'nutritionalHighlights':
-                        content[field] = []
-                    else:
-                        content[field] = None
-            
-            # Ensure nutritionalHighlights is an array
-            if not isinstance(content['nutritionalHighlights'], list):
-                if isinstance(content['nutritionalHighlights'], str):
-                    content['nutritionalHighlights'] = [content['nutritionalHighlights']]
+        # Ensure proper structure
+        required_fields = ['name', 'category', 'shelfLife', 'nutritionalHighlights', 'pregnancyBenefits']
+        for field in required_fields:
+            if field not in content:
+                if field == 'nutritionalHighlights':
+                    content[field] = []
                 else:
-                    content['nutritionalHighlights'] = []
-            
-            return content
-        else:
-            logger.error(f"Groq API Error: {response.status_code} - {response.text}")
-            raise Exception(f"Groq API Error: {response.status_code}")
-            
+                    content[field] = None
+        
+        # Ensure nutritionalHighlights is an array
+        if not isinstance(content['nutritionalHighlights'], list):
+            if isinstance(content['nutritionalHighlights'], str):
+                content['nutritionalHighlights'] = [content['nutritionalHighlights']]
+            else:
+                content['nutritionalHighlights'] = []
+        
+        # Only answers the model actually gave are worth reusing
+        if parsed:
+            vision_result_cache.put(cache_key, content)
+        
+        return content
+        
     except Exception as e:
         logger.exception(f"Error identifying food with Llama Vision: {str(e)}")
         # Return default structure if analysis fails
@@ -1124,9 +897,86 @@ def manage_food_inventory():
         return jsonify({'error': str(e)}), 500
 
 
+# Structure of recipe suggestions, validated while the LLM response streams
+RECIPE_SUGGESTIONS_SCHEMA = {
+    'type': 'object',
+    'required': ['recipes'],
+    'properties': {
+        'recipes': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'required': ['name', 'ingredients', 'instructions', 'nutritionalBenefits', 'mealType'],
+                'properties': {
+                    'ingredients': {
+                        'type': 'object',
+                        'required': ['available', 'needed'],
+                        'properties': {
+                            'available': {'type': 'array'},
+                            'needed': {'type': 'array'}
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+# Returned when the LLM response cannot be parsed
+DEFAULT_RECIPE_SUGGESTIONS = {
+    "recipes": [
+        {
+            "name": "Simple Fruit Salad",
+            "ingredients": {
+                "available": ["Apple", "Banana"],
+                "needed": ["Yogurt", "Honey", "Nuts"]
+            },
+            "instructions": "Chop fruits, mix with yogurt, drizzle with honey, and top with nuts.",
+            "nutritionalBenefits": "Rich in vitamins, fiber, and probiotics for digestive health during pregnancy.",
+            "mealType": "snack"
+        }
+    ]
+}
+
+
+def stream_recipe_suggestions(messages):
+    """
+    Yield recipe suggestion events, each recipe as soon as the LLM has finished writing it.
+    
+    Yields:
+        {"type": "recipe", "recipe": ...} per recipe, then {"type": "complete", "data": ...};
+        if the response broke off the final data holds the recipes already sent, or the
+        default suggestions if there were none
+    """
+    recipes = []
+    try:
+        for key, recipe in stream_structured_items(
+                RECIPE_SUGGESTIONS_SCHEMA,
+                label='recipe suggestions',
+                messages=messages,
+                model="llama-3.3-70b-versatile",
+                temperature=0.7,
+                max_completion_tokens=1500):
+            if key == 'recipes':
+                recipes.append(recipe)
+                yield {'type': 'recipe', 'recipe': recipe}
+        recipes_data = {'recipes': recipes}
+    except Exception as e:
+        logger.error(f"Error streaming recipe suggestions: {str(e)}")
+        # Never contradict recipes the client already received
+        recipes_data = {'recipes': recipes} if recipes else copy.deepcopy(DEFAULT_RECIPE_SUGGESTIONS)
+    yield {'type': 'complete', 'data': recipes_data}
+
+
 @app.route('/api/food/recipe-suggestions', methods=['POST'])
 def get_recipe_suggestions():
-    """Generate recipe suggestions based on available ingredients and dietary preferences."""
+    """
+    Generate recipe suggestions based on available ingredients and dietary preferences.
+    
+    With "stream": true the suggestions are sent as server-sent events: one
+    {"type": "recipe", "recipe"} event per recipe as soon as it is generated,
+    then {"type": "complete", "data": suggestions}.
+    """
     try:
         data = request.json
         if not data:
@@ -1204,51 +1054,24 @@ Please suggest 3 recipes that can be made primarily with these ingredients. Foll
             }
         ]
         
-        # Make request to Groq
-        completion = groq_client.chat.completions.create(
-            messages=messages,
-            model="llama-3.3-70b-versatile",
-            temperature=0.7,
-            max_completion_tokens=1500
-        )
-        
-        # Get the response text
-        llm_response = completion.choices[0].message.content
+        if data.get('stream', False):
+            return event_stream_response(stream_recipe_suggestions(messages), 'recipe suggestions')
         
-        # Try to parse the response directly as JSON
+        # Request the recipes; the schema checks required fields while the JSON streams
         try:
-            recipes_data = json.loads(llm_response.strip())
-            
-            # Validate that the response has the expected structure
-            if "recipes" not in recipes_data or not isinstance(recipes_data["recipes"], list):
-                raise ValueError("Response missing 'recipes' array")
-                
-            # Make sure each recipe has the required fields
-            for recipe in recipes_data["recipes"]:
-                if not all(key in recipe for key in ["name", "ingredients", "instructions", "nutritionalBenefits", "mealType"]):
-                    raise ValueError("Recipe missing required fields")
-                
-                # Ensure ingredients has available and needed arrays
-                if not isinstance(recipe["ingredients"], dict) or not all(key in recipe["ingredients"] for key in ["available", "needed"]):
-                    raise ValueError("Recipe ingredients missing 'available' or 'needed' arrays")
+            recipes_data = structured_completion(
+                RECIPE_SUGGESTIONS_SCHEMA,
+                label='recipe suggestions',
+                messages=messages,
+                model="llama-3.3-70b-versatile",
+                temperature=0.7,
+                max_completion_tokens=1500
+            )
             
-        except Exception as e:
-            logger.error(f"Error parsing recipe suggestions JSON: {str(e)}\nResponse was: {llm_response}")
+        except StructuredOutputError as e:
+            logger.error(f"Error parsing recipe suggestions JSON: {str(e)}")
             # Return a default structure if parsing fails
-            recipes_data = {
-                "recipes": [
-                    {
-                        "name": "Simple Fruit Salad",
-                        "ingredients": {
-                            "available": ["Apple", "Banana"],
-                            "needed": ["Yogurt", "Honey", "Nuts"]
-                        },
-                        "instructions": "Chop fruits, mix with yogurt, drizzle with honey, and top with nuts.",
-                        "nutritionalBenefits": "Rich in vitamins, fiber, and probiotics for digestive health during pregnancy.",
-                        "mealType": "snack"
-                    }
-                ]
-            }
+            recipes_data = copy.deepcopy(DEFAULT_RECIPE_SUGGESTIONS)
         
         # Return the recipe suggestions
         return jsonify({
@@ -1414,6 +1237,132 @@ Please suggest 3 recipes that can be made primarily with these ingredients. Foll
 
 
 from ai.AdvancedYogaPoseEstimator import advanced_yoga_pose_estimator
+from ai.pose_stream import PoseStreamSession
+
+
+def get_pose_session_id(data):
+    """
+    Identify the practice session a pose frame belongs to.
+
+    Returns None when the client sends no session ID: such frames are not
+    tracked (no smoothing, motion gating or crop tracking), since the client
+    address may be shared by many users behind one NAT or proxy.
+    """
+    return data.get('sessionId') or request.headers.get('X-Session-Id') or None
+
+
+def get_frame_params():
+    """Read pose parameters for binary frame uploads from query params or headers."""
+    def param(name, header):
+        return request.args.get(name) or request.headers.get(header)
+    
+    return {
+        'poseId': param('poseId', 'X-Pose-Id') or '1-1',  # Default to mountain pose
+        'trimester': param('trimester', 'X-Trimester'),
+        'sessionId': param('sessionId', 'X-Session-Id'),
+        'isFinal': (param('isFinal', 'X-Is-Final') or '').lower() in ('1', 'true', 'yes')
+    }
+
+
+def get_frame_image():
+    """
+    Get the uploaded frame from a raw image body or a multipart 'image' file.
+    
+    Returns:
+        Binary file object (multipart) or bytes (raw body), or None if empty
+    """
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        # The upload is already spooled to a seekable file, hand it straight to the decoder
+        return upload.stream if upload else None
+    
+    image_data = request.get_data(cache=False)
+    return image_data or None
+
+
+def pose_estimation_response(image_data, pose_id, session_id, trimester=None):
+    """Run pose estimation on a decoded frame and build the API response."""
+    # Process start time for performance monitoring
+    start_time = time.time()
+    
+    # Get pose estimation results
+    try:
+        results = advanced_yoga_pose_estimator.estimate_pose(
+            image_data, pose_id, trimester, session_id=session_id)
+        logger.info(f"Pose estimation completed with accuracy: {results['accuracy']:.1f}%")
+        
+        # Calculate processing time
+        processing_time = time.time() - start_time
+        logger.info(f"Total processing time: {processing_time:.3f}s")
+        
+        # Return results
+        return jsonify({
+            'success': True,
+            'data': {
+                'accuracy': results['accuracy'],
+                'keypoints': results['keypoints'],
+                'referenceKeypoints': results['reference_keypoints'],
+                'processingTime': processing_time,
+                'reused': results.get('reused', False),
+                'timestamp': time.time()
+            }
+        })
+    except Exception as e:
+        logger.error(f"Error in pose estimation algorithm: {str(e)}")
+        raise e
+
+
+def pose_estimation_fallback(pose_id, error):
+    """Return a working fallback response when pose estimation fails."""
+    return jsonify({
+        'success': True,
+        'data': {
+            'accuracy': 50.0,  # Default medium accuracy
+            'keypoints': advanced_yoga_pose_estimator._get_dummy_keypoints(),
+            'referenceKeypoints': advanced_yoga_pose_estimator.get_reference_pose(pose_id)['keypoints'],
+            'error': str(error),
+            'timestamp': time.time()
+        }
+    })
+
+
+def posture_feedback_response(image_data, pose_id, is_final, session_id, trimester=None):
+    """Run pose estimation with feedback on a decoded frame and build the API response."""
+    # Get pose estimation with feedback
+    results = advanced_yoga_pose_estimator.estimate_pose_with_feedback(
+        image_data, 
+        pose_id, 
+        is_final,
+        session_id=session_id,
+        trimester=trimester
+    )
+    
+    # The practice session is over, release its tracking state
+    if is_final and session_id:
+        advanced_yoga_pose_estimator.end_session(session_id)
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'feedback': results['feedback'],
+            'accuracy': results['accuracy'],
+            'keypoints': results['keypoints'],
+        }
+    })
+
+
+def posture_feedback_fallback(is_final):
+    """Return a simple fallback feedback when feedback generation fails."""
+    fallback_feedback = "Focus on your breathing and alignment. Keep your movements gentle and listen to your body's signals."
+    if is_final:
+        fallback_feedback += " You've done well with this practice session!"
+    
+    return jsonify({
+        'success': True,
+        'data': {
+            'feedback': fallback_feedback
+        }
+    })
 
 
 @app.route('/api/yoga/pose-estimation', methods=['POST'])
@@ -1427,6 +1376,8 @@ def estimate_yoga_pose():
         # Extract data from request
         image_base64 = request.json['image']
         pose_id = request.json.get('poseId', '1-1')  # Default to mountain pose
+        trimester = request.json.get('trimester')
+        session_id = get_pose_session_id(request.json)
         
         # Log request info (without the full image)
         logger.info(f"Received pose estimation request for poseId: {pose_id}")
@@ -1447,47 +1398,37 @@ def estimate_yoga_pose():
             logger.error(f"Failed to decode base64: {e}")
             return jsonify({'error': 'Invalid image data: ' + str(e)}), 400
         
-        # Process start time for performance monitoring
-        start_time = time.time()
-        
-        # Get pose estimation results
-        try:
-            results = advanced_yoga_pose_estimator.estimate_pose(image_data, pose_id)
-            logger.info(f"Pose estimation completed with accuracy: {results['accuracy']:.1f}%")
-            
-            # Calculate processing time
-            processing_time = time.time() - start_time
-            logger.info(f"Total processing time: {processing_time:.3f}s")
-            
-            # Return results
-            return jsonify({
-                'success': True,
-                'data': {
-                    'accuracy': results['accuracy'],
-                    'keypoints': results['keypoints'],
-                    'referenceKeypoints': results['reference_keypoints'],
-                    'processingTime': processing_time,
-                    'timestamp': time.time()
-                }
-            })
-        except Exception as e:
-            logger.error(f"Error in pose estimation algorithm: {str(e)}")
-            raise e
+        return pose_estimation_response(image_data, pose_id, session_id, trimester)
             
     except Exception as e:
         logger.error(f"Error in pose estimation endpoint: {str(e)}")
         # Return a working fallback even on error
-        return jsonify({
-            'success': True,
-            'data': {
-                'accuracy': 50.0,  # Default medium accuracy
-                'keypoints': advanced_yoga_pose_estimator._get_dummy_keypoints(),
-                'referenceKeypoints': advanced_yoga_pose_estimator.get_reference_pose(
-                    request.json.get('poseId', '1-1'))['keypoints'],
-                'error': str(e),
-                'timestamp': time.time()
-            }
-        })
+        return pose_estimation_fallback(request.json.get('poseId', '1-1'), e)
+
+@app.route('/api/yoga/pose-estimation/frame', methods=['POST'])
+def estimate_yoga_pose_frame():
+    """
+    Estimate yoga pose accuracy from a binary camera frame.
+    
+    Accepts a raw image/jpeg (or image/png) body or a multipart upload with an
+    'image' file, avoiding the base64 JSON overhead. Pose ID, trimester and
+    session come from query params (poseId, trimester, sessionId) or headers
+    (X-Pose-Id, X-Trimester, X-Session-Id). The response matches /api/yoga/pose-estimation.
+    """
+    params = get_frame_params()
+    try:
+        image_data = get_frame_image()
+        if image_data is None:
+            return jsonify({'error': 'No image provided'}), 400
+        
+        logger.info(f"Received binary pose estimation request for poseId: {params['poseId']}")
+        
+        return pose_estimation_response(image_data, params['poseId'],
+                                        get_pose_session_id(params), params['trimester'])
+    
+    except Exception as e:
+        logger.error(f"Error in binary pose estimation endpoint: {str(e)}")
+        return pose_estimation_fallback(params['poseId'], e)
 
 @app.route('/api/yoga/posture-feedback', methods=['POST'])
 def get_yoga_posture_feedback():
@@ -1499,6 +1440,8 @@ def get_yoga_posture_feedback():
         image_base64 = request.json['image']
         pose_id = request.json.get('poseId', '1-1')  # Default to mountain pose
         is_final = request.json.get('isFinal', False)
+        trimester = request.json.get('trimester')
+        session_id = get_pose_session_id(request.json)
         
         # Log the request for debugging
         logger.info(f"Received feedback request for pose ID: {pose_id}, is_final: {is_final}")
@@ -1513,34 +1456,73 @@ def get_yoga_posture_feedback():
             logger.error(f"Base64 decoding error: {e}")
             return jsonify({'error': 'Invalid image data'}), 400
         
-        # Get pose estimation with feedback
-        results = advanced_yoga_pose_estimator.estimate_pose_with_feedback(
-            image_data, 
-            pose_id, 
-            is_final
-        )
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'feedback': results['feedback'],
-                'accuracy': results['accuracy'],
-                'keypoints': results['keypoints'],
-            }
-        })
+        return posture_feedback_response(image_data, pose_id, is_final, session_id, trimester)
     except Exception as e:
         logger.error(f"Error in posture feedback: {str(e)}")
         # Return a simple fallback feedback
-        fallback_feedback = "Focus on your breathing and alignment. Keep your movements gentle and listen to your body's signals."
-        if request.json.get('isFinal', False):
-            fallback_feedback += " You've done well with this practice session!"
+        return posture_feedback_fallback(request.json.get('isFinal', False))
+
+@app.route('/api/yoga/posture-feedback/frame', methods=['POST'])
+def get_yoga_posture_feedback_frame():
+    """
+    Get posture feedback for a binary camera frame.
+    
+    Takes the same body and parameters as /api/yoga/pose-estimation/frame, plus
+    isFinal (or X-Is-Final). The response matches /api/yoga/posture-feedback.
+    """
+    params = get_frame_params()
+    try:
+        image_data = get_frame_image()
+        if image_data is None:
+            return jsonify({'error': 'No image provided'}), 400
         
-        return jsonify({
-            'success': True,
-            'data': {
-                'feedback': fallback_feedback
-            }
-        })
+        logger.info(f"Received binary feedback request for pose ID: {params['poseId']}, "
+                    f"is_final: {params['isFinal']}")
+        
+        return posture_feedback_response(image_data, params['poseId'], params['isFinal'],
+                                         get_pose_session_id(params), params['trimester'])
+    except Exception as e:
+        logger.error(f"Error in binary posture feedback: {str(e)}")
+        return posture_feedback_fallback(params['isFinal'])
+
+if sock is not None:
+    @sock.route('/api/yoga/pose-stream')
+    def yoga_pose_stream(ws):
+        """
+        Stream camera frames over a WebSocket and receive continuous pose results.
+        
+        Send binary JPEG frames; pending frames are dropped when the client
+        outpaces the server. Pose ID and trimester come from query params
+        (or headers, as for the /frame endpoints) and can be changed with a
+        {"type": "config"} message. Smoothing state lives for the connection.
+        See ai/pose_stream.py for the message format.
+        """
+        params = get_frame_params()
+        stream = PoseStreamSession(advanced_yoga_pose_estimator, ws.send,
+                                   params['poseId'], params['trimester'])
+        logger.info(f"Pose stream opened for poseId: {params['poseId']}")
+        try:
+            while not stream.closed:
+                message = ws.receive(timeout=1)
+                if message is None:
+                    if stream.is_idle():
+                        logger.info("Closing idle pose stream")
+                        break
+                    continue
+                
+                if isinstance(message, (bytes, bytearray)):
+                    stream.submit_frame(bytes(message))
+                else:
+                    stream.handle_control(message)
+        except ConnectionClosed:
+            pass
+        except Exception as e:
+            logger.error(f"Error in pose stream: {str(e)}")
+        finally:
+            stream.close()
+            logger.info("Pose stream closed")
+else:
+    logger.warning("flask-sock is not installed, WebSocket pose streaming is disabled")
 
 @app.route('/api/yoga/reference-pose/<pose_id>', methods=['GET'])
 def get_reference_pose(pose_id):
@@ -1564,8 +1546,26 @@ def get_reference_pose(pose_id):
                 'keypoints': advanced_yoga_pose_estimator._get_dummy_keypoints()
             }
         })
-    
-RECORDS_PATH = '/Users/j0s0yz3/Downloads/iota/MEDAI/iota_medai/iota/server/medicine_records.json'
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Runtime performance metrics for the AI services."""
+    try:
+        return jsonify({
+            'pose_inference': advanced_yoga_pose_estimator.inference_metrics(),
+            'vision_images': vision_image_stats.snapshot(),
+            'vision_result_cache': vision_result_cache.stats(),
+            'llm_gateway': llm_gateway.stats(),
+            'nutrition_tips': nutrition_tips_cache.stats(),
+            'meal_plans': meal_plan_cache.stats(),
+            'fall_detection': fall_detectors.stats(),
+            'structured_output': structured_output_stats.snapshot()
+        })
+    except Exception as e:
+        logger.error(f"Error collecting metrics: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+RECORDS_PATH ='/Users/j0s0yz3/Downloads/iota/MEDAI/iota_medai/iota/server/medicine_records.json'
 @app.route('/api/verify-medicine-blockchain', methods=['POST'])
 def verify_medicine():
     try:
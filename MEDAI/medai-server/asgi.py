@@ -0,0 +1,386 @@
+#/asgi.py
+"""
+asgi.py - asyncio serving mode for the LLM-bound routes
+
+Run with an ASGI server instead of gunicorn's sync workers, e.g.:
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5001 --workers 2
+
+The chat routes that only wait on Groq (/api/chat and the streaming
+/api/chatbot/pregnancy) are served natively on the event loop through
+AsyncLLMGateway, so thousands of open SSE streams multiplex on a few worker
+processes. Every other request is handed to the Flask app in app.py on a
+thread pool:
+
+- 'llm':  Flask routes that call the LLM (diet, recipes, food and medicine
+          vision, OCR); ASGI_LLM_THREADS threads
+- 'pose': the CPU-bound yoga pose routes; ASGI_POSE_THREADS threads, so
+          slow LLM calls never queue pose frames and vice versa
+- 'default': everything else; ASGI_DEFAULT_THREADS threads
+
+Each route prefix has a concurrency limit (ASGI_ROUTE_LIMITS, e.g.
+"/api/chat=2000,/api/diet/meal-plan=64"); requests that wait longer than
+ASGI_QUEUE_TIMEOUT seconds for a slot get a 503. WebSocket pose streaming
+(/api/yoga/pose-stream) needs flask-sock and stays on the WSGI server.
+"""
+
+import os
+import sys
+import json
+import asyncio
+import logging
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app import app as flask_app, build_pregnancy_messages
+from ai.llm_gateway import async_llm_gateway
+
+logger = logging.getLogger(__name__)
+
+ASGI_LLM_THREADS = int(os.environ.get('ASGI_LLM_THREADS', 64))
+ASGI_POSE_THREADS = int(os.environ.get('ASGI_POSE_THREADS', os.cpu_count() or 4))
+ASGI_DEFAULT_THREADS = int(os.environ.get('ASGI_DEFAULT_THREADS', 16))
+ASGI_QUEUE_TIMEOUT = float(os.environ.get('ASGI_QUEUE_TIMEOUT', 10.0))  # seconds to wait for a route slot
+ASGI_MAX_BODY = 16 * 1024 * 1024  # Same limit as Flask's MAX_CONTENT_LENGTH
+
+DEFAULT_ROUTE_LIMITS = {
+    '/api/chat': 2000,
+    '/api/chatbot/pregnancy': 2000,
+    '/api/diet/meal-plan': 64,
+    '/api/diet/nutrition-tips': 64,
+    '/api/food/recipe-suggestions': 64,
+    '/api/food/identify': 32,
+    '/api/ocr': 32,
+    '/api/yoga': 64
+}
+
+# Route prefix -> thread pool for requests handled by Flask
+EXECUTOR_ROUTES = [
+    ('/api/yoga', 'pose'),
+    ('/api/diet', 'llm'),
+    ('/api/food', 'llm'),
+    ('/api/ocr', 'llm'),
+    ('/api/chat', 'llm'),
+    ('/api/chatbot', 'llm')
+]
+
+CORS_HEADERS = [(b'access-control-allow-origin', b'*')]
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no')  # Disable nginx buffering if using nginx
+]
+
+
+def parse_route_limits(spec: str) -> Dict[str, int]:
+    """Parse "prefix=limit,prefix=limit" into a dict."""
+    limits = {}
+    for item in spec.split(','):
+        if '=' in item:
+            prefix, limit = item.split('=', 1)
+            limits[prefix.strip()] = int(limit)
+    return limits
+
+
+class RouteLimiter:
+    """Per-route-prefix concurrency limits; the longest matching prefix applies."""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = limits
+        self._slots = {prefix: asyncio.Semaphore(limit) for prefix, limit in limits.items()}
+        self._counts = {prefix: {'active': 0, 'rejected': 0} for prefix in limits}
+
+    def prefix_for(self, path: str) -> Optional[str]:
+        matches = [prefix for prefix in self.limits if path == prefix or path.startswith(prefix + '/')]
+        return max(matches, key=len) if matches else None
+
+    async def acquire(self, prefix: Optional[str]) -> bool:
+        """Wait for a slot; False if none frees up within ASGI_QUEUE_TIMEOUT."""
+        if prefix is None:
+            return True
+        try:
+            await asyncio.wait_for(self._slots[prefix].acquire(), timeout=ASGI_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._counts[prefix]['rejected'] += 1
+            return False
+        self._counts[prefix]['active'] += 1
+        return True
+
+    def release(self, prefix: Optional[str]):
+        if prefix is not None:
+            self._counts[prefix]['active'] -= 1
+            self._slots[prefix].release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {prefix: {'limit': self.limits[prefix], **counts} for prefix, counts in self._counts.items()}
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need."""
+
+    def __init__(self, scope: Dict[str, Any], body: bytes):
+        self.scope = scope
+        self.body = body
+        self.method = scope['method']
+        self.path = scope['path']
+
+    def json(self) -> Any:
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+
+async def read_body(receive: Callable) -> Optional[bytes]:
+    """Read the whole request body; None if it exceeds ASGI_MAX_BODY."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASGI_MAX_BODY:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+async def send_json(send: Callable, status: int, payload: Any):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                   + CORS_HEADERS
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def watch_disconnect(receive: Callable) -> None:
+    """Return once the client has disconnected."""
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def send_sse(send: Callable, receive: Callable, events: AsyncIterator[str], label: str):
+    """Send "data:" lines as a text/event-stream response, ending with [DONE]."""
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS + CORS_HEADERS})
+    disconnected = asyncio.ensure_future(watch_disconnect(receive))
+    try:
+        try:
+            async for data in events:
+                if disconnected.done():
+                    return
+                await send({'type': 'http.response.body', 'body': f"data: {data}\n\n".encode('utf-8'),
+                            'more_body': True})
+            # Signal the end of the stream
+            await send({'type': 'http.response.body', 'body': b"data: [DONE]\n\n", 'more_body': True})
+        except Exception as e:
+            # Handle errors during streaming
+            logger.exception(f"Error in streaming {label}")
+            error_data = json.dumps({"error": str(e)})
+            await send({'type': 'http.response.body', 'body': f"data: {error_data}\n\n".encode('utf-8'),
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnected.cancel()
+        await events.aclose()
+
+
+async def completion_chunks(**kwargs) -> AsyncIterator[str]:
+    """Streamed completion chunks as JSON, like the Flask SSE routes send them."""
+    chunks = async_llm_gateway.stream_chat_completion(**kwargs)
+    try:
+        async for chunk in chunks:
+            yield json.dumps(chunk.model_dump())
+    finally:
+        # Leaves a coalesced stream, so it stops once no client reads it
+        await chunks.aclose()
+
+
+async def chat(request: Request, send: Callable, receive: Callable) -> bool:
+    """POST /api/chat: general purpose chat, streaming or not."""
+    data = request.json()
+    if not data or 'messages' not in data or not isinstance(data['messages'], list):
+        await send_json(send, 400, {"error": "Invalid messages format"})
+        return True
+
+    kwargs = dict(
+        messages=data['messages'],
+        model=data.get('model', "llama-3.3-70b-versatile"),
+        temperature=data.get('temperature', 0.7),
+        max_completion_tokens=data.get('max_completion_tokens', 1024)
+    )
+    if data.get('stream', False):
+        await send_sse(send, receive, completion_chunks(**kwargs), 'chat response')
+        return True
+
+    try:
+        completion = await async_llm_gateway.chat_completion(**kwargs)
+    except Exception as e:
+        logger.exception("Error in chat response")
+        await send_json(send, 500, {"error": str(e)})
+        return True
+    await send_json(send, 200, completion.model_dump())
+    return True
+
+
+async def pregnancy_chat(request: Request, send: Callable, receive: Callable) -> bool:
+    """POST /api/chatbot/pregnancy with "stream": true; the template answers stay in Flask."""
+    data = request.json()
+    if not data or 'message' not in data or not data.get('stream', False):
+        return False
+
+    messages = build_pregnancy_messages(data['message'], data.get('week'), data.get('history', []))
+    await send_sse(send, receive, completion_chunks(
+        messages=messages,
+        model="llama-3.3-70b-versatile",
+        temperature=0.7,
+        max_completion_tokens=1024
+    ), 'response')
+    return True
+
+
+# (method, path) -> async handler; a handler returns False to pass the request on to Flask
+ASYNC_ROUTES = {
+    ('POST', '/api/chat'): chat,
+    ('POST', '/api/chatbot/pregnancy'): pregnancy_chat
+}
+
+
+class FlaskBridge:
+    """Runs WSGI requests on thread pools chosen by route, streaming the response body."""
+
+    def __init__(self, wsgi_app: Callable, executors: Dict[str, ThreadPoolExecutor],
+                 routes: List[Tuple[str, str]]):
+        self.wsgi_app = wsgi_app
+        self.executors = executors
+        self.routes = routes
+
+    def executor_for(self, path: str) -> ThreadPoolExecutor:
+        for prefix, name in self.routes:
+            if path == prefix or path.startswith(prefix + '/'):
+                return self.executors[name]
+        return self.executors['default']
+
+    @staticmethod
+    def environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False
+        }
+        for name, value in scope.get('headers', []):
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f"HTTP_{name}"
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    async def __call__(self, scope: Dict[str, Any], body: bytes, send: Callable, receive: Callable):
+        loop = asyncio.get_running_loop()
+        executor = self.executor_for(scope['path'])
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                         for name, value in headers]
+
+        def next_chunk(iterator):
+            return next(iterator, None)
+
+        result = await loop.run_in_executor(executor, self.wsgi_app, self.environ(scope, body), start_response)
+        disconnected = asyncio.ensure_future(watch_disconnect(receive))
+        try:
+            iterator = iter(result)
+            # start_response may be deferred until the first chunk (generators)
+            chunk = await loop.run_in_executor(executor, next_chunk, iterator)
+            await send({'type': 'http.response.start', 'status': response_start['status'],
+                        'headers': response_start['headers']})
+            while chunk is not None and not disconnected.done():
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = await loop.run_in_executor(executor, next_chunk, iterator)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            close = getattr(result, 'close', None)
+            if close is not None:
+                await loop.run_in_executor(executor, close)
+
+
+class Application:
+    """ASGI application: async LLM routes, everything else through Flask."""
+
+    def __init__(self):
+        self.limiter = RouteLimiter({**DEFAULT_ROUTE_LIMITS,
+                                     **parse_route_limits(os.environ.get('ASGI_ROUTE_LIMITS', ''))})
+        self.flask = FlaskBridge(flask_app, {
+            'llm': ThreadPoolExecutor(ASGI_LLM_THREADS, thread_name_prefix='asgi-llm'),
+            'pose': ThreadPoolExecutor(ASGI_POSE_THREADS, thread_name_prefix='asgi-pose'),
+            'default': ThreadPoolExecutor(ASGI_DEFAULT_THREADS, thread_name_prefix='asgi-default')
+        }, EXECUTOR_ROUTES)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            # WebSocket routes are served by the WSGI deployment (flask-sock)
+            if scope['type'] == 'websocket':
+                await send({'type': 'websocket.close', 'code': 1003})
+            return
+
+        body = await read_body(receive)
+        if body is None:
+            await send_json(send, 413, {'error': 'Request body too large'})
+            return
+
+        if scope['path'] == '/api/metrics/asgi':
+            await send_json(send, 200, {
+                'routes': self.limiter.stats(),
+                'async_llm_gateway': async_llm_gateway.stats()
+            })
+            return
+
+        prefix = self.limiter.prefix_for(scope['path'])
+        if not await self.limiter.acquire(prefix):
+            await send_json(send, 503, {'error': 'Server busy, please retry'})
+            return
+        try:
+            handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+            if handler is None or not await handler(Request(scope, body), send, receive):
+                await self.flask(scope, body, send, receive)
+        finally:
+            self.limiter.release(prefix)
+
+
+application = Application()
@@ -0,0 +1,134 @@
+"""
+Fall detection: batch analysis and the fall detection endpoints.
+"""
+
+import numpy as np
+import pytest
+
+from ai.fall_detection import (AXES, analyze_accelerometer_data, analyze_batch, analyze_samples, resample,
+                               to_sample_array)
+from ai.fall_monitor import FallDetectorStore
+
+# Upright, a free fall, a hard impact, then lying still (10 Hz)
+FALL = np.array([[0.0, 0.0, 1.0]] * 5 + [[0.05, 0.05, 0.1]] * 6 + [[3.5, 1.0, 0.5]]
+                + [[1.0, 0.0, 0.1]] * 12, dtype=np.float32)
+STILL = np.array([[0.0, 0.0, 1.0]] * 20, dtype=np.float32)
+
+
+def as_json(samples, timestamps=None):
+    """Samples as the app sends them; timestamps in ms become expo-sensors' seconds."""
+    data = [dict(zip(AXES, sample)) for sample in samples.tolist()]
+    if timestamps is not None:
+        for sample, timestamp in zip(data, (timestamps / 1000).tolist()):
+            sample['timestamp'] = timestamp
+    return data
+
+
+def random_trace(rng, length, fall=FALL):
+    samples = rng.normal([0.0, 0.0, 1.0], 0.05, (length, 3)).astype(np.float32)
+    start = int(rng.integers(0, length - len(fall)))
+    samples[start:start + len(fall)] = fall
+    return samples
+
+
+def jittered_timestamps(rng, length, period_ms, jitter_ms):
+    """Timestamps (ms) of samples taken every period_ms, each off by up to jitter_ms."""
+    return np.sort(np.arange(length) * period_ms + rng.uniform(-jitter_ms, jitter_ms, length)) + 1.7e12
+
+
+def stream(store, samples, timestamps, rng, device_id='watch'):
+    """Feed samples to the store in random upload sizes; return the falls reported."""
+    falls, start = [], 0
+    while start < len(samples):
+        end = start + int(rng.integers(1, 30))
+        falls += store.update(device_id, samples[start:end], None, timestamps[start:end])['falls']
+        start = end
+    return falls
+
+
+@pytest.fixture(scope='module')
+def client():
+    from app import app
+    return app.test_client()
+
+
+def test_batch_skips_empty_windows():
+    empty = to_sample_array([])
+    results = analyze_batch([empty, FALL, empty, STILL], [10.0, 10.0, 5.0, 10.0])
+
+    assert results[0] == results[2] == (False, 0, "unknown")
+    assert results[1] == analyze_samples(FALL)
+    assert results[1][0]
+    assert results[3] == (False, 0, "unknown")
+    assert analyze_batch([empty, empty]) == [(False, 0, "unknown")] * 2
+
+
+def test_batch_endpoint_empty_window(client):
+    response = client.post('/api/fall-detection/analyze-batch', json={'devices': [
+        {'deviceId': 'a', 'accelerometerData': []},
+        {'deviceId': 'b', 'accelerometerData': as_json(FALL)}
+    ]})
+
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['fallDetected'] for result in results] == [False, True]
+    assert 'error' not in results[0]
+
+
+@pytest.mark.parametrize('body', [
+    {'devices': ['a']},
+    {'devices': [{'deviceId': 'a', 'accelerometerData': []}, None]},
+    {'devices': 'a'},
+    ['a']
+])
+def test_batch_endpoint_rejects_malformed_devices(client, body):
+    response = client.post('/api/fall-detection/analyze-batch', json=body)
+
+    assert response.status_code == 400
+
+
+def test_jittered_10hz_timestamps_match_fixed_windows():
+    # The app's 10 Hz stream measures anywhere around 10 Hz; it must be
+    # analyzed exactly like before timestamps were used (fixed 10 Hz windows)
+    rng = np.random.default_rng(0)
+    for _ in range(300):
+        samples = random_trace(rng, int(rng.integers(30, 80)))
+        timestamps = jittered_timestamps(rng, len(samples), rng.uniform(88, 112), 15)
+        data = as_json(samples, timestamps)
+
+        assert analyze_accelerometer_data(data) == analyze_samples(to_sample_array(data))
+
+
+def test_stream_matches_analysis_with_timestamps():
+    rng = np.random.default_rng(1)
+    for period_ms, jitter_ms in [(100, 15), (20, 4)]:
+        for _ in range(50):
+            # Hold each 10 Hz sample for the length of its 100 ms bin
+            repeat = 100 // period_ms
+            samples = np.repeat(random_trace(rng, int(rng.integers(60, 120))), repeat, axis=0)
+            samples += rng.normal(0, 0.02, samples.shape).astype(np.float32)
+            timestamps = jittered_timestamps(rng, len(samples), period_ms, jitter_ms)
+            expected = analyze_samples(*resample(samples, None, timestamps))
+
+            falls = stream(FallDetectorStore(), samples, timestamps, rng)
+            assert expected[0] and falls
+            assert (falls[0]['confidence'], falls[0]['fallType']) == expected[1:]
+
+
+def test_stream_endpoint_uses_timestamps(client):
+    rng = np.random.default_rng(2)
+    # A 50 Hz device that sends timestamps but no sampleRate
+    samples = np.repeat(random_trace(rng, 60), 5, axis=0)
+    timestamps = jittered_timestamps(rng, len(samples), 20, 4)
+    data = as_json(samples, timestamps)
+
+    falls = []
+    for start in range(0, len(data), 50):
+        response = client.post('/api/fall-detection/stream',
+                               json={'deviceId': 'timestamped', 'accelerometerData': data[start:start + 50]})
+        assert response.status_code == 200
+        falls += response.get_json()['falls']
+
+    analyzed = client.post('/api/fall-detection/analyze', json={'accelerometerData': data}).get_json()
+    assert analyzed['fallDetected'] and falls
+    assert (falls[0]['confidence'], falls[0]['fallType']) == (analyzed['confidence'], analyzed['fallType'])
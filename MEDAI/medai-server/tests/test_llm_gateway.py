@@ -0,0 +1,127 @@
+"""
+Request coalescing in the asyncio LLM gateway, against a fake Groq client.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from ai.llm_gateway import AsyncLLMGateway, CircuitBreaker
+
+PROMPT = dict(model='llama-3.3-70b-versatile', messages=[{'role': 'user', 'content': 'hi'}])
+
+
+class FakeStream:
+    def __init__(self, chunks, delay):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCompletions:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self.streams = []
+
+    async def create(self, timeout=None, stream=False, **kwargs):
+        self.calls += 1
+        if stream:
+            self.streams.append(FakeStream([f'chunk-{i}' for i in range(5)], self.delay / 5))
+            return self.streams[-1]
+        await asyncio.sleep(self.delay)
+        return SimpleNamespace(call=self.calls)
+
+
+def make_gateway(coalesce=True):
+    gateway = AsyncLLMGateway(api_key='test', breaker=CircuitBreaker(), coalesce=coalesce)
+    completions = FakeCompletions()
+    gateway._client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return gateway, completions
+
+
+async def read(chunks, delay=0.0):
+    await asyncio.sleep(delay)
+    return [chunk async for chunk in chunks]
+
+
+def test_identical_completions_share_one_call():
+    async def main():
+        gateway, completions = make_gateway()
+        results = await asyncio.gather(*[gateway.chat_completion(**PROMPT) for _ in range(5)])
+        other = await gateway.chat_completion(**dict(PROMPT, temperature=0.2))
+        return gateway, completions, results, other
+
+    gateway, completions, results, other = asyncio.run(main())
+    assert completions.calls == 2
+    assert all(result is results[0] for result in results)
+    assert other is not results[0]
+    assert gateway.stats()['coalesced'] == 4
+
+
+def test_coalescing_can_be_bypassed():
+    async def main():
+        gateway, completions = make_gateway()
+        await asyncio.gather(gateway.chat_completion(**PROMPT), gateway.chat_completion(coalesce=False, **PROMPT))
+        disabled, disabled_completions = make_gateway(coalesce=False)
+        await asyncio.gather(*[disabled.chat_completion(**PROMPT) for _ in range(3)])
+        return completions.calls, disabled_completions.calls
+
+    assert asyncio.run(main()) == (2, 3)
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def main():
+        gateway, completions = make_gateway()
+        first = asyncio.ensure_future(gateway.chat_completion(**PROMPT))
+        second = asyncio.ensure_future(gateway.chat_completion(**PROMPT))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return completions, await second
+
+    completions, result = asyncio.run(main())
+    assert completions.calls == 1
+    assert result.call == 1
+
+
+def test_identical_streams_share_one_upstream_stream():
+    async def main():
+        gateway, completions = make_gateway()
+        # The late subscriber joins after some chunks were sent and still gets all of them
+        subscriptions = [gateway.stream_chat_completion(**PROMPT) for _ in range(3)]
+        await asyncio.sleep(0.025)
+        subscriptions.append(gateway.stream_chat_completion(**PROMPT))
+        results = await asyncio.gather(*[read(chunks) for chunks in subscriptions])
+        return gateway, completions, results
+
+    gateway, completions, results = asyncio.run(main())
+    assert completions.calls == 1
+    assert completions.streams[0].closed
+    assert all(result == [f'chunk-{i}' for i in range(5)] for result in results)
+    assert gateway.stats()['coalesced_streams'] == 3
+
+
+def test_stream_stops_when_every_subscriber_leaves():
+    async def main():
+        gateway, completions = make_gateway()
+        chunks = gateway.stream_chat_completion(**PROMPT)
+        assert await chunks.__anext__() == 'chunk-0'
+        await chunks.aclose()
+        await asyncio.sleep(0.05)
+        # A new identical call starts a fresh upstream stream
+        await read(gateway.stream_chat_completion(**PROMPT))
+        return completions
+
+    completions = asyncio.run(main())
+    assert completions.calls == 2
+    assert completions.streams[0].closed
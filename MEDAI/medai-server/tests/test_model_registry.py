@@ -0,0 +1,50 @@
+"""
+Status reporting and idempotent fetches of the local model registry.
+"""
+
+import os
+
+import pytest
+
+from ai import model_registry
+from ai.model_registry import fetch_movenet, model_status, movenet_dir, write_manifest
+
+pytest.importorskip('tensorflow_hub')
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(model_registry, 'MODELS_DIR', str(tmp_path))
+    monkeypatch.setattr(model_registry, '_verified', set())
+    return tmp_path
+
+
+def install(version='4'):
+    path = movenet_dir('thunder', version)
+    os.makedirs(os.path.join(path, 'saved_model'))
+    with open(os.path.join(path, 'saved_model', 'saved_model.pb'), 'wb') as f:
+        f.write(b'graph')
+    write_manifest(path, 'movenet-thunder', version)
+    return path
+
+
+def test_status_reports_missing_and_corrupt_models(registry):
+    status = model_status('thunder')
+    assert not status['installed'] and 'not installed' in status['error']
+
+    path = install()
+    assert model_status('thunder')['installed']
+
+    with open(os.path.join(path, 'saved_model', 'saved_model.pb'), 'wb') as f:
+        f.write(b'tampered')
+    model_registry._verified.clear()
+    status = model_status('thunder')
+    assert not status['installed'] and 'checksum mismatch' in status['error']
+
+
+def test_fetch_keeps_a_verified_install(registry):
+    path = install()
+
+    assert fetch_movenet('thunder').path == path
+    with pytest.raises(FileExistsError):
+        fetch_movenet('thunder', tflite=True)
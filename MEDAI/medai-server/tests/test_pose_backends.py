@@ -0,0 +1,109 @@
+"""
+Accuracy parity of the TFLite pose backends against the TF reference backend.
+
+The fixture images in tests/fixtures/pose are run through every backend and
+the keypoints compared with parity_report. The MoveNet check needs the model
+registry populated (python -m ai.model_registry fetch thunder --tflite) and
+is skipped otherwise; the stand-in model check always runs, so the
+conversion, quantization and interpreter setup are covered without the
+MoveNet weights.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from ai.model_registry import MOVENET_SOURCES, TFLITE_VARIANTS, resolve_movenet
+from ai.pose_backends import (TFLITE_BACKENDS, TFBackend, TFLiteBackend, _load_fixture_images,
+                              create_backend, parity_report)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'pose')
+VARIANT = 'thunder'
+INPUT_SIZE = MOVENET_SOURCES[VARIANT]['input_size']
+
+# Largest mean keypoint error (normalized coordinates) and smallest PCK allowed
+MAX_MEAN_ERROR = 0.02
+MIN_PCK = 0.95
+
+
+@pytest.fixture(scope='module')
+def fixtures():
+    images = _load_fixture_images(FIXTURES_DIR, INPUT_SIZE)
+    assert images, f"No fixture images in {FIXTURES_DIR}"
+    return np.stack(images)
+
+
+class StandInMoveNet(tf.Module):
+    """Tiny model with MoveNet's signature: int32 (1, H, W, 3) image -> (1, 1, 17, 3) keypoints."""
+
+    def __init__(self):
+        super().__init__()
+        rng = np.random.default_rng(0)
+        cells = (INPUT_SIZE // 32) ** 2 * 3
+        self.weights = tf.Variable(rng.normal(0, 4 / np.sqrt(cells), (cells, 51)).astype(np.float32))
+        self.bias = tf.Variable(rng.normal(0, 0.5, 51).astype(np.float32))
+
+    @tf.function(input_signature=[tf.TensorSpec([1, INPUT_SIZE, INPUT_SIZE, 3], tf.int32)])
+    def serve(self, image):
+        pooled = tf.nn.avg_pool2d(tf.cast(image, tf.float32) / 255.0 - 0.5, 32, 32, 'VALID')
+        keypoints = tf.sigmoid(tf.matmul(tf.reshape(pooled, [1, -1]), self.weights) + self.bias)
+        return {'output_0': tf.reshape(keypoints, [1, 1, 17, 3])}
+
+
+@pytest.fixture(scope='module')
+def stand_in(tmp_path_factory):
+    """Saved stand-in model and its TFLite conversions, by quantization."""
+    path = str(tmp_path_factory.mktemp('movenet'))
+    module = StandInMoveNet()
+    tf.saved_model.save(module, path, signatures={'serving_default': module.serve})
+
+    tflite_paths = {}
+    for quantization, (_, filename) in TFLITE_VARIANTS.items():
+        converter = tf.lite.TFLiteConverter.from_saved_model(path)
+        if quantization == 'float16':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantization == 'int8':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        tflite_paths[quantization] = os.path.join(path, filename)
+        with open(tflite_paths[quantization], 'wb') as f:
+            f.write(converter.convert())
+    return tf.saved_model.load(path), tflite_paths
+
+
+def assert_parity(reference, keypoints):
+    report = parity_report(reference, keypoints)
+    assert report['compared_keypoints'] > 0
+    assert report['mean_error'] <= MAX_MEAN_ERROR, report
+    assert report['pck'] >= MIN_PCK, report
+
+
+@pytest.mark.parametrize('backend', sorted(TFLITE_BACKENDS))
+def test_stand_in_tflite_parity(fixtures, stand_in, backend):
+    model, tflite_paths = stand_in
+    reference = TFBackend(VARIANT, model=model).infer_batch(fixtures)
+    candidate = TFLiteBackend(tflite_paths[TFLITE_BACKENDS[backend]], INPUT_SIZE, num_threads=2, name=backend)
+
+    assert_parity(reference, np.stack([candidate.infer(image) for image in fixtures]))
+
+
+def test_stand_in_xnnpack_matches_reference_kernels(fixtures, stand_in):
+    _, tflite_paths = stand_in
+    xnnpack = TFLiteBackend(tflite_paths['float32'], INPUT_SIZE, num_threads=2, xnnpack=True)
+    reference_kernels = TFLiteBackend(tflite_paths['float32'], INPUT_SIZE, num_threads=1, xnnpack=False)
+
+    np.testing.assert_allclose(xnnpack.infer_batch(fixtures), reference_kernels.infer_batch(fixtures), atol=1e-4)
+
+
+@pytest.mark.parametrize('backend', sorted(TFLITE_BACKENDS))
+def test_movenet_tflite_parity(fixtures, backend):
+    fmt = TFLITE_VARIANTS[TFLITE_BACKENDS[backend]][0]
+    if resolve_movenet(VARIANT, fmt='saved_model') is None or resolve_movenet(VARIANT, fmt=fmt) is None:
+        pytest.skip(f"MoveNet {VARIANT} SavedModel or {fmt} artifact not in the model registry")
+    reference = create_backend('tf', VARIANT)
+
+    assert_parity(np.stack([reference.infer(image) for image in fixtures]),
+                  np.stack([create_backend(backend, VARIANT, num_threads=2).infer(image) for image in fixtures]))
@@ -0,0 +1,63 @@
+"""
+Near-duplicate lookups in the vision result stores against a brute-force scan.
+"""
+
+import random
+
+import pytest
+
+from ai.result_cache import (MAX_INDEXED_DISTANCE, MemoryResultStore, SQLiteResultStore, VisionResultCache,
+                             hamming_distance)
+
+NAMESPACE = 'food:v1'
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def make(max_size):
+        if request.param == 'memory':
+            return MemoryResultStore(max_size=max_size)
+        return SQLiteResultStore(str(tmp_path / 'vision_results.sqlite3'), max_size=max_size)
+    return make
+
+
+def nearby(rng, image_hash, max_bits):
+    for _ in range(rng.randint(0, max_bits)):
+        image_hash ^= 1 << rng.randrange(64)
+    return image_hash
+
+
+def test_band_index_finds_the_nearest_image(make_store):
+    rng = random.Random(0)
+    store = make_store(max_size=5000)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    for image_hash in hashes:
+        store.put(NAMESPACE, image_hash, str(image_hash))
+    store.put('medicine:v1', hashes[0] ^ 1, 'other task')
+
+    for _ in range(500):
+        query = nearby(rng, rng.choice(hashes), MAX_INDEXED_DISTANCE + 2)
+        distance = min(hamming_distance(image_hash, query) for image_hash in hashes)
+        found = store.get(NAMESPACE, query, MAX_INDEXED_DISTANCE)
+        if distance <= MAX_INDEXED_DISTANCE:
+            assert found is not None and found[0] == distance
+            assert hamming_distance(int(found[1]), query) == distance
+        else:
+            assert found is None
+    assert store.get('medicine:v1', hashes[0], 0) is None
+
+
+def test_evicted_images_leave_the_band_index(make_store):
+    rng = random.Random(1)
+    store = make_store(max_size=10)
+    hashes = [rng.getrandbits(64) for _ in range(100)]
+    for image_hash in hashes:
+        store.put(NAMESPACE, image_hash, str(image_hash))
+
+    assert len(store) == 10
+    assert all(store.get(NAMESPACE, image_hash ^ 1, 1) is None for image_hash in hashes[:90])
+    assert all(store.get(NAMESPACE, image_hash ^ 1, 1) == (1, str(image_hash)) for image_hash in hashes[90:])
+
+
+def test_max_distance_is_capped_to_the_band_index():
+    assert VisionResultCache(MemoryResultStore(), max_distance=12).max_distance == MAX_INDEXED_DISTANCE
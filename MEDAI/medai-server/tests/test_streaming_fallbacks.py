@@ -0,0 +1,47 @@
+"""
+Streamed recipe suggestions and meal plans when the LLM response breaks off.
+"""
+
+import pytest
+
+import app as app_module
+from ai import meal_plans
+from ai.meal_plans import DEFAULT_MEAL_PLAN, MealPlanCache
+
+MEAL = {'name': 'Oatmeal'}
+RECIPE = {'name': 'Lentil soup'}
+
+
+def breaks_off(*items):
+    """Stand-in LLM stream yielding items, then failing."""
+    def stream(*args, **kwargs):
+        yield from items
+        raise RuntimeError('connection reset')
+    return stream
+
+
+@pytest.mark.parametrize('sent', [[], [('breakfast', MEAL)]])
+def test_meal_plan_complete_matches_sent_meals(monkeypatch, sent):
+    monkeypatch.setattr(meal_plans, 'stream_meal_plan', breaks_off(*sent))
+    cache = MealPlanCache()
+    events = list(cache.stream({}, 20))
+
+    complete = events[-1]['data']
+    if sent:
+        assert [event['meal'] for event in events[:-1]] == complete['breakfast'] == [MEAL]
+    else:
+        assert complete == DEFAULT_MEAL_PLAN
+    # Neither a partial nor a default plan is cached
+    assert cache.stats()['entries'] == 0
+
+
+@pytest.mark.parametrize('sent', [[], [('recipes', RECIPE)]])
+def test_recipe_suggestions_complete_matches_sent_recipes(monkeypatch, sent):
+    monkeypatch.setattr(app_module, 'stream_structured_items', breaks_off(*sent))
+    events = list(app_module.stream_recipe_suggestions([]))
+
+    complete = events[-1]['data']
+    if sent:
+        assert complete == {'recipes': [RECIPE]}
+    else:
+        assert complete == app_module.DEFAULT_RECIPE_SUGGESTIONS